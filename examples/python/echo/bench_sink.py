@@ -0,0 +1,51 @@
+#
+## Microbenchmark - per event cost of the echo function printing every event to a pipe (line buffered, a write per
+## event as to the watchdog, which forwards the lines to the function log) compared with sink mode counting the events
+## and writing a summary per interval
+##
+## Usage: python bench_sink.py [number of events, default 50000]
+#
+import sys, os, io, json, threading, time, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'handler'))
+import echo
+from echosink import Sink
+
+def events(count):
+    start = time.time() - 1
+    return [json.dumps({'id': f'id-{key}', 'source': 'https://vcenter/sdk', 'specversion': '1.0',
+                        'type': 'com.vmware.event.router/event', 'subject': 'VmPoweredOnEvent',
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(start + key / 1000)) + '.123456789Z',
+                        'data': {'Key': key, 'Vm': {'Name': 'Test VM', 'Vm': {'Type': 'VirtualMachine', 'Value': 'vm-33'}}}})
+            for key in range(count)]
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    reqs = events(count)
+    stdout = sys.stdout
+    read, write = os.pipe()
+    forwarded = []
+    drain = threading.Thread(target=lambda: [forwarded.append(len(data)) for data in iter(lambda: os.read(read, 1 << 16), b'')],
+                             daemon=True)
+    drain.start()
+    with open(write, 'w', buffering=1) as pipe:
+        sys.stdout = pipe
+        try:
+            printed = timeit.timeit(lambda: [echo.handle(req) for req in reqs], number=1)
+        finally:
+            sys.stdout = stdout
+    drain.join()
+    os.close(read)
+    summaries = io.StringIO()
+    echo.SINK = Sink(interval=1, out=summaries)
+    try:
+        sunk = timeit.timeit(lambda: [echo.handle(req) for req in reqs], number=1)
+    finally:
+        echo.SINK = None
+    print(f'{count} events')
+    print(f'print     {printed / count * 1e6:8.2f} us/event  {sum(forwarded):>10} bytes to the log')
+    print(f'sink      {sunk / count * 1e6:8.2f} us/event  {len(summaries.getvalue()):>10} bytes to the log'
+          f' ({len(summaries.getvalue().splitlines())} summary lines)')
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,31 @@
 # Original function contribution by Michael Gasch https://github.com/embano1/of-echo/
+import os, atexit
+
+try:
+    from .echosink import Sink
+    from .vebatch import batched
+except ImportError:
+    from echosink import Sink
+    from vebatch import batched
+
+# sink_mode: the events are counted instead of printed, a summary is printed every sink_interval seconds (see echosink.py)
+SINK_MODE = os.getenv("sink_mode", "false").lower() in ("1", "true", "yes")
+SINK = None
+if SINK_MODE:
+    SINK = Sink(interval=float(os.getenv("sink_interval", "10")), window=int(os.getenv("sink_window", "100000")))
+    atexit.register(SINK.flush)
+
+@batched()
 def handle(req):
     """handle a request to the function
     Args:
         req (str): request body
     """
 
+    if SINK is not None:
+        SINK.record(req)
+        return "ok"
+
     print(req)
 
     return "ok"
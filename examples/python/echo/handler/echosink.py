@@ -0,0 +1,190 @@
+#
+## Sink mode of the echo function: instead of printing every event, the events are counted by subject, the delivery
+## lag from the CloudEvent time to the receipt is kept in a histogram and repeated or missing events are detected.
+## Every interval one summary line is written to stdout, eg. to size the event router and the gateway for the event
+## rate of a vCenter
+##     {"sink": {"seconds": 10.0, "events": 5230, "per_second": 523.0, "subjects": {"VmPoweredOnEvent": 2615, ...},
+##               "lag_ms": {"min": 3.1, "p50": 13.5, "p90": 32.0, "p99": 76.1, "max": 90.2}, "duplicates": 0,
+##               "skipped": 0, "late": 0, "missing": 0, "invalid": 0}}
+#
+import bisect, calendar, sys, threading, time
+from collections import OrderedDict
+
+try:
+    from .vecevent import DecodeError, dumps, loads
+except ImportError:
+    from vecevent import DecodeError, dumps, loads
+
+# upper bounds in ms, 4 buckets per doubling from 0.1ms to about 47 minutes: quantiles are off by at most 19%
+BOUNDS = tuple(0.1 * 2 ** (i / 4) for i in range(100))
+QUANTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))
+
+EPOCHS = {} # 'YYYY-MM-DDTHH:MM:SS' -> seconds since the epoch, events of the same second share the conversion
+
+def parsetime(value):
+    """
+    Arguments:
+        value {str} -- RFC 3339 time of a CloudEvent, eg. 2020-02-23T22:29:28.911840208Z
+
+    Returns:
+        float -- seconds since the epoch, None if value is not such a time
+    """
+    if not isinstance(value, str) or len(value) < 20:
+        return None
+    second = value[:19]
+    seconds = EPOCHS.get(second)
+    if seconds is None:
+        try:
+            seconds = calendar.timegm(time.strptime(second, '%Y-%m-%dT%H:%M:%S'))
+        except ValueError:
+            return None
+        if len(EPOCHS) >= 4096:
+            EPOCHS.clear()
+        EPOCHS[second] = seconds
+    if value[19] == '.' and value[-1] in 'Zz' and value[20:-1].isdigit():
+        return seconds + float(value[19:-1]) #the times of the event router
+    rest = value[19:]
+    if rest[0] == '.':
+        digits = len(rest) - len(rest[1:].lstrip('0123456789'))
+        if digits > 1:
+            seconds += float(rest[:digits])
+        rest = rest[digits:]
+    if rest in ('Z', 'z'):
+        return seconds
+    if len(rest) == 6 and rest[0] in '+-' and rest[3] == ':' and rest[1:3].isdigit() and rest[4:].isdigit():
+        offset = int(rest[1:3]) * 3600 + int(rest[4:]) * 60
+        return seconds - offset if rest[0] == '+' else seconds + offset
+    return None
+
+class LagHistogram:
+    """streaming histogram of the delivery lag, quantiles are the upper bound of their bucket"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.min = self.max = None
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(BOUNDS, ms)] += 1 #lag below 0 (clocks apart) lands in the first bucket
+        self.count += 1
+        if self.min is None or ms < self.min:
+            self.min = ms
+        if self.max is None or ms > self.max:
+            self.max = ms
+
+    def quantile(self, q):
+        rank, seen = q * self.count, 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(BOUNDS[bucket], self.max) if bucket < len(BOUNDS) else self.max
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return None
+        summary = {'min': round(self.min, 1)}
+        summary.update((name, round(self.quantile(q), 1)) for name, q in QUANTILES)
+        summary['max'] = round(self.max, 1)
+        return summary
+
+class Sink:
+    """
+    Sink records the events of the function and writes a summary line every interval, see the top of this file
+    """
+
+    def __init__(self, interval=10, window=100000, out=None, clock=time.time):
+        """
+        Arguments:
+            interval {float} -- seconds between summaries, a summary is written with the first event after it passed
+            window {int} -- ids and keys remembered to detect duplicates, and missing keys remembered per source
+            out {file} -- where the summaries go, stdout by default
+            clock {function} -- time of receipt in seconds since the epoch
+        """
+        self.interval = interval
+        self.window = max(1, window)
+        self.out = out
+        self.clock = clock
+        self.recent = OrderedDict() # CloudEvent ids and (source, data.Key) of the last events
+        self.sources = {} # source -> [highest data.Key, keys below it not received yet]
+        self.lock = threading.Lock()
+        self.reset(clock())
+
+    def reset(self, now):
+        self.started = now
+        self.events = self.duplicates = self.skipped = self.late = self.invalid = 0
+        self.subjects = {}
+        self.lag = LagHistogram()
+
+    def record(self, req):
+        """counts the event of the request body req"""
+        received = self.clock()
+        try:
+            event = loads(req) #only 5 fields are read, the event is not decoded into a VCEvent
+            data = event.get('data') or {}
+            key = data.get('Key')
+        except (DecodeError, AttributeError, TypeError):
+            event = None #not a CloudEvent
+        with self.lock:
+            if event is None:
+                self.invalid += 1
+            else:
+                self.count(event.get('id'), event.get('source'), event.get('subject'), key, received,
+                           parsetime(event.get('time')))
+            line = self.summary(received) if received - self.started >= self.interval else None
+        if line is not None:
+            self.write(line)
+
+    def count(self, id, source, subject, key, received, sent):
+        self.events += 1
+        self.subjects[subject] = self.subjects.get(subject, 0) + 1
+        if sent is not None:
+            self.lag.observe((received - sent) * 1000)
+        recent = self.recent
+        mark = (source, key) if key is not None else None
+        if id in recent or mark in recent:
+            self.duplicates += 1 #eg. redelivered by the router after a restart, with a new id but the same key
+            return
+        if id is not None:
+            recent[id] = None
+        if mark is not None:
+            recent[mark] = None
+        while len(recent) > 2 * self.window:
+            recent.popitem(last=False)
+        if type(key) is not int:
+            return
+        # data.Key counts up per vCenter, keys between the highest key and the next one are missing until they arrive
+        sequence = self.sources.get(source)
+        if sequence is None:
+            self.sources[source] = [key, set()]
+        elif key > sequence[0]:
+            highest, missing = sequence
+            self.skipped += key - highest - 1
+            if key - highest > 1 and len(missing) + key - highest - 1 <= self.window:
+                missing.update(range(highest + 1, key))
+            sequence[0] = key
+        else:
+            sequence[1].discard(key)
+            self.late += 1
+
+    def summary(self, now):
+        """the summary line of the events since the last one, the counters start again"""
+        seconds = max(now - self.started, 1e-9)
+        summary = {'seconds': round(seconds, 3), 'events': self.events, 'per_second': round(self.events / seconds, 1),
+                   'subjects': self.subjects, 'lag_ms': self.lag.summary(), 'duplicates': self.duplicates,
+                   'skipped': self.skipped, 'late': self.late,
+                   'missing': sum(len(missing) for _, missing in self.sources.values()), 'invalid': self.invalid}
+        self.reset(now)
+        return dumps({'sink': summary})
+
+    def flush(self):
+        """writes the summary of the events since the last one, eg. when the process ends"""
+        with self.lock:
+            line = self.summary(self.clock()) if self.events or self.invalid else None
+        if line is not None:
+            self.write(line)
+
+    def write(self, line):
+        out = self.out or sys.stdout
+        out.write(line + '\n')
+        out.flush()
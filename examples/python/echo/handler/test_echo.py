@@ -0,0 +1,82 @@
+import sys, importlib.util, io, json, os, unittest
+from unittest import mock
+
+sys.modules.pop('handler', None)
+import echo
+from echosink import Sink, parsetime
+
+def event(key, id=None, subject='VmPoweredOnEvent', time='2020-02-23T22:29:28.911840208Z', source='https://vcenter/sdk'):
+    return json.dumps({'id': id or f'id-{key}', 'source': source, 'specversion': '1.0', 'type': 'com.vmware.event.router/event',
+                       'subject': subject, 'time': time, 'data': {'Key': key, 'Vm': None}})
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class SinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = parsetime('2020-02-23T22:29:28.911840208Z')
+        self.clock = Clock(self.sent)
+        self.out = io.StringIO()
+        self.sink = Sink(interval=10, window=100, out=self.out, clock=self.clock)
+
+    def summaries(self):
+        return [json.loads(line)['sink'] for line in self.out.getvalue().splitlines()]
+
+    def test_parsetime(self):
+        self.assertAlmostEqual(self.sent, 1582496968.911840208, places=6)
+        self.assertEqual(parsetime('2020-02-23T22:29:28Z'), 1582496968)
+        self.assertEqual(parsetime('2020-02-23T23:29:28.5+01:00'), 1582496968.5)
+        self.assertIsNone(parsetime('yesterday'))
+        self.assertIsNone(parsetime(None))
+
+    def test_summary_every_interval(self):
+        for key in range(1, 4):
+            self.clock.now = self.sent + 0.010 * key
+            self.sink.record(event(key, subject='VmPoweredOffEvent' if key == 3 else 'VmPoweredOnEvent'))
+        self.assertEqual(self.out.getvalue(), '')
+        self.clock.now = self.sent + 10
+        self.sink.record('not json')
+        summary, = self.summaries()
+        self.assertEqual(summary['events'], 3)
+        self.assertEqual(summary['invalid'], 1)
+        self.assertEqual(summary['subjects'], {'VmPoweredOnEvent': 2, 'VmPoweredOffEvent': 1})
+        self.assertEqual(summary['lag_ms']['min'], 10.0)
+        self.assertEqual(summary['lag_ms']['max'], 30.0)
+        self.assertLessEqual(summary['lag_ms']['p50'], 20.0 * 1.19)
+        self.sink.flush()
+        self.assertEqual(len(self.summaries()), 1) #nothing since the last summary
+
+    def test_duplicates_gaps_and_late_events(self):
+        for key in (10, 11, 14, 12):
+            self.sink.record(event(key))
+        self.sink.record(event(11)) #same id
+        self.sink.record(event(14, id='redelivered')) #same key
+        self.sink.flush()
+        summary, = self.summaries()
+        self.assertEqual(summary['events'], 6)
+        self.assertEqual(summary['duplicates'], 2)
+        self.assertEqual((summary['skipped'], summary['late'], summary['missing']), (2, 1, 1))
+
+    def test_handler_sink_mode(self):
+        sink = Sink(interval=3600, out=io.StringIO())
+        with mock.patch.object(echo, 'SINK', sink), mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            self.assertEqual(echo.handle(event(1)), 'ok')
+            self.assertEqual(echo.handle(event(2) + '\n' + event(3)), 'ok\nok')
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertEqual(sink.events, 3)
+
+    def test_sink_mode_parsed(self):
+        for value, enabled in (('true', True), ('1', True), ('false', False), ('0', False), ('', False)):
+            with mock.patch.dict(os.environ, {'sink_mode': value}), mock.patch('atexit.register'):
+                spec = importlib.util.spec_from_file_location('echo_sink_mode', echo.__file__)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+            self.assertEqual(module.SINK is not None, enabled, value)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,74 +1,257 @@
 import os
+import re
 import ssl
 import sys
-import json
 import atexit
-import gzip, zlib
-from pyVim import connect
-from pyVmomi import vim
-
-
-def get_vm_hosts(content, regex_esxi=None):
-    host_view = content.viewManager.CreateContainerView(content.rootFolder,
-                                                        [vim.HostSystem],
-                                                        True)
-    obj = [host for host in host_view.view]
-    match_obj = []
-    if regex_esxi:
-        for esxi in obj:
-            if re.findall(r'%s.*' % regex_esxi, esxi.name):
-                match_obj.append(esxi)
-        match_obj_name = [match_esxi.name for match_esxi in match_obj]
-        host_view.Destroy()
-        return match_obj
-    else:
-        host_view.Destroy()
-        return obj
+import contextlib
+import functools
+import threading
+from collections import deque
 
+try:
+    from .inventory import retrieve_host_vnics, retrieve_single_host_vnics, mtu_violations
+    from .remediate import Limiter, Remediation
+    from .sipool import ServiceInstancePool
+    from .vebatch import batched
+    from .vecevent import DecodeError, decode, dumps
+    from .velazy import lazy, preload
+    from .vetiming import Timings
+    from .watcher import Watcher
+except ImportError:
+    from inventory import retrieve_host_vnics, retrieve_single_host_vnics, mtu_violations
+    from remediate import Limiter, Remediation
+    from sipool import ServiceInstancePool
+    from vebatch import batched
+    from vecevent import DecodeError, decode, dumps
+    from velazy import lazy, preload
+    from vetiming import Timings
+    from watcher import Watcher
 
-def handle(req):
-    sslContext = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
-    sslContext.verify_mode = ssl.CERT_NONE
+# pyVmomi takes long to import, it is imported on first use (see velazy.py)
+connect = lazy('pyVim.connect')
+vim = lazy('pyVmomi', 'vim')
+
+MIN_MTU = 1500
+# remediation settings, hosts updated at the same time per vCenter and per cluster
+DRY_RUN = os.getenv("dry_run", "false").lower() in ("1", "true", "yes")
+MAX_PARALLEL = int(os.getenv("max_parallel", "8"))
+MAX_PARALLEL_PER_CLUSTER = int(os.getenv("max_parallel_per_cluster", "2"))
+HOST_TIMEOUT = float(os.getenv("host_timeout", "60"))
+# slots shared by the requests and the watcher of the process
+LIMITER = Limiter(MAX_PARALLEL, MAX_PARALLEL_PER_CLUSTER)
+# event: only the host of the event is checked, requests without a host (scheduled reconcile) scan all hosts
+# full: every request scans all hosts
+SCAN_MODE = os.getenv("scan_mode", "event").lower()
+# hosts with a name not matching the pattern are left alone
+HOST_FILTER = re.compile(os.environ["host_filter"]) if os.getenv("host_filter") else None
+# watch (warm-process mode only): a background thread keeps a PropertyFilter on the vnics of all hosts and fixes a
+# host as soon as vCenter reports its MTU below MIN_MTU (see watcher.py), requests return the state of the watcher
+WATCH_MODE = os.getenv("watch_mode", "false").lower() in ("1", "true", "yes")
+WATCH_WAIT = int(os.getenv("watch_wait", "30"))
+WATCH_RETRY = float(os.getenv("watch_retry", "10"))
+# of-watchdog templates (mode=http) keep the process running between events, the vCenter
+# sessions are then reused instead of logging in for every event
+WARM_PROCESS = bool(os.getenv("warm_process")) or os.getenv("mode") == "http"
+POOL = ServiceInstancePool(max_sessions=int(os.getenv("max_sessions", "2")),
+                           check_interval=float(os.getenv("session_check_interval", "30")))
+if WARM_PROCESS:
+    atexit.register(POOL.close_all)
+    preload(connect, vim)
+TIMINGS = Timings("esx-mtu-fixer", WARM_PROCESS)
+VC_USER = "/var/openfaas/secrets/vc-user"
+VC_PASSWORD = "/var/openfaas/secrets/vc-password"
+VC_HOST = "/var/openfaas/secrets/vc-host"
 
-    service_instance = None
-    
-    vcenter_host = None
-    vcenter_user = None
-    vcenter_pass = None
 
-    with open("/var/openfaas/secrets/vc-user","r") as vc_user:
+def credentials():
+    """
+    vCenter host, user and password from the function secrets
+    """
+    with open(VC_HOST,"r") as vc_host:
+        vcenter_host = vc_host.read()
+
+    with open(VC_USER,"r") as vc_user:
         vcenter_user = vc_user.read()
 
-    with open("/var/openfaas/secrets/vc-password","r") as vc_pass:
+    with open(VC_PASSWORD,"r") as vc_pass:
         vcenter_pass = vc_pass.read()
 
-    with open("/var/openfaas/secrets/vc-host","r") as vc_host:
-        vcenter_host = vc_host.read()
+    return vcenter_host, vcenter_user, vcenter_pass
+
 
+def unverified_context():
+    sslContext = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+    sslContext.verify_mode = ssl.CERT_NONE
+    return sslContext
+
+
+def remediation(vcenter):
+    return Remediation(MIN_MTU,
+                       timeout=HOST_TIMEOUT,
+                       dry_run=DRY_RUN,
+                       limiter=LIMITER,
+                       vcenter=vcenter)
+
+
+def request_scope(req):
+    """
+    Hosts a request is about: "all" for a reconcile (an empty body, e.g. a scheduled invocation, or
+    any request with scan_mode full), the managed object id of the host referenced by the CloudEvent
+    (data.Host.Host.Value), None for an event without one
+
+    Raises:
+        DecodeError -- the request is neither empty nor a CloudEvent
+    """
+    if not req.strip():
+        return "all"
+    host = decode(req).host
+    if SCAN_MODE == "full":
+        return "all"
+    return host.value if host is not None and host.value else None
+
+
+@contextlib.contextmanager
+def batchscope():
+    """
+    The vCenter sessions are kept for a batch of events (see vebatch.py), as in warm-process mode
+    """
+    global WARM_PROCESS
+    warm, WARM_PROCESS = WARM_PROCESS, True
     try:
-        service_instance = connect.SmartConnect(host=vcenter_host,
-                                        user=vcenter_user,
-                                        pwd=vcenter_pass,
+        yield
+    finally:
+        WARM_PROCESS = warm
+        if not warm:
+            POOL.close_all()
+
+
+class WatchLoop(object):
+    """
+    WatchLoop runs the Watcher in a background thread, a lost session is replaced and the index is built again
+    from the first update of the new filter. The last changes are kept for the state returned by handle()
+    """
+
+    def __init__(self, max_changes=100):
+        self.stop = threading.Event()
+        self.changes = deque(maxlen=max_changes)
+        self.watcher = None
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name="watcher", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stop.is_set():
+            service_instance = None
+            try:
+                vcenter_host, vcenter_user, vcenter_pass = credentials()
+                service_instance = POOL.get(vcenter_host, vcenter_user, vcenter_pass,
+                                            port=443,
+                                            sslContext=unverified_context())
+                self.watcher = Watcher(service_instance.content, functools.partial(remediation, vcenter_host),
+                                       MIN_MTU, HOST_FILTER, WATCH_WAIT)
+                self.watcher.start()
+                self.error = None
+                while not self.stop.is_set():
+                    self.changes.extend(self.watcher.check())
+            except vim.fault.NotAuthenticated:
+                POOL.invalidate(service_instance)
+            except Exception as e:
+                self.error = getattr(e, "msg", None) or str(e)
+                sys.stderr.write("watcher failed, retrying in %ss: %s\n" % (WATCH_RETRY, self.error))
+                self.stop.wait(WATCH_RETRY)
+            finally:
+                if self.watcher is not None:
+                    self.watcher.close()
+
+    def state(self):
+        watcher = self.watcher
+        return {"scope": "watch", "dry_run": DRY_RUN,
+                "hosts": len(watcher.index) if watcher is not None else 0,
+                "version": watcher.version if watcher is not None else None,
+                "error": self.error, "changes": list(self.changes)}
+
+
+WATCH = None
+WATCH_LOCK = threading.Lock()
+
+
+def watching():
+    """
+    The WatchLoop of the process, started with the first request
+    """
+    global WATCH
+    with WATCH_LOCK:
+        if WATCH is None:
+            WATCH = WatchLoop().start()
+            atexit.register(WATCH.stop.set)
+        return WATCH
+
+
+@batched(batchscope)
+@TIMINGS.timed
+def handle(req):
+    if WATCH_MODE and WARM_PROCESS:
+        return dumps(watching().state())
+
+    with TIMINGS.stage("decode"):
+        try:
+            scope = request_scope(req)
+        except DecodeError as err:
+            return dumps({"status": "400", "message": "Invalid JSON > DecodeError: {0}".format(err)})
+    if scope is None:
+        # only an empty body or scan_mode full scan all hosts, an event without a host has nothing to check
+        return dumps({"scope": None, "dry_run": DRY_RUN, "changes": []})
+
+    sslContext = unverified_context()
+
+    service_instance = None
+
+    with TIMINGS.stage("config"):
+        vcenter_host, vcenter_user, vcenter_pass = credentials()
+
+    with TIMINGS.stage("auth"):
+        try:
+            service_instance = POOL.get(vcenter_host, vcenter_user, vcenter_pass,
                                         port=443,
                                         sslContext=sslContext)
-        atexit.register(connect.Disconnect, service_instance)
-    except IOError as e:
-        sys.stderr.write(str(e))
+        except IOError as e:
+            sys.stderr.write(str(e))
 
     if not service_instance:
         sys.stderr.write(str("Unable to connect to host with supplied info."))
-        
-    esx_hosts = get_vm_hosts(service_instance.content)
-    
-    changes = "Changed hosts:\n"
+        return "Unable to connect to host with supplied info."
+
+    try:
+        try:
+            res = fix_mtu(service_instance, scope, vcenter_host)
+        except vim.fault.NotAuthenticated:
+            # the session expired or was terminated in vCenter since it was last checked
+            POOL.invalidate(service_instance)
+            with TIMINGS.stage("auth"):
+                service_instance = POOL.get(vcenter_host, vcenter_user, vcenter_pass,
+                                            port=443,
+                                            sslContext=sslContext)
+            res = fix_mtu(service_instance, scope, vcenter_host)
+    finally:
+        if not WARM_PROCESS:
+            POOL.close_all()
+
+    return dumps(res)
+
 
-    new_vnic = vim.host.VirtualNic.Specification()
-    new_vnic.mtu = 1500
+def fix_mtu(service_instance, scope, vcenter):
+    # name and vnics are fetched with one (paged) property collector call,
+    # the MTU check is done locally on the result
+    with TIMINGS.stage("inventory"):
+        if scope == "all":
+            esx_hosts = retrieve_host_vnics(service_instance.content, name_filter=HOST_FILTER)
+        else:
+            esx_hosts = retrieve_single_host_vnics(service_instance.content, scope, HOST_FILTER)
 
-    for host in esx_hosts:
-        for vnic in host.configManager.networkSystem.networkInfo.vnic:
-            if vnic.spec.mtu < 1500:
-                changes = changes + "host IP: " + host.name + "\nold mtu: " + str(vnic.spec.mtu) + "\nnew mtu: 1500\n"
-                host.configManager.networkSystem.UpdateVirtualNic(vnic.device,new_vnic)   
+    with TIMINGS.stage("remediate"):
+        changes = remediation(vcenter).run(mtu_violations(esx_hosts, MIN_MTU))
 
-    return changes
+    return {"scope": scope, "dry_run": DRY_RUN, "changes": changes}
@@ -0,0 +1,138 @@
+try:
+    from .velazy import lazy
+except ImportError:
+    from velazy import lazy
+
+vim = lazy('pyVmomi', 'vim')
+vmodl = lazy('pyVmomi', 'vmodl')
+
+# properties fetched for every host, config.network.vnic is the same data as
+# configManager.networkSystem.networkInfo.vnic without dereferencing the network system,
+# parent is the cluster (or standalone compute resource) of the host
+HOST_PROPERTIES = ['name', 'config.network.vnic', 'configManager.networkSystem', 'parent']
+
+
+class HostVnics(object):
+    """
+    Name, VMkernel adapters, network system and cluster id of a host as returned by the property collector
+    """
+    __slots__ = ('host', 'name', 'vnics', 'network_system', 'cluster')
+
+    def __init__(self, host, name, vnics, network_system, cluster=None):
+        self.host = host
+        self.name = name
+        self.vnics = vnics
+        self.network_system = network_system
+        self.cluster = cluster
+
+
+def host_filter_spec(container):
+    """
+    FilterSpec selecting the HostSystem properties of every host in a ContainerView
+    """
+    traverse_view = vmodl.query.PropertyCollector.TraversalSpec(name='traverseView',
+                                                                path='view',
+                                                                skip=False,
+                                                                type=vim.view.ContainerView)
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=container,
+                                                        skip=True,
+                                                        selectSet=[traverse_view])
+    prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.HostSystem,
+                                                           pathSet=HOST_PROPERTIES,
+                                                           all=False)
+    return vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec],
+                                                    propSet=[prop_spec])
+
+
+def single_host_filter_spec(host):
+    """
+    FilterSpec selecting the HostSystem properties of one host, no view or traversal needed
+    """
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=host, skip=False)
+    prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.HostSystem,
+                                                           pathSet=HOST_PROPERTIES,
+                                                           all=False)
+    return vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec],
+                                                    propSet=[prop_spec])
+
+
+def to_host_vnics(obj_content):
+    props = dict((prop.name, prop.val) for prop in obj_content.propSet)
+    parent = props.get('parent')
+    return HostVnics(obj_content.obj,
+                     props.get('name'),
+                     props.get('config.network.vnic') or [],
+                     props.get('configManager.networkSystem'),
+                     parent._moId if parent is not None else None)
+
+
+def retrieve_host_vnics(content, page_size=500, name_filter=None):
+    """
+    Fetches name and vnics of all hosts with RetrievePropertiesEx, one round-trip per
+    page_size hosts instead of several per host
+
+    Arguments:
+        content {vim.ServiceInstanceContent} -- content of the connected ServiceInstance
+        page_size {int} -- hosts returned per RetrievePropertiesEx/ContinueRetrievePropertiesEx call
+        name_filter {re.Pattern} -- only hosts with a name matching the compiled pattern are returned
+
+    Returns:
+        list -- HostVnics for every host
+    """
+    container = content.viewManager.CreateContainerView(content.rootFolder,
+                                                        [vim.HostSystem],
+                                                        True)
+    collector = content.propertyCollector
+    hosts = []
+    try:
+        options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=page_size)
+        result = collector.RetrievePropertiesEx([host_filter_spec(container)], options)
+        while result:
+            hosts.extend(to_host_vnics(obj) for obj in result.objects)
+            if not result.token:
+                break
+            result = collector.ContinueRetrievePropertiesEx(result.token)
+    finally:
+        container.Destroy()
+    return filter_hosts(hosts, name_filter)
+
+
+def retrieve_single_host_vnics(content, host_id, name_filter=None):
+    """
+    Fetches name and vnics of the host with the managed object id host_id, a single
+    RetrievePropertiesEx call independent of the number of hosts
+
+    Arguments:
+        content {vim.ServiceInstanceContent} -- content of the connected ServiceInstance
+        host_id {str} -- managed object id of the host, e.g. host-42
+        name_filter {re.Pattern} -- the host is skipped if its name doesn't match the compiled pattern
+
+    Returns:
+        list -- HostVnics of the host, empty if it doesn't exist (anymore) or is filtered
+    """
+    collector = content.propertyCollector
+    host = vim.HostSystem(host_id, collector._stub)
+    options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=1)
+    try:
+        result = collector.RetrievePropertiesEx([single_host_filter_spec(host)], options)
+    except vmodl.fault.ManagedObjectNotFound:
+        return []
+    hosts = [to_host_vnics(obj) for obj in result.objects] if result else []
+    return filter_hosts(hosts, name_filter)
+
+
+def filter_hosts(hosts, name_filter):
+    if name_filter is None:
+        return hosts
+    return [host for host in hosts if host.name and name_filter.search(host.name)]
+
+
+def mtu_violations(hosts, min_mtu):
+    """
+    VMkernel adapters with an MTU below min_mtu, computed from the retrieved properties
+
+    Returns:
+        list -- (HostVnics, vim.host.VirtualNic) tuples
+    """
+    return [(host, vnic) for host in hosts for vnic in host.vnics
+            if vnic.spec.mtu is not None and vnic.spec.mtu < min_mtu]
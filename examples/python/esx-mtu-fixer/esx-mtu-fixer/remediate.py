@@ -0,0 +1,205 @@
+import contextlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from queue import Empty, Queue
+
+try:
+    from .velazy import lazy
+except ImportError:
+    from velazy import lazy
+
+vim = lazy('pyVmomi', 'vim')
+
+# interval for checking the per-host timeouts while waiting for the workers
+POLL_INTERVAL = 0.5
+
+
+class HostTask(object):
+    """
+    VMkernel adapters of one host to fix, with one result dict per adapter
+    """
+    __slots__ = ('host', 'cluster', 'results', 'started')
+
+    def __init__(self, host, cluster):
+        self.host = host
+        self.cluster = cluster
+        self.results = []
+        self.started = None
+
+
+class Limiter(object):
+    """
+    Limiter hands out the slots of the hosts being updated: at most max_parallel hosts of a vCenter and
+    max_per_cluster hosts of one of its clusters at a time. A process keeps one Limiter for all its
+    remediations, so concurrent requests and the watcher stay within the limits together
+    """
+
+    def __init__(self, max_parallel=8, max_per_cluster=2):
+        self.max_parallel = max(1, max_parallel)
+        self.max_per_cluster = max(1, max_per_cluster)
+        self.semaphores = {}  # vCenter or (vCenter, cluster) -> BoundedSemaphore
+        self.lock = threading.Lock()
+        self.progress = 0  # time a host last took or gave back its slots
+
+    def semaphore(self, key, size):
+        with self.lock:
+            semaphore = self.semaphores.get(key)
+            if semaphore is None:
+                semaphore = self.semaphores[key] = threading.BoundedSemaphore(size)
+            return semaphore
+
+    @contextlib.contextmanager
+    def slot(self, vcenter, cluster):
+        """
+        Held while a host is updated. The cluster slot is taken first, a host waiting for its
+        cluster doesn't hold a vCenter slot the hosts of other clusters could use
+        """
+        with self.semaphore((vcenter, cluster), self.max_per_cluster):
+            with self.semaphore(vcenter, self.max_parallel):
+                self.progress = time.time()
+                try:
+                    yield
+                finally:
+                    self.progress = time.time()
+
+
+class Remediation(object):
+    """
+    Remediation fixes the MTU of VMkernel adapters on several hosts in parallel, within the
+    slots of limiter (a Limiter of its own with max_parallel and max_per_cluster by default).
+    A host not done within timeout seconds is reported as timeout
+    """
+
+    def __init__(self, min_mtu, max_parallel=8, max_per_cluster=2, timeout=60, dry_run=False,
+                 limiter=None, vcenter=None):
+        self.min_mtu = min_mtu
+        self.limiter = limiter or Limiter(max_parallel, max_per_cluster)
+        self.vcenter = vcenter
+        self.timeout = timeout
+        self.dry_run = dry_run
+        self.lock = threading.Lock()
+
+    def plan(self, violations):
+        """
+        Groups the (HostVnics, vnic) violations per host
+
+        Returns:
+            list -- HostTask for every host with a violation, status of all results is planned
+        """
+        tasks = OrderedDict()
+        for host, vnic in violations:
+            task = tasks.get(host.host._moId)
+            if task is None:
+                task = tasks[host.host._moId] = HostTask(host, host.cluster)
+            task.results.append(OrderedDict([('host', host.name),
+                                             ('host_id', host.host._moId),
+                                             ('cluster', host.cluster),
+                                             ('device', vnic.device),
+                                             ('old_mtu', vnic.spec.mtu),
+                                             ('new_mtu', self.min_mtu),
+                                             ('status', 'planned'),
+                                             ('error', None)]))
+        return list(tasks.values())
+
+    def run(self, violations):
+        """
+        Applies the changes, in dry-run mode they are only returned
+
+        Arguments:
+            violations {list} -- (HostVnics, vim.host.VirtualNic) tuples from mtu_violations
+
+        Returns:
+            list -- one dict per adapter, status is planned, fixed, failed or timeout
+        """
+        tasks = self.plan(violations)
+        if self.dry_run or not tasks:
+            return [result for task in tasks for result in task.results]
+
+        futures = OrderedDict((Future(), task) for task in interleave(tasks))
+        start_workers(self.limiter.max_parallel, [(future, self.fix, (task,)) for future, task in futures.items()])
+        pending = set(futures)
+        progress = time.time()
+        while pending:
+            done, pending = wait(pending, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            now = time.time()
+            with self.lock:
+                if done or self.limiter.progress > progress:
+                    progress = now
+                for future in list(pending):
+                    task = futures[future]
+                    # a host waiting for a free slot times out when no other host (of any remediation) made progress
+                    since = task.started or progress
+                    if now - since > self.timeout:
+                        future.cancel()
+                        pending.discard(future)
+                        self.finish(task, 'timeout', 'no response within %ss' % self.timeout)
+        return [result for task in tasks for result in task.results]
+
+    def fix(self, task):
+        with self.limiter.slot(self.vcenter, task.cluster):
+            with self.lock:
+                if task.results[0]['status'] != 'planned':
+                    return
+                task.started = time.time()
+            spec = vim.host.VirtualNic.Specification(mtu=self.min_mtu)
+            for result in task.results:
+                try:
+                    task.host.network_system.UpdateVirtualNic(result['device'], spec)
+                    status, error = 'fixed', None
+                except Exception as e:
+                    status, error = 'failed', getattr(e, 'msg', None) or str(e)
+                with self.lock:
+                    if result['status'] == 'planned':
+                        result['status'], result['error'] = status, error
+
+    def finish(self, task, status, error):
+        for result in task.results:
+            if result['status'] == 'planned':
+                result['status'], result['error'] = status, error
+
+
+def start_workers(count, jobs):
+    """
+    Runs the (future, function, args) jobs on at most count daemon threads. Blocked UpdateVirtualNic calls
+    can't be aborted, unlike the threads of a ThreadPoolExecutor the workers don't keep the process from
+    exiting after the hosts timed out
+    """
+    jobs_queue = Queue()
+    for job in jobs:
+        jobs_queue.put(job)
+
+    def work():
+        while True:
+            try:
+                future, function, args = jobs_queue.get_nowait()
+            except Empty:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(function(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    for _ in range(min(count, len(jobs))):
+        threading.Thread(target=work, name='remediate', daemon=True).start()
+
+
+def interleave(tasks):
+    """
+    Orders the hosts round-robin over their clusters, so the workers don't all
+    wait for the slots of the same cluster
+    """
+    clusters = OrderedDict()
+    for task in tasks:
+        clusters.setdefault(task.cluster, []).append(task)
+    queues = list(clusters.values())
+    ordered = []
+    while queues:
+        for queue in list(queues):
+            ordered.append(queue.pop(0))
+            if not queue:
+                queues.remove(queue)
+    return ordered
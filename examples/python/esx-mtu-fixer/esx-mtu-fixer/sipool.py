@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from .velazy import lazy
+except ImportError:
+    from velazy import lazy
+
+connect = lazy('pyVim.connect')
+vim = lazy('pyVmomi', 'vim')
+
+
+class PooledInstance(object):
+    """
+    ServiceInstance of a pooled session with the password it was created with and the time it was last
+    checked or handed out
+    """
+    __slots__ = ('si', 'pwd', 'checked')
+
+    def __init__(self, si, pwd):
+        self.si = si
+        self.pwd = pwd
+        self.checked = time.time()
+
+
+class ServiceInstancePool(object):
+    """
+    ServiceInstancePool keeps logged in ServiceInstances keyed by vCenter host and user, so a warm
+    process logs in once instead of once per event. At most max_sessions sessions are kept, the
+    least recently used one is logged out when another is needed. A session idle for more than
+    check_interval seconds is checked with CurrentTime() before it is handed out again
+    """
+
+    def __init__(self, max_sessions=4, check_interval=30, smart_connect=None, disconnect=None):
+        self.max_sessions = max(1, max_sessions)
+        self.check_interval = check_interval
+        # looked up at call time when not given, pyVim.connect is the default
+        self.smart_connect = smart_connect
+        self.disconnect = disconnect
+        self.sessions = OrderedDict()
+        self.connecting = {}
+        self.lock = threading.Lock()
+
+    def get(self, host, user, pwd, **kwargs):
+        """
+        Returns a logged in ServiceInstance for host and user, kwargs are passed to SmartConnect
+        when a new session is needed
+
+        Raises:
+            IOError, vim.fault.InvalidLogin -- SmartConnect failed
+        """
+        key = (host, user)
+        with self.lock:
+            connecting = self.connecting.setdefault(key, threading.Lock())
+        # one login per key at a time, concurrent events wait for it and share the session
+        with connecting:
+            with self.lock:
+                pooled = self.sessions.get(key)
+                if pooled is not None:
+                    self.sessions.move_to_end(key)
+            if pooled is not None:
+                if pooled.pwd == pwd and self.alive(pooled):
+                    return pooled.si
+                self.invalidate(pooled.si)
+
+            si = (self.smart_connect or connect.SmartConnect)(host=host, user=user, pwd=pwd, **kwargs)
+            with self.lock:
+                evicted = []
+                while len(self.sessions) >= self.max_sessions:
+                    evicted.append(self.sessions.popitem(last=False)[1])
+                self.sessions[key] = PooledInstance(si, pwd)
+        for pooled in evicted:
+            self.close(pooled)
+        return si
+
+    def invalidate(self, si):
+        """
+        Drops the session of si from the pool, e.g. after a call failed with NotAuthenticated
+        """
+        with self.lock:
+            for key, pooled in list(self.sessions.items()):
+                if pooled.si is si:
+                    del self.sessions[key]
+                    break
+            else:
+                return
+        self.close(pooled)
+
+    def close_all(self):
+        with self.lock:
+            pooled = list(self.sessions.values())
+            self.sessions.clear()
+        for entry in pooled:
+            self.close(entry)
+
+    def alive(self, pooled):
+        # a session in use is known to work, only one idle for check_interval is checked
+        now = time.time()
+        if now - pooled.checked >= self.check_interval:
+            try:
+                pooled.si.CurrentTime()
+            except (vim.fault.NotAuthenticated, IOError):
+                return False
+        pooled.checked = now
+        return True
+
+    def close(self, pooled):
+        try:
+            (self.disconnect or connect.Disconnect)(pooled.si)
+        except Exception:
+            # expired sessions fail to log out, nothing left to clean up
+            pass
+
+    def __len__(self):
+        return len(self.sessions)
@@ -0,0 +1,572 @@
+import sys, os, re, json, time, datetime, tempfile, threading, unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pyVmomi import vim, vmodl, VmomiSupport, SoapAdapter
+
+sys.modules.pop('handler', None) #every example function has a handler module, make sure this one is loaded
+import handler
+import inventory
+import remediate
+import sipool
+import watcher
+
+VERSION = VmomiSupport.newestVersions.GetName('vim')
+ENVELOPE = ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" '
+            'xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+            '<soapenv:Body>{0}</soapenv:Body></soapenv:Envelope>')
+
+class FakeVim(BaseHTTPRequestHandler):
+    """
+    Fake vCenter SOAP endpoint answering the calls made by the handler with pyVmomi serialized responses.
+    hosts maps a host id to its name, cluster and {vmk device: mtu}, calls records the SOAP methods invoked.
+    UpdateVirtualNic takes delay seconds (hanging hosts never answer in time) and fails for failing hosts,
+    inflight tracks the concurrent calls per cluster. While expired is set, calls fail with NotAuthenticated
+    """
+    protocol_version = 'HTTP/1.1'
+    hosts = {}
+    calls = []
+    delay = 0
+    failing = set()
+    hanging = set()
+    inflight = {}
+    peak = {}
+    expired = False
+    lock = threading.Lock()
+
+    @classmethod
+    def reset(cls, count=0, low=(), clusters=1):
+        cls.calls = []
+        cls.hosts = {}
+        cls.delay = 0
+        cls.failing = set()
+        cls.hanging = set()
+        cls.inflight = {}
+        cls.peak = {}
+        cls.expired = False
+        for i in range(1, count + 1):
+            cls.hosts['host-%d' % i] = {'name': 'esxi%02d.pdotk.local' % i,
+                                        'cluster': 'domain-c%d' % ((i - 1) % clusters + 1),
+                                        'vnics': {'vmk0': 1400 if i in low else 1500, 'vmk1': 9000}}
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        method = re.search(r'<soapenv:Body><(\w+)', body).group(1)
+        with FakeVim.lock:
+            FakeVim.calls.append(method)
+        status = 200
+        try:
+            if FakeVim.expired and method not in ('RetrieveServiceContent', 'Fetch'):
+                raise vim.fault.NotAuthenticated(msg='The session is not authenticated.')
+            result = getattr(self, method)(body)
+        except vmodl.MethodFault as fault:
+            # faults are sent like vCenter does, as <detail><{name}Fault xsi:type="{name}">
+            status = 500
+            info = VmomiSupport.Object(name=fault._wsdlName + 'Fault', type=object, version=VERSION, flags=0)
+            payload = ('<soapenv:Fault><faultcode>ServerFaultCode</faultcode><faultstring>{0}</faultstring>'
+                       '<detail>{1}</detail></soapenv:Fault>').format(
+                fault.msg, SoapAdapter.SerializeFaultDetail(fault, info=info, version=VERSION))
+        else:
+            if result is None:
+                payload = '<{0}Response xmlns="urn:vim25"></{0}Response>'.format(method)
+            else:
+                # property reads (Fetch) are declared as anyType and need the xsi:type of the value
+                restype = object if method == 'Fetch' else type(result)
+                info = VmomiSupport.Object(name='returnval', type=restype, version=VERSION, flags=0)
+                payload = '<{0}Response xmlns="urn:vim25">{1}</{0}Response>'.format(
+                    method, SoapAdapter.SerializeToStr(result, info=info, version=VERSION))
+        data = ENVELOPE.format(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+    # vim API
+    def RetrieveServiceContent(self, body):
+        return vim.ServiceInstanceContent(rootFolder=vim.Folder('group-d1'),
+                                          propertyCollector=vmodl.query.PropertyCollector('propertyCollector'),
+                                          viewManager=vim.view.ViewManager('ViewManager'),
+                                          sessionManager=vim.SessionManager('SessionManager'),
+                                          about=vim.AboutInfo(name='VMware vCenter Server', apiVersion='7.0'))
+
+    def Fetch(self, body):
+        prop = re.search(r'<prop[^>]*>(\w+)</prop>', body).group(1)
+        assert prop == 'content', prop
+        return self.RetrieveServiceContent(body)
+
+    def CurrentTime(self, body):
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    def Logout(self, body):
+        return None
+
+    def CreateContainerView(self, body):
+        return vim.view.ContainerView('session[fake]view-1')
+
+    def DestroyView(self, body):
+        return None
+
+    def RetrievePropertiesEx(self, body):
+        assert re.search(r'<type[^>]*>HostSystem</type>', body) and re.search(r'<pathSet[^>]*>config.network.vnic</pathSet>', body)
+        page = int(re.search(r'<maxObjects[^>]*>(\d+)</maxObjects>', body).group(1))
+        single = re.search(r'<obj type="HostSystem"[^>]*>([\w-]+)</obj>', body)
+        if single:
+            if single.group(1) not in FakeVim.hosts:
+                raise vmodl.fault.ManagedObjectNotFound(msg='The object has already been deleted or has not been completely created',
+                                                        obj=vim.HostSystem(single.group(1)))
+            return self.page([single.group(1)], page)
+        return self.page(sorted(FakeVim.hosts), page)
+
+    def ContinueRetrievePropertiesEx(self, body):
+        token = re.search(r'<token[^>]*>(.*?)</token>', body).group(1)
+        offset, page = [int(n) for n in token.split(':')]
+        return self.page(sorted(FakeVim.hosts)[offset:], page, offset)
+
+    def page(self, ids, size, offset=0):
+        objects = []
+        for hostid in ids[:size]:
+            host = FakeVim.hosts[hostid]
+            vnics = [vim.host.VirtualNic(device=device, spec=vim.host.VirtualNic.Specification(mtu=mtu))
+                     for device, mtu in sorted(host['vnics'].items())]
+            objects.append(vmodl.query.PropertyCollector.ObjectContent(obj=vim.HostSystem(hostid), propSet=[
+                vmodl.DynamicProperty(name='name', val=host['name']),
+                vmodl.DynamicProperty(name='config.network.vnic', val=vim.host.VirtualNic.Array(vnics)),
+                vmodl.DynamicProperty(name='configManager.networkSystem', val=vim.host.NetworkSystem('networkSystem-' + hostid)),
+                vmodl.DynamicProperty(name='parent', val=vim.ClusterComputeResource(host['cluster']))]))
+        token = '%d:%d' % (offset + size, size) if len(ids) > size else None
+        return vmodl.query.PropertyCollector.RetrieveResult(objects=objects, token=token)
+
+    def UpdateVirtualNic(self, body):
+        hostid = re.search(r'>networkSystem-(host-\d+)<', body).group(1)
+        device = re.search(r'<device[^>]*>(\w+)</device>', body).group(1)
+        cluster = FakeVim.hosts[hostid]['cluster']
+        with FakeVim.lock:
+            for key in (cluster, None):
+                FakeVim.inflight[key] = FakeVim.inflight.get(key, 0) + 1
+                FakeVim.peak[key] = max(FakeVim.peak.get(key, 0), FakeVim.inflight[key])
+        try:
+            time.sleep(FakeVim.delay * (20 if hostid in FakeVim.hanging else 1))
+            if hostid in FakeVim.failing:
+                raise vim.fault.HostConfigFault(msg='fake fault on ' + hostid)
+            FakeVim.hosts[hostid]['vnics'][device] = int(re.search(r'<mtu[^>]*>(\d+)</mtu>', body).group(1))
+        finally:
+            with FakeVim.lock:
+                for key in (cluster, None):
+                    FakeVim.inflight[key] -= 1
+        return None
+
+class FakeVimTest(unittest.TestCase):
+
+    def setUp(self):
+        FakeVim.reset()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeVim)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        stub = SoapAdapter.SoapStubAdapter(host='127.0.0.1', port=-self.server.server_port, version=VERSION)
+        self.si = vim.ServiceInstance('ServiceInstance', stub)
+
+        self.secrets = tempfile.TemporaryDirectory()
+        patches = []
+        for name, value in (('VC_HOST', '127.0.0.1'), ('VC_USER', 'administrator@vsphere.local'), ('VC_PASSWORD', 'secret')):
+            path = os.path.join(self.secrets.name, name)
+            with open(path, 'w') as secret:
+                secret.write(value)
+            patches.append(mock.patch.object(handler, name, path))
+        self.logins = 0
+        patches.append(mock.patch.object(handler.connect, 'SmartConnect', self.login))
+        patches.append(mock.patch.object(handler, 'POOL', sipool.ServiceInstancePool(max_sessions=2, check_interval=0)))
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def login(self, **kwargs):
+        self.logins += 1
+        FakeVim.expired = False
+        return self.si
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.secrets.cleanup()
+
+class RetrievalTest(FakeVimTest):
+
+    def test_all_hosts_retrieved_in_pages(self):
+        FakeVim.reset(count=7, low=(3, 6))
+        hosts = inventory.retrieve_host_vnics(self.si.RetrieveContent(), page_size=3)
+
+        self.assertEqual([host.name for host in hosts], ['esxi%02d.pdotk.local' % i for i in range(1, 8)])
+        self.assertEqual(FakeVim.calls, ['RetrieveServiceContent', 'CreateContainerView', 'RetrievePropertiesEx',
+                                         'ContinueRetrievePropertiesEx', 'ContinueRetrievePropertiesEx', 'DestroyView'])
+        violations = inventory.mtu_violations(hosts, 1500)
+        self.assertEqual([(host.name, vnic.device, vnic.spec.mtu) for host, vnic in violations],
+                         [('esxi03.pdotk.local', 'vmk0', 1400), ('esxi06.pdotk.local', 'vmk0', 1400)])
+
+    def test_handle_fixes_low_mtu(self):
+        FakeVim.reset(count=4, low=(2,))
+        res = json.loads(handler.handle(''))
+
+        self.assertEqual(res['changes'], [{'host': 'esxi02.pdotk.local', 'host_id': 'host-2', 'cluster': 'domain-c1',
+                                           'device': 'vmk0', 'old_mtu': 1400, 'new_mtu': 1500,
+                                           'status': 'fixed', 'error': None}])
+        self.assertEqual(FakeVim.hosts['host-2']['vnics'], {'vmk0': 1500, 'vmk1': 9000})
+        self.assertEqual(FakeVim.calls.count('UpdateVirtualNic'), 1)
+
+class IncrementalTest(FakeVimTest):
+
+    def event(self, hostid):
+        return json.dumps({'subject': 'HostConnectedEvent',
+                           'data': {'Host': {'Name': hostid, 'Host': {'Type': 'HostSystem', 'Value': hostid}}}})
+
+    def test_event_scans_only_its_host(self):
+        FakeVim.reset(count=6, low=(2, 5))
+        res = json.loads(handler.handle(self.event('host-5')))
+
+        self.assertEqual(res['scope'], 'host-5')
+        self.assertEqual([change['host'] for change in res['changes']], ['esxi05.pdotk.local'])
+        self.assertNotIn('CreateContainerView', FakeVim.calls)
+        self.assertEqual(FakeVim.calls.count('RetrievePropertiesEx'), 1)
+        self.assertEqual(FakeVim.hosts['host-2']['vnics']['vmk0'], 1400)
+
+    def test_unknown_host_changes_nothing(self):
+        FakeVim.reset(count=2, low=(1,))
+        res = json.loads(handler.handle(self.event('host-99')))
+
+        self.assertEqual(res['changes'], [])
+        self.assertNotIn('UpdateVirtualNic', FakeVim.calls)
+
+    def test_invalid_or_hostless_request_scans_nothing(self):
+        FakeVim.reset(count=2, low=(1,))
+        res = json.loads(handler.handle('{"id":'))
+        self.assertEqual(res['status'], '400')
+        res = json.loads(handler.handle(json.dumps({'subject': 'UserLoginSessionEvent', 'data': {'Host': None}})))
+        self.assertEqual((res['scope'], res['changes']), (None, []))
+        self.assertEqual(FakeVim.calls, [])
+        self.assertEqual(self.logins, 0)
+
+    def test_full_scan_mode_scans_all_hosts(self):
+        FakeVim.reset(count=6, low=(2, 5))
+        with mock.patch.object(handler, 'SCAN_MODE', 'full'):
+            res = json.loads(handler.handle(self.event('host-5')))
+
+        self.assertEqual(res['scope'], 'all')
+        self.assertEqual([change['host'] for change in res['changes']], ['esxi02.pdotk.local', 'esxi05.pdotk.local'])
+
+    def test_scheduled_reconcile_scans_filtered_hosts(self):
+        FakeVim.reset(count=12, low=(2, 11))
+        with mock.patch.object(handler, 'HOST_FILTER', re.compile(r'^esxi1\d\.')):
+            res = json.loads(handler.handle(''))
+
+        self.assertEqual(res['scope'], 'all')
+        self.assertEqual([change['host'] for change in res['changes']], ['esxi11.pdotk.local'])
+        self.assertEqual(FakeVim.hosts['host-2']['vnics']['vmk0'], 1400)
+
+class SessionPoolTest(FakeVimTest):
+
+    def test_warm_process_logs_in_once(self):
+        FakeVim.reset(count=2, low=(1,))
+        with mock.patch.object(handler, 'WARM_PROCESS', True):
+            for _ in range(3):
+                json.loads(handler.handle(''))
+
+        self.assertEqual(self.logins, 1)
+        self.assertEqual(FakeVim.calls.count('CurrentTime'), 2)
+        self.assertNotIn('Logout', FakeVim.calls)
+        self.assertEqual(len(handler.POOL), 1)
+
+    def test_session_in_use_not_checked(self):
+        FakeVim.reset(count=2)
+        handler.POOL.check_interval = 60
+        now = time.time()
+        with mock.patch.object(handler, 'WARM_PROCESS', True):
+            for i in range(4):
+                with mock.patch.object(sipool.time, 'time', return_value=now + 40 * i):
+                    handler.handle('')
+            self.assertEqual(FakeVim.calls.count('CurrentTime'), 0)
+            # idle for longer than check_interval
+            with mock.patch.object(sipool.time, 'time', return_value=now + 40 * 3 + 61):
+                handler.handle('')
+
+        self.assertEqual(FakeVim.calls.count('CurrentTime'), 1)
+        self.assertEqual(self.logins, 1)
+
+    def test_classic_process_logs_out(self):
+        FakeVim.reset(count=2, low=(1,))
+        handler.handle('')
+
+        self.assertEqual(FakeVim.calls.count('Logout'), 1)
+        self.assertEqual(len(handler.POOL), 0)
+
+    def test_expired_session_replaced(self):
+        FakeVim.reset(count=2, low=(1,))
+        with mock.patch.object(handler, 'WARM_PROCESS', True):
+            handler.handle('')
+            FakeVim.expired = True
+            handler.handle('')
+            # expired after the health check, the failing call is retried with a new session
+            handler.POOL.check_interval = 60
+            FakeVim.expired = True
+            res = json.loads(handler.handle(''))
+
+        self.assertEqual(self.logins, 3)
+        self.assertEqual(res['changes'], [])
+        self.assertEqual(FakeVim.hosts['host-1']['vnics']['vmk0'], 1500)
+
+    def test_live_sessions_capped(self):
+        closed = []
+        pool = sipool.ServiceInstancePool(max_sessions=2, smart_connect=lambda **kwargs: object(), disconnect=closed.append)
+        first = pool.get('vc1', 'user', 'pwd')
+        pool.get('vc2', 'user', 'pwd')
+        self.assertIs(pool.get('vc1', 'user', 'pwd'), first)
+        pool.get('vc3', 'user', 'pwd')
+
+        self.assertEqual(len(pool), 2)
+        self.assertEqual(len(closed), 1)
+        self.assertIsNot(closed[0], first)
+        self.assertIsNot(pool.get('vc1', 'user', 'changed'), first)
+        self.assertIn(first, closed)
+
+class RemediationTest(FakeVimTest):
+
+    def test_dry_run_changes_nothing(self):
+        FakeVim.reset(count=4, low=(1, 3))
+        with mock.patch.object(handler, 'DRY_RUN', True):
+            res = json.loads(handler.handle(''))
+
+        self.assertTrue(res['dry_run'])
+        self.assertEqual([(change['host'], change['status']) for change in res['changes']],
+                         [('esxi01.pdotk.local', 'planned'), ('esxi03.pdotk.local', 'planned')])
+        self.assertNotIn('UpdateVirtualNic', FakeVim.calls)
+        self.assertEqual(FakeVim.hosts['host-1']['vnics']['vmk0'], 1400)
+
+    def test_concurrency_limits(self):
+        FakeVim.reset(count=12, low=range(1, 13), clusters=2)
+        FakeVim.delay = 0.05
+        hosts = inventory.retrieve_host_vnics(self.si.RetrieveContent())
+        changes = remediate.Remediation(1500, max_parallel=3, max_per_cluster=2).run(inventory.mtu_violations(hosts, 1500))
+
+        self.assertEqual([change['status'] for change in changes], ['fixed'] * 12)
+        self.assertEqual(FakeVim.peak[None], 3)
+        self.assertLessEqual(FakeVim.peak['domain-c1'], 2)
+        self.assertLessEqual(FakeVim.peak['domain-c2'], 2)
+
+    def test_limits_shared_by_remediations(self):
+        FakeVim.reset(count=12, low=range(1, 13), clusters=2)
+        FakeVim.delay = 0.05
+        violations = inventory.mtu_violations(inventory.retrieve_host_vnics(self.si.RetrieveContent()), 1500)
+        limiter = remediate.Limiter(max_parallel=3, max_per_cluster=2)
+        results = []
+        def run(part):
+            results.extend(remediate.Remediation(1500, limiter=limiter, vcenter='vcsa').run(part))
+        threads = [threading.Thread(target=run, args=(part,)) for part in (violations[:6], violations[6:])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([change['status'] for change in results], ['fixed'] * 12)
+        self.assertEqual(FakeVim.peak[None], 3)
+        self.assertLessEqual(FakeVim.peak['domain-c1'], 2)
+        self.assertLessEqual(FakeVim.peak['domain-c2'], 2)
+
+    def test_failed_and_timed_out_hosts_reported(self):
+        FakeVim.reset(count=3, low=(1, 2, 3))
+        FakeVim.delay = 0.1
+        FakeVim.failing = {'host-1'}
+        FakeVim.hanging = {'host-2'}
+        hosts = inventory.retrieve_host_vnics(self.si.RetrieveContent())
+        with mock.patch.object(remediate, 'POLL_INTERVAL', 0.05):
+            changes = remediate.Remediation(1500, max_parallel=3, timeout=0.5).run(inventory.mtu_violations(hosts, 1500))
+
+        self.assertEqual([(change['host_id'], change['status']) for change in changes],
+                         [('host-1', 'failed'), ('host-2', 'timeout'), ('host-3', 'fixed')])
+        self.assertIn('fake fault on host-1', changes[0]['error'])
+        # the worker still blocked on host-2 does not keep the process alive
+        workers = [thread for thread in threading.enumerate() if thread.name == 'remediate']
+        self.assertTrue(workers)
+        self.assertTrue(all(thread.daemon for thread in workers))
+
+PC = vmodl.query.PropertyCollector
+
+class FakeCollector(object):
+    """
+    Stand-in stub for the property collector of vCenter and the managed objects the watcher uses. hosts maps a host
+    id to its name, cluster and {vmk device: mtu}, every change is appended to log. WaitForUpdatesEx called with an
+    empty version returns every host, otherwise the hosts changed since the version (the position in log), at most
+    maxObjectUpdates at a time. returned records the object updates of every call
+    """
+
+    def __init__(self, count=0, low=()):
+        self.hosts = {}
+        self.log = []
+        self.calls = []
+        self.returned = []
+        self.changed = threading.Condition()
+        for i in range(1, count + 1):
+            self.hosts['host-%d' % i] = {'name': 'esxi%02d.pdotk.local' % i, 'cluster': 'domain-c1',
+                                         'vnics': {'vmk0': 1400 if i in low else 1500, 'vmk1': 9000}}
+        self.content = vim.ServiceInstanceContent(rootFolder=vim.Folder('group-d1', self),
+                                                  propertyCollector=PC('propertyCollector', self),
+                                                  viewManager=vim.view.ViewManager('ViewManager', self))
+
+    def InvokeMethod(self, mo, info, args):
+        self.calls.append(info.wsdlName)
+        return getattr(self, info.wsdlName)(mo, *args)
+
+    def InvokeAccessor(self, mo, info):
+        return self.content
+
+    def change(self, hostid, device=None, mtu=None, remove=False):
+        with self.changed:
+            if remove:
+                del self.hosts[hostid]
+            elif device is not None:
+                self.hosts[hostid]['vnics'][device] = mtu
+            self.log.append(hostid)
+            self.changed.notify_all()
+
+    def update(self, hostid, kind):
+        if kind == 'leave':
+            return PC.ObjectUpdate(kind=kind, obj=vim.HostSystem(hostid))
+        host = self.hosts[hostid]
+        vnics = [vim.host.VirtualNic(device=device, spec=vim.host.VirtualNic.Specification(mtu=mtu))
+                 for device, mtu in sorted(host['vnics'].items())]
+        return PC.ObjectUpdate(kind=kind, obj=vim.HostSystem(hostid), changeSet=[
+            PC.Change(name='name', op='assign', val=host['name']),
+            PC.Change(name='config.network.vnic', op='assign', val=vim.host.VirtualNic.Array(vnics)),
+            PC.Change(name='configManager.networkSystem', op='assign', val=vim.host.NetworkSystem('networkSystem-' + hostid, self)),
+            PC.Change(name='parent', op='assign', val=vim.ClusterComputeResource(host['cluster']))])
+
+    # vim API
+    def CurrentTime(self, mo):
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    def CreateContainerView(self, mo, container, type, recursive):
+        return vim.view.ContainerView('session[fake]view-1', self)
+
+    def CreatePropertyCollector(self, mo):
+        return PC('session[fake]collector-1', self)
+
+    def CreateFilter(self, mo, spec, partialUpdates):
+        assert spec.propSet[0].type is vim.HostSystem and 'config.network.vnic' in spec.propSet[0].pathSet
+        return PC.Filter('session[fake]filter-1', self)
+
+    def WaitForUpdatesEx(self, mo, version, options):
+        with self.changed:
+            if version:
+                position = int(version.split(':')[0])
+                if position >= len(self.log) and options.maxWaitSeconds:
+                    self.changed.wait(min(options.maxWaitSeconds, 0.2))
+                pending = list(dict.fromkeys(self.log[position:]))
+                updates = [self.update(hostid, 'modify' if hostid in self.hosts else 'leave') for hostid in pending]
+            else:
+                position = len(self.log)
+                updates = [self.update(hostid, 'enter') for hostid in sorted(self.hosts)]
+            end = len(self.log)
+        if not updates:
+            return None
+        size = options.maxObjectUpdates or len(updates)
+        self.returned.append(len(updates[:size]))
+        # a truncated set continues with the hosts after the ones returned
+        truncated = len(updates) > size
+        if truncated and version:
+            self.log[position:end] = [update.obj._moId for update in updates[size:]]
+            end = position
+        elif truncated:
+            self.log[position:position] = [update.obj._moId for update in updates[size:]]
+            end = position
+        return PC.UpdateSet(version=str(end), truncated=truncated, filterSet=[
+            PC.FilterUpdate(filter=PC.Filter('session[fake]filter-1'), objectSet=updates[:size])])
+
+    def UpdateVirtualNic(self, mo, device, nic):
+        self.change(mo._moId[len('networkSystem-'):], device, nic.mtu)
+
+    def DestroyView(self, mo):
+        return None
+
+    DestroyPropertyCollector = DestroyPropertyFilter = DestroyView
+
+class WatcherTest(unittest.TestCase):
+
+    def watcher(self, fake, **kwargs):
+        w = watcher.Watcher(fake.content, lambda: remediate.Remediation(1500), 1500, max_wait=1, **kwargs)
+        w.start()
+        self.addCleanup(w.close)
+        return w
+
+    def test_changes_only_fix_changed_hosts(self):
+        fake = FakeCollector(count=50, low=(7,))
+        w = self.watcher(fake)
+
+        changes = w.check()
+        self.assertEqual([(change['host_id'], change['status']) for change in changes], [('host-7', 'fixed')])
+        self.assertEqual(len(w.index), 50)
+        self.assertEqual(fake.returned, [50])
+        # the fix of host-7 comes back as an update without a violation
+        self.assertEqual(w.check(), [])
+        self.assertEqual(fake.returned, [50, 1])
+
+        fake.change('host-12', 'vmk1', 1280)
+        fake.change('host-30', 'vmk1', 9000)
+        changes = w.check()
+        self.assertEqual([(change['host_id'], change['device'], change['old_mtu']) for change in changes], [('host-12', 'vmk1', 1280)])
+        self.assertEqual(fake.returned[-1], 2)
+        self.assertEqual(fake.hosts['host-12']['vnics']['vmk1'], 1500)
+        self.assertEqual(fake.calls.count('UpdateVirtualNic'), 2)
+
+    def test_truncated_updates_fetched_at_once(self):
+        fake = FakeCollector(count=5, low=(1, 5))
+        w = self.watcher(fake, max_updates=2)
+
+        changes = w.check()
+        self.assertEqual(sorted(change['host_id'] for change in changes), ['host-1', 'host-5'])
+        self.assertEqual(fake.returned, [2, 2, 1])
+        self.assertEqual(len(w.index), 5)
+
+    def test_removed_host_dropped_and_filter_destroyed(self):
+        fake = FakeCollector(count=3)
+        w = self.watcher(fake, name_filter=re.compile(r'^esxi0[12]\.'))
+        w.check()
+        fake.change('host-2', remove=True)
+        fake.change('host-3', 'vmk0', 1000)
+        self.assertEqual(w.check(), [])
+        self.assertEqual(sorted(w.index.hosts), ['host-1', 'host-3'])
+        w.close()
+        self.assertEqual(fake.calls[-3:], ['DestroyPropertyFilter', 'DestroyPropertyCollector', 'DestroyView'])
+
+    def test_handler_watch_mode(self):
+        fake = FakeCollector(count=3, low=(2,))
+        si = vim.ServiceInstance('ServiceInstance', fake)
+        secrets = tempfile.TemporaryDirectory()
+        self.addCleanup(secrets.cleanup)
+        patches = [mock.patch.object(handler, 'WATCH_MODE', True), mock.patch.object(handler, 'WARM_PROCESS', True),
+                   mock.patch.object(handler, 'WATCH_WAIT', 1), mock.patch.object(handler, 'WATCH', None),
+                   mock.patch.object(handler.connect, 'SmartConnect', lambda **kwargs: si),
+                   mock.patch.object(handler, 'POOL', sipool.ServiceInstancePool(disconnect=lambda si: None))]
+        for name in ('VC_HOST', 'VC_USER', 'VC_PASSWORD'):
+            path = os.path.join(secrets.name, name)
+            with open(path, 'w') as secret:
+                secret.write('vcenter')
+            patches.append(mock.patch.object(handler, name, path))
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        handler.handle('{}')
+        loop = handler.WATCH
+        self.addCleanup(loop.stop.set)
+        deadline = time.time() + 5
+        while not loop.changes and time.time() < deadline:
+            time.sleep(0.01)
+        state = json.loads(handler.handle('{}'))
+
+        self.assertEqual(state['scope'], 'watch')
+        self.assertEqual(state['hosts'], 3)
+        self.assertEqual([(change['host_id'], change['status']) for change in state['changes']], [('host-2', 'fixed')])
+        self.assertIsNone(state['error'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,203 @@
+#
+## Stage timing shared by the Python example functions - keep the copies in the function folders identical to
+## examples/python/shared/vetiming.py (see examples/python/shared/README.md)
+##
+## handle() is wrapped with Timings.timed and its stages with Timings.stage
+##     TIMINGS = Timings('my-function', WARM_PROCESS)
+##     @TIMINGS.timed
+##     def handle(req):
+##         with TIMINGS.stage('decode'):
+##             ...
+## In warm-process mode the timings are Prometheus histograms served on metrics_port, otherwise every event writes a
+## JSON trailer line with its timings to stderr. Timing is off unless stage_timing is set, handle() then only pays
+## for an attribute check and stage() returns a shared no-op context manager
+##
+## Other metrics of a warm process (eg. a delivery queue) are registered with Timings.report and served as JSON on
+## GET /stats of the same endpoint
+#
+import bisect, functools, itertools, json, os, sys, threading, time
+
+# upper bounds in seconds, from a cached config read to a slow vCenter call
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRIC = 'veba_function_stage_seconds'
+
+class NullStage:
+    """context manager of disabled timing and of stages outside of handle()"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_STAGE = NullStage()
+
+class Stage:
+    __slots__ = ('stages', 'name', 'start')
+
+    def __init__(self, stages, name):
+        self.stages = stages
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stages.append((self.name, time.perf_counter() - self.start))
+        return False
+
+class Histogram:
+    """Prometheus histogram per stage, observations are counted in their bucket and made cumulative when exposed"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.series = {} # stage -> [count per bucket..., count above the last bucket, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            series = self.series.get(stage)
+            if series is None:
+                series = self.series[stage] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bucket] += 1
+            series[-1] += seconds
+
+    def exposition(self, function):
+        """the histogram in the Prometheus text format"""
+        lines = [f'# HELP {METRIC} Time spent in the stages of handle(), stage="total" is the whole event',
+                 f'# TYPE {METRIC} histogram']
+        with self.lock:
+            series = {stage: list(values) for stage, values in self.series.items()}
+        for stage, values in sorted(series.items()):
+            labels = f'function="{function}",stage="{stage}"'
+            cumulative = list(itertools.accumulate(values[:-1]))
+            for bound, count in zip(self.buckets + ('+Inf',), cumulative):
+                lines.append(f'{METRIC}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{METRIC}_sum{{{labels}}} {values[-1]:.6f}')
+            lines.append(f'{METRIC}_count{{{labels}}} {cumulative[-1]}')
+        return '\n'.join(lines) + '\n'
+
+class Timings:
+    """
+    Timings measures the stages of handle(), see the top of this file
+    """
+
+    def __init__(self, function, warm, enabled=None, port=None, stream=None):
+        """
+        Arguments:
+            function {str} -- function name, the function label of the metrics
+            warm {bool} -- warm-process mode, timings are kept as histograms instead of written per event
+            enabled {bool} -- timing on, from stage_timing by default
+            port {int} -- port of the metrics endpoint in warm-process mode, from metrics_port (default 8082) by
+                          default, 0 serves no endpoint
+            stream {file} -- where the trailer lines go, stderr by default
+        """
+        self.function = function
+        self.warm = warm
+        self.enabled = bool(os.getenv('stage_timing')) if enabled is None else enabled
+        self.port = int(os.getenv('metrics_port', '8082')) if port is None else port
+        self.stream = stream
+        self.histogram = Histogram()
+        self.local = threading.local()
+        self.server = None
+        self.lock = threading.Lock()
+        self.reports = {} # name -> function returning a JSON serializable dict, see report
+
+    def timed(self, handle):
+        """decorates handle(req), the event and its stages are timed if timing is enabled"""
+        @functools.wraps(handle)
+        def timedhandle(req):
+            if not self.enabled:
+                return handle(req)
+            stages = self.local.stages = []
+            start = time.perf_counter()
+            try:
+                return handle(req)
+            finally:
+                self.local.stages = None
+                stages.append(('total', time.perf_counter() - start))
+                self.record(stages)
+        return timedhandle
+
+    def stage(self, name):
+        """
+        Returns:
+            context manager timing the stage name of the current event
+        """
+        if not self.enabled:
+            return NULL_STAGE
+        stages = getattr(self.local, 'stages', None)
+        if stages is None:
+            return NULL_STAGE
+        return Stage(stages, name)
+
+    def record(self, stages):
+        if self.warm:
+            for name, seconds in stages:
+                self.histogram.observe(name, seconds)
+            if self.server is None and self.port:
+                self.serve()
+            return
+        timings = {}
+        for name, seconds in stages:
+            timings[name] = timings.get(name, 0) + seconds #eg. a stage retried after the session expired
+        trailer = {'function': self.function, 'stages_ms': {name: round(seconds * 1000, 3) for name, seconds in timings.items()}}
+        (self.stream or sys.stderr).write(json.dumps(trailer) + '\n')
+
+    def exposition(self):
+        return self.histogram.exposition(self.function)
+
+    def report(self, name, stats):
+        """
+        Serves stats() as name in the JSON of GET /stats. In warm-process mode the endpoint is started right away,
+        whether timing is enabled or not
+
+        Arguments:
+            name {str} -- key of the stats in the JSON
+            stats {function} -- returns a JSON serializable dict, called for every request
+        """
+        self.reports[name] = stats
+        if self.warm and self.port:
+            self.serve()
+
+    def stats(self):
+        return json.dumps({name: stats() for name, stats in self.reports.items()})
+
+    def serve(self):
+        """starts the metrics endpoint, GET /metrics and GET /stats on port"""
+        with self.lock:
+            if self.server is not None:
+                return
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer #only warm processes serve metrics
+            timings = self
+
+            class Metrics(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    path = self.path.split('?')[0]
+                    if path == '/metrics':
+                        data, contenttype = timings.exposition().encode(), 'text/plain; version=0.0.4'
+                    elif path == '/stats':
+                        data, contenttype = timings.stats().encode(), 'application/json'
+                    else:
+                        self.send_error(404)
+                        return
+                    self.send_response(200)
+                    self.send_header('Content-Type', contenttype)
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+
+                def log_message(self, format, *args):
+                    pass
+
+            try:
+                self.server = ThreadingHTTPServer(('', self.port), Metrics)
+            except OSError as err:
+                sys.stderr.write(f'metrics endpoint not started on port {self.port}: {err}\n')
+                self.port = 0
+                return
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True).start()
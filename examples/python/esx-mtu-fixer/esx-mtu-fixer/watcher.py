@@ -0,0 +1,143 @@
+try:
+    from .inventory import HostVnics, host_filter_spec, filter_hosts, mtu_violations
+    from .velazy import lazy
+except ImportError:
+    from inventory import HostVnics, host_filter_spec, filter_hosts, mtu_violations
+    from velazy import lazy
+
+vim = lazy('pyVmomi', 'vim')
+vmodl = lazy('pyVmomi', 'vmodl')
+
+# HostVnics attribute of every property in inventory.HOST_PROPERTIES
+FIELDS = {'name': 'name',
+          'config.network.vnic': 'vnics',
+          'configManager.networkSystem': 'network_system',
+          'parent': 'cluster'}
+
+
+class VnicIndex(object):
+    """
+    VMkernel adapters of every host by managed object id, kept up to date from the property collector updates
+    """
+
+    def __init__(self):
+        self.hosts = {}
+
+    def apply(self, update_set):
+        """
+        Applies the object updates of a WaitForUpdatesEx result
+
+        Returns:
+            set -- managed object ids of the hosts that entered or changed, hosts that left are dropped
+        """
+        changed = set()
+        for filter_update in update_set.filterSet or []:
+            for update in filter_update.objectSet or []:
+                hostid = update.obj._moId
+                if update.kind == 'leave':
+                    self.hosts.pop(hostid, None)
+                    changed.discard(hostid)
+                    continue
+                host = self.hosts.get(hostid)
+                if host is None:
+                    host = self.hosts[hostid] = HostVnics(update.obj, None, [], None)
+                for change in update.changeSet or []:
+                    field = FIELDS.get(change.name)
+                    if field is None:
+                        continue
+                    val = change.val if change.op in ('assign', 'add') else None
+                    if field == 'cluster':
+                        val = val._moId if val is not None else None
+                    elif field == 'vnics':
+                        val = val or []
+                    setattr(host, field, val)
+                changed.add(hostid)
+        return changed
+
+    def __len__(self):
+        return len(self.hosts)
+
+
+class Watcher(object):
+    """
+    Watcher registers a PropertyFilter on the VMkernel adapters of all hosts and remediates the hosts an update
+    reports with an MTU below min_mtu. The first update brings every host (and fixes the ones already below),
+    afterwards WaitForUpdatesEx only returns the hosts that changed since the version of the previous call, so
+    the work per check is proportional to the changes instead of the number of hosts
+    """
+
+    def __init__(self, content, remediation, min_mtu, name_filter=None, max_wait=30, max_updates=500):
+        """
+        Arguments:
+            content {vim.ServiceInstanceContent} -- content of the connected ServiceInstance
+            remediation {function} -- returns the Remediation applying the changes of a check
+            min_mtu {int} -- adapters below are fixed
+            name_filter {re.Pattern} -- only hosts with a name matching the compiled pattern are fixed
+            max_wait {int} -- seconds a WaitForUpdatesEx call waits for changes
+            max_updates {int} -- object updates returned per WaitForUpdatesEx call, more are fetched right away
+        """
+        self.content = content
+        self.remediation = remediation
+        self.min_mtu = min_mtu
+        self.name_filter = name_filter
+        self.max_wait = max_wait
+        self.max_updates = max_updates
+        self.index = VnicIndex()
+        self.version = ''
+        self.view = self.collector = self.filter = None
+
+    def start(self):
+        """
+        Creates the view of all hosts and a property collector of its own with the filter, the session collector
+        is left to other callers
+        """
+        self.view = self.content.viewManager.CreateContainerView(self.content.rootFolder, [vim.HostSystem], True)
+        self.collector = self.content.propertyCollector.CreatePropertyCollector()
+        self.filter = self.collector.CreateFilter(host_filter_spec(self.view), partialUpdates=False)
+        self.version = ''
+
+    def poll(self):
+        """
+        Waits up to max_wait seconds for updates and applies them to the index
+
+        Returns:
+            list -- HostVnics of the hosts that entered or changed, empty if nothing changed
+        """
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=self.max_wait,
+                                                            maxObjectUpdates=self.max_updates)
+        changed = set()
+        while True:
+            update_set = self.collector.WaitForUpdatesEx(self.version, options)
+            if update_set is None:
+                break
+            self.version = update_set.version
+            changed |= self.index.apply(update_set)
+            if not update_set.truncated:
+                break
+            # the rest of the updates is ready, fetched without waiting
+            options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=0, maxObjectUpdates=self.max_updates)
+        hosts = [self.index.hosts[hostid] for hostid in sorted(changed) if hostid in self.index.hosts]
+        return filter_hosts(hosts, self.name_filter)
+
+    def check(self):
+        """
+        Polls once and fixes the changed hosts with an MTU below min_mtu
+
+        Returns:
+            list -- one dict per adapter as returned by Remediation.run
+        """
+        violations = mtu_violations(self.poll(), self.min_mtu)
+        if not violations:
+            return []
+        return self.remediation().run(violations)
+
+    def close(self):
+        for obj in (self.filter, self.collector, self.view):
+            if obj is None:
+                continue
+            try:
+                obj.Destroy()
+            except Exception:
+                # the session is gone, so are the objects it created
+                pass
+        self.view = self.collector = self.filter = None
@@ -0,0 +1,64 @@
+#
+## Benchmark - throughput of RESTful.postmany() against a local stand-in API with a fixed response latency
+## Reports events per second for increasing max_in_flight, and for batched requests
+##
+## Usage: python bench_delivery.py [number of events, default 400] [stand-in latency in ms, default 20]
+#
+import sys, os, json, time, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'handler'))
+import handler
+
+EVENT = json.loads('{"id":"453120cd-3d19-4c43-aadc-df0cdbce3887","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"VmPoweredOnEvent","time":"2020-04-13T23:46:10.402531287Z","data":{"Key":7441,"ChainId":7438,"CreatedTime":"2020-04-13T23:46:09.387283Z","UserName":"Administrator","Datacenter":{"Name":"PKLAB","Datacenter":{"Type":"Datacenter","Value":"datacenter-3"}},"ComputeResource":{"Name":"esxi01.pdotk.local","ComputeResource":{"Type":"ComputeResource","Value":"domain-s29"}},"Host":{"Name":"esxi01.pdotk.local","Host":{"Type":"HostSystem","Value":"host-31"}},"Vm":{"Name":"Test VM","Vm":{"Type":"VirtualMachine","Value":"vm-33"}},"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"Test VM on esxi01.pdotk.local in PKLAB has powered on","ChangeTag":"","Template":false},"datacontenttype":"application/json"}')
+LATENCY = 0.02
+
+class StandIn(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(LATENCY)
+        reply = b'{"ok":true}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, format, *args):
+        pass
+
+def run(config, count, max_in_flight, batch_size):
+    config = dict(config, delivery={'max_in_flight': max_in_flight, 'batch_size': batch_size})
+    s = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=max_in_flight, pool_maxsize=max_in_flight)
+    s.mount('http://', adapter)
+    restful = handler.RESTful(s, config, None)
+    start = time.perf_counter()
+    results = list(restful.postmany(EVENT for _ in range(count)))
+    elapsed = time.perf_counter() - start
+    s.close()
+    assert len(results) == count and all(r.status == '200' for r in results)
+    return count / elapsed
+
+def main():
+    global LATENCY
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    LATENCY = (float(sys.argv[2]) if len(sys.argv) > 2 else 20) / 1000
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    here = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(here, 'metaconfig-slack.json'), 'r') as configfile:
+        config = json.load(configfile)
+    config['url'] = f'http://127.0.0.1:{server.server_port}/hook'
+
+    print(f'{count} events, stand-in latency {LATENCY*1000:.0f}ms')
+    print(f'{"max_in_flight":>14}{"batch_size":>12}{"events/s":>12}')
+    for max_in_flight, batch_size in [(1, 1), (2, 1), (4, 1), (8, 1), (16, 1), (32, 1), (8, 10), (8, 50)]:
+        print(f'{max_in_flight:>14}{batch_size:>12}{run(config, count, max_in_flight, batch_size):>12.0f}')
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
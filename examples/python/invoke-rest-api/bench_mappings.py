@@ -0,0 +1,68 @@
+#
+## Microbenchmark - per event cost of building the request body from the metaconfig mappings
+## Compares the dpath walk the handler used to do for every event with the precompiled mappings, and a Slack message
+## template parsed again for every event with the template compiled once
+##
+## Usage: python bench_mappings.py [number of events, default 20000]
+#
+import sys, os, json, timeit
+import dpath.util
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'handler'))
+import handler
+
+CONFIGS = ['metaconfig-slack.json', 'metaconfig-jira.json', 'metaconfig-snow.json']
+EVENT = json.loads('{"id":"453120cd-3d19-4c43-aadc-df0cdbce3887","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"VmPoweredOnEvent","time":"2020-04-13T23:46:10.402531287Z","data":{"Key":7441,"ChainId":7438,"CreatedTime":"2020-04-13T23:46:09.387283Z","UserName":"Administrator","Datacenter":{"Name":"PKLAB","Datacenter":{"Type":"Datacenter","Value":"datacenter-3"}},"ComputeResource":{"Name":"esxi01.pdotk.local","ComputeResource":{"Type":"ComputeResource","Value":"domain-s29"}},"Host":{"Name":"esxi01.pdotk.local","Host":{"Type":"HostSystem","Value":"host-31"}},"Vm":{"Name":"Test VM","Vm":{"Type":"VirtualMachine","Value":"vm-33"}},"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"Test VM on esxi01.pdotk.local in PKLAB has powered on","ChangeTag":"","Template":false},"datacontenttype":"application/json"}')
+
+def dpathbody(body, mappings, event):
+    # validation walk done by handle() followed by the dpath get/set done by RESTful.getbody()
+    for mapping in mappings:
+        dpath.util.get(body, mapping['push'])
+        dpath.util.get(event, mapping['pull'])
+    for mapping in mappings:
+        dpath.util.set(body, mapping['push'], dpath.util.get(event, mapping['pull']))
+    return body
+
+TEMPLATE = {'text': '${subject}: VM ${data/Vm/Name} on ${data/Host/Name} in ${data/Datacenter/Name|unknown datacenter}',
+            'blocks': [{'type': 'section', 'text': {'type': 'mrkdwn', 'text': '*${data/Vm/Name}* (${data/Vm/Vm/Value}) by ${data/UserName}'}}]}
+
+def parsedbody(body, event):
+    # the template expressions found and resolved with dpath for every event
+    def value(match):
+        path, _, default = match.group(1).partition('|')
+        try:
+            found = dpath.util.get(event, path)
+        except KeyError:
+            return default
+        return default if found is None else str(found)
+    def walk(node):
+        if isinstance(node, dict):
+            return {key: walk(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [walk(value) for value in node]
+        return handler.TEMPLATE_EXPR.sub(value, node) if isinstance(node, str) else node
+    return walk(body)
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    here = os.path.dirname(os.path.abspath(__file__))
+    print(f'{"metaconfig":<24}{"mappings":>10}{"dpath us/event":>16}{"compiled us/event":>20}{"speedup":>10}')
+    for name in CONFIGS:
+        with open(os.path.join(here, name), 'r') as configfile:
+            config = json.load(configfile)
+        body, mappings = config['body'], config['mappings']
+        compiled = handler.CompiledMappings(body, mappings)
+        assert compiled.render(EVENT) == dpathbody(json.loads(json.dumps(body)), mappings, EVENT)
+
+        legacy = min(timeit.repeat(lambda: dpathbody(body, mappings, EVENT), number=number, repeat=3)) / number
+        fast = min(timeit.repeat(lambda: compiled.render(EVENT), number=number, repeat=3)) / number
+        print(f'{name:<24}{len(mappings):>10}{legacy*1e6:>16.2f}{fast*1e6:>20.2f}{legacy/fast:>9.1f}x')
+
+    compiled = handler.CompiledMappings(TEMPLATE, [])
+    assert compiled.render(EVENT) == parsedbody(TEMPLATE, EVENT)
+    legacy = min(timeit.repeat(lambda: parsedbody(TEMPLATE, EVENT), number=number, repeat=3)) / number
+    fast = min(timeit.repeat(lambda: compiled.render(EVENT), number=number, repeat=3)) / number
+    print(f'{"template (per event)":<24}{"6 exprs":>10}{legacy*1e6:>16.2f}{fast*1e6:>20.2f}{legacy/fast:>9.1f}x')
+
+if __name__ == '__main__':
+    main()
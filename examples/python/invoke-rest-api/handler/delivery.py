@@ -0,0 +1,127 @@
+import threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+class RateLimiter:
+    """
+    RateLimiter is a token bucket shared by all workers posting to the same endpoint
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        Arguments:
+            rate {float} -- [requests per second]
+            burst {int} -- [requests that can be sent at once before the rate applies, defaults to one second worth]
+        """
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a request may be sent
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+LIMITERS = {}
+LIMITERS_LOCK = threading.Lock()
+
+def endpointlimiter(url, rate):
+    """
+    Returns the rate limiter for an endpoint, limiters are kept per process so a warm process
+    honours the limit across invocations
+    """
+    with LIMITERS_LOCK:
+        limiter = LIMITERS.get(url)
+        if limiter is None or limiter.rate != rate:
+            limiter = LIMITERS[url] = RateLimiter(rate)
+        return limiter
+
+class Delivery:
+    """
+    Delivery renders and posts a stream of events concurrently. At most max_in_flight requests are
+    outstanding at any time, the results are returned in the order of the events
+    """
+
+    def __init__(self, render, post, max_in_flight=8, rate_limiter=None, batch_size=1):
+        """
+        Arguments:
+            render {function} -- [builds the request body for an event, returns a FaaSResponse for events that can't be rendered]
+            post {function} -- [posts a request body (or a list of bodies when batching) and returns a FaaSResponse]
+            max_in_flight {int} -- [number of concurrent requests]
+            rate_limiter {RateLimiter} -- [limits the request rate to the endpoint, optional]
+            batch_size {int} -- [number of events sent as a JSON array in one request, 1 sends the bodies as they are]
+        """
+        self.render = render
+        self.post = post
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.rate_limiter = rate_limiter
+        self.batch_size = max(1, int(batch_size))
+
+    def send(self, body):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        return self.post(body)
+
+    def deliver(self, events):
+        """
+        Delivers the events, consuming the iterable lazily so memory stays bounded for long streams
+
+        Arguments:
+            events {iterable} -- [CloudEvents as dict]
+
+        Returns:
+            [generator] -- [one FaaSResponse per event, in order]
+        """
+        # pending holds [result or future, number of events it answers] in event order
+        pending = deque()
+        inflight = 0
+        batch = []
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            def submit(bodies):
+                body = bodies if self.batch_size > 1 else bodies[0]
+                pending.append([pool.submit(self.send, body), len(bodies)])
+
+            for event in events:
+                rendered = self.render(event)
+                if isinstance(rendered, (dict, list)):
+                    batch.append(rendered)
+                    if len(batch) >= self.batch_size:
+                        submit(batch)
+                        inflight += 1
+                        batch = []
+                else:
+                    # keep the order of the results, the events before the failed one go out first
+                    if batch:
+                        submit(batch)
+                        inflight += 1
+                        batch = []
+                    pending.append([rendered, 1])
+
+                while inflight >= self.max_in_flight or len(pending) > 2 * self.max_in_flight:
+                    for res in self.pop(pending):
+                        yield res
+                    inflight = sum(1 for entry in pending if hasattr(entry[0], 'result'))
+
+            if batch:
+                submit(batch)
+            while pending:
+                for res in self.pop(pending):
+                    yield res
+
+    def pop(self, pending):
+        result, count = pending.popleft()
+        if hasattr(result, 'result'):
+            result = result.result()
+        return [result] * count
@@ -1,31 +1,32 @@
-import sys, json, os
-import urllib3
-import requests
-import dpath.util
+import sys, json, os, re, contextlib
+import logging
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
-# GLOBAL_VARS
-DEBUG=False
-class bgc:
-    HEADER = '\033[95m'
-    OKBLUE = '\033[94m'
-    OKGREEN = '\033[92m'
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
-    BOLD = '\033[1m'
-    UNDERLINE = '\033[4m'
-
-if(os.getenv("insecure_ssl")):
-    # Surpress SSL warnings
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-if(os.getenv("write_debug")):
-    sys.stderr.write(f"{bgc.WARNING}WARNING!! DEBUG has been enabled for this function. Sensitive information could be printed to sysout{bgc.ENDC} \n")
-    DEBUG=True
-
-def debug(s):
-    if DEBUG:
-        sys.stderr.write(s+" \n") #Syserr only get logged on the console logs
+try:
+    from .delivery import Delivery, endpointlimiter
+    from .vebalog import getlogger, pretty
+    from .vebatch import batched
+    from .vecevent import DecodeError, dumps, loads
+    from .vefilter import EventFilter
+    from .velazy import lazy, preload
+    from .vetiming import Timings
+except ImportError:
+    from delivery import Delivery, endpointlimiter
+    from vebalog import getlogger, pretty
+    from vebatch import batched
+    from vecevent import DecodeError, dumps, loads
+    from vefilter import EventFilter
+    from velazy import lazy, preload
+    from vetiming import Timings
+
+# imported on first use, see velazy.py - dpath only for mappings with wildcards
+requests = lazy('requests')
+urllib3 = lazy('urllib3')
+dpath = lazy('dpath')
+
+# debug records (write_debug env) are only formatted when they are emitted, see vebalog.py
+log = getlogger('invoke-rest-api')
 
 #
 ### Paths and Endpoints
@@ -33,6 +34,16 @@ def debug(s):
 #
 META_CONFIG='/var/openfaas/secrets/metaconfig'
 
+#
+### Warm-process mode
+### With the of-watchdog http mode (eg. the python3-flask template) the process serves many events, so the
+### parsed config and the HTTP connection pool are kept between invocations instead of being set up per event
+#
+WARM_PROCESS = bool(os.getenv("warm_process")) or os.getenv("mode") == "http"
+if WARM_PROCESS:
+    preload(requests, urllib3)
+POOL_SIZE = int(os.getenv("pool_size", "10"))
+
 class FaaSResponse:
     """
     FaaSResponse is a helper class to construct a properly formatted message returned by this function.
@@ -47,12 +58,393 @@ class FaaSResponse:
         self.status=status
         self.message=message
 
+#
+### Mapping compiler
+### push/pull paths are parsed once per config so building a body per event is a plain copy-and-fill
+#
+GLOB_CHARS = re.compile(r'[*?]|\[(?!\d+\])')
+INDEX_SEGMENT = re.compile(r'^\[(\d+)\]$')
+
+def parsepath(path):
+    """
+    Splits a dpath style path (eg. blocks/[1]/fields/[0]/text) into a tuple of keys
+    
+    Arguments:
+        path {str} -- [slash separated path, list indices can be given as [N] or N]
+    
+    Returns:
+        [tuple] -- [keys with list indices converted to int]
+    """
+    keys = []
+    for segment in path.strip('/').split('/'):
+        index = INDEX_SEGMENT.match(segment)
+        keys.append(int(index.group(1)) if index else segment)
+    return tuple(keys)
+
+def resolvekey(obj, key):
+    """
+    Resolves a single key against a dict or a list the same way dpath does
+    
+    Raises:
+        KeyError -- [if the key does not exist in obj]
+    """
+    try:
+        if isinstance(obj, list):
+            return int(key)
+        if key in obj:
+            return key
+    except (TypeError, ValueError):
+        pass
+    raise KeyError(key)
+
+def pullgetter(path):
+    """
+    Compiles a pull path into a function that returns the value of that path from an event
+    
+    Arguments:
+        path {str} -- [path within the CloudEvent, eg. data/Vm/Vm/Value]
+    
+    Returns:
+        [function] -- [getter taking the event dict]
+    """
+    if GLOB_CHARS.search(path):
+        # globs have to be matched against every event, leave those to dpath
+        return lambda event: dpath.util.get(event, path)
+
+    keys = parsepath(path)
+    def get(event):
+        obj = event
+        for key in keys:
+            try:
+                obj = obj[key]
+            except (TypeError, IndexError, KeyError):
+                try:
+                    obj = obj[resolvekey(obj, key)]
+                except (TypeError, IndexError, KeyError):
+                    raise KeyError(path)
+        return obj
+    return get
+
+#
+### Templates
+### string values of the body with ${path} expressions (eg. "VM ${data/Vm/Name} on ${data/Host/Name} powered on") are
+### compiled once per config into a %-format string and the getters of their paths
+#
+TEMPLATE_EXPR = re.compile(r'\$\$|\$\{([^{}|]+)(?:\|([^{}]*))?\}')
+
+def templatetext(value, default):
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value
+    return dumps(value)
+
+def templategetter(text):
+    """
+    Compiles a body value with ${path} expressions into a function that renders it for an event. A path missing in
+    the event (or null) gives the default of ${path|default}, an empty string without one. A value that is a single
+    ${path} is replaced by the value of the path itself (eg. a number), null if it is missing and has no default.
+    $$ is a literal $
+
+    Arguments:
+        text {str} -- [string value from the body template]
+
+    Returns:
+        [function] -- [renderer taking the event dict, None if text has no expression]
+
+    Raises:
+        ValueError -- [an expression is not closed]
+    """
+    if '${' not in text:
+        return None
+    parts, getters, pos = [], [], 0
+    for match in TEMPLATE_EXPR.finditer(text):
+        parts.append(text[pos:match.start()])
+        if match.group(1) is None:
+            parts.append('$')
+        else:
+            getters.append((pullgetter(match.group(1).strip()), match.group(2)))
+            parts.append(None)
+        pos = match.end()
+    parts.append(text[pos:])
+    if any(part is not None and '${' in part for part in parts):
+        raise ValueError(f'template "{text}" has an expression that is not closed')
+
+    if parts == ['', None, '']:
+        get, default = getters[0]
+        def value(event):
+            try:
+                found = get(event)
+            except KeyError:
+                return default
+            return default if found is None and default is not None else found
+        return value
+
+    fmt = ''.join('%s' if part is None else part.replace('%', '%%') for part in parts)
+    getters = [(get, default or '') for get, default in getters]
+    def render(event):
+        values = []
+        for get, default in getters:
+            try:
+                values.append(templatetext(get(event), default))
+            except KeyError:
+                values.append(default)
+        return fmt % tuple(values)
+    return render
+
+class CompiledMappings:
+    """
+    CompiledMappings validates the metaconfig mappings against the body template and compiles its templates once,
+    it renders the request body for an event by copying only the containers that are written to
+    """
+
+    def __init__(self, body, mappings):
+        """
+        Arguments:
+            body {dict} -- [body template from the metaconfig, never modified]
+            mappings {list} -- [push/pull mappings from the metaconfig]
+        
+        Raises:
+            KeyError -- [push path does not exist in the body template]
+            ValueError -- [push path matches multiple keys or overlaps with another push path, template not closed]
+        """
+        self.template = body
+        self.tree = {}
+        for mapping in mappings:
+            pushkeys = self.pushkeys(mapping['push'])
+            getter = pullgetter(mapping['pull'])
+            log.debug('Config has key "%s" >>> Event key "%s"', mapping["push"], mapping["pull"])
+            node = self.tree
+            for key in pushkeys[:-1]:
+                node = node.setdefault(key, {})
+                if not isinstance(node, dict):
+                    raise ValueError(f'push path "{mapping["push"]}" overlaps with another mapping')
+            if isinstance(node.get(pushkeys[-1]), dict):
+                raise ValueError(f'push path "{mapping["push"]}" overlaps with another mapping')
+            node[pushkeys[-1]] = getter
+        self.addtemplates(body, self.tree)
+
+    def addtemplates(self, node, tree):
+        """adds the renderers of the templated string values below node to tree, the templates at or below a key
+        a mapping pushes to are dropped"""
+        for key, value in (enumerate(node) if isinstance(node, list) else node.items()):
+            current = tree.get(key)
+            if current is not None and not isinstance(current, dict):
+                continue # pushed by a mapping
+            if isinstance(value, str):
+                render = templategetter(value)
+                if render is not None:
+                    tree[key] = render
+            elif isinstance(value, (dict, list)):
+                sub = current if current is not None else {}
+                self.addtemplates(value, sub)
+                if sub:
+                    tree[key] = sub
+
+    def pushkeys(self, path):
+        """
+        Resolves a push path to the concrete keys of the body template
+        
+        Returns:
+            [tuple] -- [keys with list indices as int]
+        """
+        if GLOB_CHARS.search(path):
+            found = [match for match, _ in dpath.util.search(self.template, path, yielded=True)]
+            if not found:
+                raise KeyError(path)
+            if len(found) > 1:
+                raise ValueError(f'multiple keys found for "{path}": {found}')
+            path = found[0]
+
+        keys = []
+        obj = self.template
+        for key in parsepath(path):
+            key = resolvekey(obj, key)
+            try:
+                obj = obj[key]
+            except IndexError:
+                raise KeyError(path)
+            keys.append(key)
+        if not keys:
+            raise KeyError(path)
+        return tuple(keys)
+
+    def render(self, event):
+        """
+        Builds the request body for an event
+        
+        Arguments:
+            event {dict} -- [Cloud Event from vCenter]
+        
+        Returns:
+            [dict] -- [body with all mappings applied, sharing untouched parts with the template]
+        
+        Raises:
+            KeyError -- [pull path does not exist in the event]
+        """
+        return fill(self.template, self.tree, event)
+
+def fill(node, tree, event):
+    copy = list(node) if isinstance(node, list) else dict(node)
+    for key, sub in tree.items():
+        if isinstance(sub, dict):
+            copy[key] = fill(node[key], sub, event)
+        else:
+            copy[key] = sub(event)
+    return copy
+
+class Target:
+    """
+    Target is one destination of the metaconfig, its settings (url, auth, headers, body, mappings, delivery) and the
+    compiled mappings of its body
+    """
+
+    def __init__(self, config, name=None):
+        """
+        Arguments:
+            config {dict} -- [the metaconfig, or one entry of its "targets"]
+            name {str} -- [name of the target in the results, None for a metaconfig with a single destination]
+
+        Raises:
+            KeyError -- [required key missing in the config or push path not found in the body]
+            ValueError -- [push path matches multiple keys, template not closed or invalid delivery setting]
+        """
+        #Config - checking for required fields, url (not validating if an actual URL is provided), auth (can be empty
+        #for no auth but a required key) and headers (not validating sanctity of headers) are read per request
+        for key in ('url', 'auth', 'headers'):
+            config[key]
+        body = config['body'] #json only supported
+        mappings = config['mappings'] #mapping can be empty array but the key needs to be present in the config
+        delivery = config.get('delivery', {}) #optional, concurrency settings used when a list of events is posted
+        for key in ('max_in_flight', 'rate_limit', 'batch_size'):
+            if key in delivery and not isinstance(delivery[key], (int, float)):
+                raise ValueError(f'delivery setting "{key}" must be a number')
+        self.name = name
+        self.config = config
+        self.mappings = CompiledMappings(body, mappings)
+
+    def render(self, event):
+        """
+        Returns:
+            [dict] -- [request body for the event, a FaaSResponse if the event can not be rendered]
+        """
+        try:
+            return self.mappings.render(event)
+        except (KeyError, TypeError) as err:
+            return FaaSResponse('400','Invalid JSON, required key not found > KeyError: {0}'.format(err))
+        except ValueError as err:
+            return FaaSResponse('400','Invalid mapping, multiple keys found > ValueError: {0}'.format(err))
+
+def loadtargets(metaconfig):
+    """
+    Returns the targets of a metaconfig, one for a metaconfig with a url and a body, the entries of "targets" for a
+    metaconfig sending every event to several destinations
+
+    Raises:
+        KeyError -- [required key missing in a target]
+        ValueError -- [invalid target]
+    """
+    if 'targets' not in metaconfig:
+        return [Target(metaconfig)]
+    configs = metaconfig['targets']
+    if not isinstance(configs, list) or not configs:
+        raise ValueError('"targets" must be a list of destinations')
+    targets = [Target(config, config.get('name') or config['url']) for config in configs]
+    names = [target.name for target in targets]
+    if len(set(names)) != len(names):
+        raise ValueError(f'target names must be unique: {names}')
+    return targets
+
+class ConfigCache:
+    """
+    ConfigCache holds the parsed metaconfig and its targets with their compiled mappings. The file is only parsed
+    again when its path or modification time changes, so a warm process picks up an updated secret without restarting
+    """
+
+    def __init__(self):
+        self.path = None
+        self.mtime = None
+        self.config = None
+        self.targets = None
+
+    def load(self, path):
+        """
+        Returns the config for path, reading and compiling it if it is not cached or has changed
+        
+        Arguments:
+            path {str} -- [path to the metaconfig file]
+        
+        Returns:
+            [tuple] -- [metaconfig dict and its list of Target]
+        
+        Raises:
+            OSError -- [config could not be read]
+            JSONDecodeError -- [config is not valid JSON]
+            KeyError -- [required key missing in the config or push path not found in the body]
+            ValueError -- [push path matches multiple keys, template not closed or invalid targets]
+        """
+        mtime = os.stat(path).st_mtime_ns
+        if self.config is not None and path == self.path and mtime == self.mtime:
+            return self.config, self.targets
+
+        with open(path, 'r') as prodconfig:
+            metaconfig = json.load(prodconfig)
+        targets = loadtargets(metaconfig)
+
+        log.debug('Loaded configuration with %d target(s) (warm process: %s)', len(targets), WARM_PROCESS)
+        self.path, self.mtime, self.config, self.targets = path, mtime, metaconfig, targets
+        return metaconfig, targets
+
+CONFIG_CACHE = ConfigCache()
+TIMINGS = Timings('invoke-rest-api', WARM_PROCESS)
+FILTER = EventFilter.fromenv()
+SESSION = None
+# the requests to the targets of an event after the first one, threads are only started when needed
+FANOUT = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='fanout')
+
+def getsession():
+    """
+    Returns the requests session used for the Rest API calls. Connections are pooled (pool_size env) and kept alive,
+    in warm-process mode the same session is handed out for every invocation
+    
+    Returns:
+        [session] -- [Request Connection]
+    """
+    global SESSION
+    if WARM_PROCESS and SESSION is not None:
+        return SESSION
+    s=requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    s.mount('https://', adapter)
+    s.mount('http://', adapter)
+    if(os.getenv("insecure_ssl")):
+        # Surpress SSL warnings
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        s.verify=False
+    if WARM_PROCESS:
+        SESSION = s
+    return s
+
+@contextlib.contextmanager
+def batchscope():
+    """the session and the configuration are kept for a batch of events (see vebatch.py), as in warm-process mode"""
+    global WARM_PROCESS, SESSION
+    warm, WARM_PROCESS = WARM_PROCESS, True
+    try:
+        getsession() #created before the events of the batch are handled concurrently
+        yield
+    finally:
+        WARM_PROCESS = warm
+        if not warm and SESSION is not None:
+            SESSION.close()
+            SESSION = None
+
 class RESTful:
     """
     RESTful is a class which aims to make Rest API calls easily without writing any code
     """    
 
-    def __init__(self, conn, config, event):
+    def __init__(self, conn, config, event, mappings=None):
         """
         Constructor for RESTful class
         
@@ -60,10 +452,14 @@ class RESTful:
             conn {session} -- [Request Connection]
             config {dict} -- [Config with URL, Body and Mapping for Rest API call]
             event {dict} -- [Cloud Event from vCenter]
+            mappings {CompiledMappings} -- [precompiled config mappings, compiled from config if not provided]
         """   
         self.session = conn
         self.config = config
         self.event = event
+        if mappings is None:
+            mappings = CompiledMappings(config['body'], config['mappings'])
+        self.mappings = mappings
     
     def geturl(self):
         """
@@ -84,7 +480,7 @@ class RESTful:
         try:
             auth = (ref['un'], ref['pwd'])
         except (TypeError,KeyError) as err:
-            debug(f'Unexpected auth param provided, assuming no auth > "{ref}"')
+            log.debug('Unexpected auth param provided, assuming no auth > "%s"', ref)
             auth = None
         return auth
     
@@ -95,154 +491,280 @@ class RESTful:
         Returns:
             [dict] -- [JSON constructed body]
         """
-        body = self.config['body']
-        mappings = self.config['mappings']
-        for mapping in mappings:
-            pushvalue = mapping['push']
-            pullvalue = mapping['pull']
-            #debug(f'Attempting mapping of Body:{pushvalue} with CloudEvent:{pullvalue}')
-            #debug(f'Replacing >>> {dpath.util.get(body, pushvalue)} with ::: {dpath.util.get(self.event, pullvalue)}')
-            dpath.util.set(body, pushvalue, dpath.util.get(self.event, pullvalue))
-        return body
+        return self.mappings.render(self.event)
+
+    def postmany(self, events):
+        """
+        Renders and posts a list (or any iterable) of events concurrently, as configured by the optional
+        "delivery" section of the config: max_in_flight requests at once (default 8), rate_limit requests
+        per second to the endpoint (default unlimited) and batch_size events per request for endpoints
+        accepting a JSON array (default 1, no batching)
+        
+        Arguments:
+            events {iterable} -- [Cloud Events from vCenter]
+        
+        Returns:
+            [generator] -- [FaaSResponse for every event, in order]
+        """
+        settings = self.config.get('delivery', {})
+        limiter = None
+        if settings.get('rate_limit'):
+            limiter = endpointlimiter(self.geturl(), settings['rate_limit'])
+
+        def render(event):
+            try:
+                return self.mappings.render(event)
+            except (KeyError, TypeError) as err:
+                return FaaSResponse('400','Invalid JSON, required key not found > KeyError: {0}'.format(err))
+            except ValueError as err:
+                return FaaSResponse('400','Invalid mapping, multiple keys found > ValueError: {0}'.format(err))
+
+        def post(body):
+            try:
+                return self.post(body)
+            except Exception as err:
+                return FaaSResponse('500','Unexpected error occurred > Exception: {0}'.format(err))
 
-    # PagerDuty REST API implementation        
-    def post(self):
+        delivery = Delivery(render, post,
+                            max_in_flight=settings.get('max_in_flight', 8),
+                            rate_limiter=limiter,
+                            batch_size=settings.get('batch_size', 1))
+        return delivery.deliver(events)
+
+    # REST API call to the configured endpoint
+    def post(self, bodyObj=None):
         """
         Function to make the POST call to the endpoint
         
+        Arguments:
+            bodyObj {dict} -- [already rendered request body, rendered from the event if not provided]
+        
         Returns:
             [FaaSResponse] -- [Formatted message for OpenFaaS]
         """
         
         urlPath = self.geturl()
-        debug(f'{bgc.OKBLUE}> URL: {bgc.ENDC}{urlPath}')
+        log.debug('> URL: %s', urlPath)
         authObj = self.getauth()
-        #debug(f'{bgc.OKBLUE}> Auth: {bgc.ENDC}{authObj}') #don't want auth printed
         headerObj = self.getheaders()
-        debug(f'{bgc.OKBLUE}> Headers: {bgc.ENDC}{json.dumps(headerObj, indent=4)}')
-        bodyObj = self.getbody()
-        debug(f'{bgc.OKBLUE}> Body: {bgc.ENDC}{json.dumps(bodyObj, indent=4)}')
+        log.debug('> Headers: %s', pretty(headerObj))
+        if bodyObj is None:
+            bodyObj = self.getbody()
+        log.debug('> Body: %s', pretty(bodyObj))
         try:
             resp = self.session.post(urlPath, auth=authObj, json=bodyObj, headers=headerObj)
             resp.raise_for_status()
-            try:
-                resp_body = json.loads(resp.text)
-                debug(f'{bgc.OKBLUE}> Response: {bgc.ENDC}{json.dumps(resp_body, indent=4, sort_keys=True)}')
-            except json.JSONDecodeError as err:
-                debug(f'{bgc.OKBLUE}> Response: {bgc.ENDC}{resp.text}') #some apis don't return json
+            if log.isEnabledFor(logging.DEBUG): #the response is only parsed for the log
+                try:
+                    log.debug('> Response: %s', pretty(loads(resp.text), sort_keys=True))
+                except DecodeError:
+                    log.debug('> Response: %s', resp.text) #some apis don't return json
             
             return FaaSResponse('200', f'Response:{resp.text}')
         except requests.HTTPError as err:
             return FaaSResponse('500', 'Could not executed REST API > HTTPError: {0}'.format(err))
 
+def combine(targets, results):
+    """
+    Combines the results of the targets of an event
+    
+    Returns:
+        [FaaSResponse] -- [status 200 if every target succeeded, 207 if some did, the status of the first failure
+                           otherwise, with the result of every target in targets]
+    """
+    succeeded = sum(1 for res in results if res.status == '200')
+    if succeeded == len(results):
+        status = '200'
+    elif succeeded:
+        status = '207'
+    else:
+        status = results[0].status
+    res = FaaSResponse(status, f'{succeeded} of {len(results)} targets succeeded')
+    res.targets = [{'target': target.name, 'status': r.status, 'message': r.message} for target, r in zip(targets, results)]
+    return res
+
+def fanout(conn, event, targets, bodies):
+    """
+    Posts the bodies rendered for an event to their targets at the same time, a target that fails or can not be
+    rendered does not keep the event from the others
+    
+    Arguments:
+        conn {session} -- [Request Connection, shared by the targets]
+        event {dict} -- [Cloud Event from vCenter]
+        targets {list} -- [Target of the metaconfig]
+        bodies {list} -- [request body (or FaaSResponse) rendered for every target]
+    
+    Returns:
+        [FaaSResponse] -- [see combine()]
+    """
+    def post(target, body):
+        if isinstance(body, FaaSResponse):
+            return body
+        try:
+            return RESTful(conn, target.config, event, target.mappings).post(body)
+        except Exception as err:
+            traceback.print_exc(limit=1, file=sys.stderr)
+            return FaaSResponse('500','Unexpected error occurred > Exception: {0}'.format(err))
+
+    futures = [FANOUT.submit(post, target, body) for target, body in zip(targets[1:], bodies[1:])]
+    results = [post(targets[0], bodies[0])] + [future.result() for future in futures]
+    return combine(targets, results)
+
+def fanoutmany(conn, events, targets):
+    """
+    Posts a list of events to every target, the targets are served at the same time with their own delivery settings
+    
+    Returns:
+        [list] -- [combined FaaSResponse for every event, in order]
+    """
+    def postmany(target):
+        return list(RESTful(conn, target.config, None, target.mappings).postmany(events))
+
+    futures = [FANOUT.submit(postmany, target) for target in targets[1:]]
+    results = [postmany(targets[0])] + [future.result() for future in futures]
+    return [combine(targets, list(eventresults)) for eventresults in zip(*results)]
+
+@batched(batchscope)
+@TIMINGS.timed
 def handle(req):
     
+    # Events the function is not set up for are rejected before they are decoded, with the filter_* env set in
+    # stack.yml (see vefilter.py) - a list of events is passed on if any of them matches
+    with TIMINGS.stage('filter'):
+        rejected = FILTER.reject(req)
+    if rejected:
+        res = FaaSResponse('200','Event filtered out > {0}'.format(rejected))
+        return dumps(vars(res))
+
     # Load the Events that function gets from vCenter through the Event Router
-    debug(f'{bgc.HEADER}Reading Cloud Event: {bgc.ENDC}')
-    debug(f'{bgc.OKBLUE}Event > {bgc.ENDC}{req}')
-    try:
-        cevent = json.loads(req)
-    except json.JSONDecodeError as err:
-        res = FaaSResponse('400','Invalid JSON > JSONDecodeError: {0}'.format(err))
-        print(json.dumps(vars(res)))
-        return
-
-    # Load the Config File
-    debug(f'{bgc.HEADER}Reading Configuration file: {bgc.ENDC}')
-    debug(f'{bgc.OKBLUE}Config File > {bgc.ENDC}{META_CONFIG}')
-    try: 
-        with open(META_CONFIG, 'r') as prodconfig:
-            metaconfig = json.load(prodconfig)
-    except json.JSONDecodeError as err:
-        res = FaaSResponse('400','Invalid JSON > JSONDecodeError: {0}'.format(err))
-        print(json.dumps(vars(res)))
-        return
-    except OSError as err:
-        res = FaaSResponse('500','Could not read configuration > OSError: {0}'.format(err))
-        print(json.dumps(vars(res)))
-        return
-
-    #Validate CloudEvent and Configuration for mandatory fields
-    debug(f'{bgc.HEADER}Validating Input data and mapping: {bgc.ENDC}')
-    debug(f'{bgc.OKBLUE}Event > {bgc.ENDC}{json.dumps(cevent, indent=4, sort_keys=True)}')
-    debug(f'{bgc.OKBLUE}Config > {bgc.ENDC}{json.dumps(metaconfig, indent=4, sort_keys=True)}')
-    try:
-        #CloudEvent - simple validation
-        event = cevent['data']
-        
-        #Config - checking for required fields
-        url = metaconfig['url'] #not validating if an actual URL is provided
-        auth = metaconfig['auth'] #auth can be empty for no auth but a required key
-        headers = metaconfig['headers'] #not validating sanctity of headers
-        body = metaconfig['body'] #json only supported
-        mappings = metaconfig['mappings'] #mapping can be empty array but the key needs to be present in the config
-        
-        #supports 1-1 event-config mapping. next iteration can take complex 1-*(seperated by comma) mapping that will allow building out strings with values from the event
-        for mapping in mappings:
-            pushvalue = mapping['push']
-            debug(f'Config has key "{pushvalue}" >>> "{dpath.util.get(body, pushvalue)}"')
-            pullvalue = mapping['pull']
-            debug(f'Event has key "{pullvalue}" >>> "{dpath.util.get(cevent, pullvalue)}"')
-    except KeyError as err:
-        res = FaaSResponse('400','Invalid JSON, required key not found > KeyError: {0}'.format(err))
-        traceback.print_exc(limit=1, file=sys.stderr) #providing traceback since it helps debug the exact key that failed
-        print(json.dumps(vars(res)))
-        return
-    except ValueError as err:
-        res = FaaSResponse('400','Invalid mapping, multiple keys found > ValueError: {0}'.format(err))
-        traceback.print_exc(limit=1, file=sys.stderr) #providing traceback since it helps debug the exact key that failed
-        print(json.dumps(vars(res)))
-        return
-
-    # Make the Rest Api Call
-    s=requests.Session()
-    if(os.getenv("insecure_ssl")):
-        s.verify=False
-    
-    # with the metaconfig - which is the configuration file with the URL and body to make the call
-    # and with the cloud event - which is the event generated from vCenter
-    # we are going to build the request body and make the rest api call
-    debug(f'{bgc.HEADER}Attemping HTTP POST: {bgc.ENDC}')
-    try:
-        restful = RESTful(s, metaconfig, cevent)
-        res = restful.post()
-        print(json.dumps(vars(res)))
-    except Exception as err:
-        res = FaaSResponse('500','Unexpected error occurred > Exception: {0}'.format(err))
-        traceback.print_exc(limit=1, file=sys.stderr) #providing traceback since it helps debug the exact key that failed
-        print(json.dumps(vars(res)))
+    log.debug('Reading Cloud Event:')
+    log.debug('Event > %s', req)
+    with TIMINGS.stage('decode'):
+        try:
+            cevent = loads(req)
+        except DecodeError as err:
+            res = FaaSResponse('400','Invalid JSON > JSONDecodeError: {0}'.format(err))
+            return dumps(vars(res))
+
+    # Load the Config File - in warm-process mode this is only re-read when the secret changes
+    log.debug('Reading Configuration file:')
+    log.debug('Config File > %s', META_CONFIG)
+    with TIMINGS.stage('config'):
+        try:
+            metaconfig, targets = CONFIG_CACHE.load(META_CONFIG)
+        except json.JSONDecodeError as err:
+            res = FaaSResponse('400','Invalid JSON > JSONDecodeError: {0}'.format(err))
+            return dumps(vars(res))
+        except OSError as err:
+            res = FaaSResponse('500','Could not read configuration > OSError: {0}'.format(err))
+            return dumps(vars(res))
+        except KeyError as err:
+            res = FaaSResponse('400','Invalid JSON, required key not found > KeyError: {0}'.format(err))
+            traceback.print_exc(limit=1, file=sys.stderr) #providing traceback since it helps debug the exact key that failed
+            return dumps(vars(res))
+        except ValueError as err:
+            res = FaaSResponse('400','Invalid mapping, multiple keys found > ValueError: {0}'.format(err))
+            traceback.print_exc(limit=1, file=sys.stderr) #providing traceback since it helps debug the exact key that failed
+            return dumps(vars(res))
+    target = targets[0]
+
+    # A list of events (eg. a replay after an outage) is delivered concurrently, one result per event
+    if isinstance(cevent, list):
+        with TIMINGS.stage('dispatch'):
+            s=getsession()
+            log.debug('Attemping HTTP POST for %d events to %d target(s):', len(cevent), len(targets))
+            if target.name is None:
+                res = [vars(r) for r in RESTful(s, target.config, None, target.mappings).postmany(cevent)]
+            else:
+                res = [vars(r) for r in fanoutmany(s, cevent, targets)]
+        if not WARM_PROCESS:
+            s.close()
+        return dumps(res)
+
+    # With several targets the event is rendered for every target and sent to all of them at once
+    if target.name is not None:
+        log.debug('Event > %s', pretty(cevent, sort_keys=True))
+        with TIMINGS.stage('render'):
+            if not isinstance(cevent, dict) or 'data' not in cevent:
+                res = FaaSResponse('400','Invalid JSON, required key not found > KeyError: {0}'.format("'data'"))
+                return dumps(vars(res))
+            bodies = [t.render(cevent) for t in targets]
+        with TIMINGS.stage('dispatch'):
+            s=getsession()
+            log.debug('Attemping HTTP POST to %d targets:', len(targets))
+            res = fanout(s, cevent, targets, bodies)
+        if not WARM_PROCESS:
+            s.close()
+        return dumps(vars(res))
+
+    #Validate CloudEvent for mandatory fields
+    log.debug('Validating Input data and mapping:')
+    log.debug('Event > %s', pretty(cevent, sort_keys=True))
+    log.debug('Config > %s', pretty(metaconfig, sort_keys=True))
+    with TIMINGS.stage('render'):
+        try:
+            #CloudEvent - simple validation
+            cevent['data']
         
-    s.close()
+            #1-1 event-config mappings and ${path} templates in the body values that build out strings with values from the event
+            #push paths were validated and templates compiled when the config was loaded, pull paths are validated when the body is rendered for the event
+            reqbody = target.mappings.render(cevent)
+        except KeyError as err:
+            res = FaaSResponse('400','Invalid JSON, required key not found > KeyError: {0}'.format(err))
+            traceback.print_exc(limit=1, file=sys.stderr) #providing traceback since it helps debug the exact key that failed
+            return dumps(vars(res))
+        except ValueError as err:
+            res = FaaSResponse('400','Invalid mapping, multiple keys found > ValueError: {0}'.format(err))
+            traceback.print_exc(limit=1, file=sys.stderr) #providing traceback since it helps debug the exact key that failed
+            return dumps(vars(res))
+
+    # Make the Rest Api Call - the session and its connection pool are kept in warm-process mode
+    with TIMINGS.stage('dispatch'):
+        s=getsession()
+
+        # with the metaconfig - which is the configuration file with the URL and body to make the call
+        # and with the cloud event - which is the event generated from vCenter
+        # we are going to build the request body and make the rest api call
+        log.debug('Attemping HTTP POST:')
+        try:
+            restful = RESTful(s, target.config, cevent, target.mappings)
+            res = restful.post(reqbody)
+        except Exception as err:
+            res = FaaSResponse('500','Unexpected error occurred > Exception: {0}'.format(err))
+            traceback.print_exc(limit=1, file=sys.stderr) #providing traceback since it helps debug the exact key that failed
+
+    if not WARM_PROCESS:
+        s.close()
 
-    return
+    return dumps(vars(res))
 
 #
 ## Unit Test - helps testing the function locally
 ## Uncomment META_CONFIG - update the path to the file accordingly
-## Uncomment handle('...') to test the function with the event samples provided below test without deploying to OpenFaaS
+## Uncomment print(handle('...')) to test the function with the event samples provided below test without deploying to OpenFaaS
 #
 #META_CONFIG='metaconfig-pduty.json'
 
 #
 ## FAILURE CASES :Invalid Inputs
 #
-#handle('')
-#handle('"test":"ok"')
-#handle('{"test":"ok"}')
-#handle('{"data":"ok"}')
+#print(handle(''))
+#print(handle('"test":"ok"'))
+#print(handle('{"test":"ok"}'))
+#print(handle('{"data":"ok"}'))
 
 #
 ## FAILURE CASES :Unhandled Events
 # 
 # Standard : UserLogoutSessionEvent
-#handle('{"id":"17e1027a-c865-4354-9c21-e8da3df4bff9","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"UserLogoutSessionEvent","time":"2020-04-14T00:28:36.455112549Z","data":{"Key":7775,"ChainId":7775,"CreatedTime":"2020-04-14T00:28:35.221698Z","UserName":"machine-b8eb9a7f","Datacenter":null,"ComputeResource":null,"Host":null,"Vm":null,"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"User machine-b8ebe7eb9a7f@127.0.0.1 logged out (login time: Tuesday, 14 April, 2020 12:28:35 AM, number of API invocations: 34, user agent: pyvmomi Python/3.7.5 (Linux; 4.19.84-1.ph3; x86_64))","ChangeTag":"","IpAddress":"127.0.0.1","UserAgent":"pyvmomi Python/3.7.5 (Linux; 4.19.84-1.ph3; x86_64)","CallCount":34,"SessionId":"52edf160927","LoginTime":"2020-04-14T00:28:35.071817Z"},"datacontenttype":"application/json"}')
+#print(handle('{"id":"17e1027a-c865-4354-9c21-e8da3df4bff9","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"UserLogoutSessionEvent","time":"2020-04-14T00:28:36.455112549Z","data":{"Key":7775,"ChainId":7775,"CreatedTime":"2020-04-14T00:28:35.221698Z","UserName":"machine-b8eb9a7f","Datacenter":null,"ComputeResource":null,"Host":null,"Vm":null,"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"User machine-b8ebe7eb9a7f@127.0.0.1 logged out (login time: Tuesday, 14 April, 2020 12:28:35 AM, number of API invocations: 34, user agent: pyvmomi Python/3.7.5 (Linux; 4.19.84-1.ph3; x86_64))","ChangeTag":"","IpAddress":"127.0.0.1","UserAgent":"pyvmomi Python/3.7.5 (Linux; 4.19.84-1.ph3; x86_64)","CallCount":34,"SessionId":"52edf160927","LoginTime":"2020-04-14T00:28:35.071817Z"},"datacontenttype":"application/json"}'))
 # Eventex : vim.event.ResourceExhaustionStatusChangedEvent
-#handle('{"id":"0707d7e0-269f-42e7-ae1c-18458ecabf3d","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/eventex","subject":"vim.event.ResourceExhaustionStatusChangedEvent","time":"2020-04-14T00:20:15.100325334Z","data":{"Key":7715,"ChainId":7715,"CreatedTime":"2020-04-14T00:20:13.76967Z","UserName":"machine-bb9a7f","Datacenter":null,"ComputeResource":null,"Host":null,"Vm":null,"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"vCenter Log File System Resource status changed from Yellow to Green on vcsa.pdotk.local  ","ChangeTag":"","EventTypeId":"vim.event.ResourceExhaustionStatusChangedEvent","Severity":"info","Message":"","Arguments":[{"Key":"resourceName","Value":"storage_util_filesystem_log"},{"Key":"oldStatus","Value":"yellow"},{"Key":"newStatus","Value":"green"},{"Key":"reason","Value":" "},{"Key":"nodeType","Value":"vcenter"},{"Key":"_sourcehost_","Value":"vcsa.pdotk.local"}],"ObjectId":"","ObjectType":"","ObjectName":"","Fault":null},"datacontenttype":"application/json"}')
+#print(handle('{"id":"0707d7e0-269f-42e7-ae1c-18458ecabf3d","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/eventex","subject":"vim.event.ResourceExhaustionStatusChangedEvent","time":"2020-04-14T00:20:15.100325334Z","data":{"Key":7715,"ChainId":7715,"CreatedTime":"2020-04-14T00:20:13.76967Z","UserName":"machine-bb9a7f","Datacenter":null,"ComputeResource":null,"Host":null,"Vm":null,"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"vCenter Log File System Resource status changed from Yellow to Green on vcsa.pdotk.local  ","ChangeTag":"","EventTypeId":"vim.event.ResourceExhaustionStatusChangedEvent","Severity":"info","Message":"","Arguments":[{"Key":"resourceName","Value":"storage_util_filesystem_log"},{"Key":"oldStatus","Value":"yellow"},{"Key":"newStatus","Value":"green"},{"Key":"reason","Value":" "},{"Key":"nodeType","Value":"vcenter"},{"Key":"_sourcehost_","Value":"vcsa.pdotk.local"}],"ObjectId":"","ObjectType":"","ObjectName":"","Fault":null},"datacontenttype":"application/json"}'))
 
 #
 ## SUCCESS CASES
 #
 # Standard : VmPoweredOnEvent
-#handle('{"id":"453120cd-3d19-4c43-aadc-df0cdbce3887","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"VmPoweredOnEvent","time":"2020-04-13T23:46:10.402531287Z","data":{"Key":7441,"ChainId":7438,"CreatedTime":"2020-04-13T23:46:09.387283Z","UserName":"Administrator","Datacenter":{"Name":"PKLAB","Datacenter":{"Type":"Datacenter","Value":"datacenter-3"}},"ComputeResource":{"Name":"esxi01.pdotk.local","ComputeResource":{"Type":"ComputeResource","Value":"domain-s29"}},"Host":{"Name":"esxi01.pdotk.local","Host":{"Type":"HostSystem","Value":"host-31"}},"Vm":{"Name":"Test VM","Vm":{"Type":"VirtualMachine","Value":"vm-33"}},"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"Test VM on esxi01.pdotk.local in PKLAB has powered on","ChangeTag":"","Template":false},"datacontenttype":"application/json"}')
+#print(handle('{"id":"453120cd-3d19-4c43-aadc-df0cdbce3887","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"VmPoweredOnEvent","time":"2020-04-13T23:46:10.402531287Z","data":{"Key":7441,"ChainId":7438,"CreatedTime":"2020-04-13T23:46:09.387283Z","UserName":"Administrator","Datacenter":{"Name":"PKLAB","Datacenter":{"Type":"Datacenter","Value":"datacenter-3"}},"ComputeResource":{"Name":"esxi01.pdotk.local","ComputeResource":{"Type":"ComputeResource","Value":"domain-s29"}},"Host":{"Name":"esxi01.pdotk.local","Host":{"Type":"HostSystem","Value":"host-31"}},"Vm":{"Name":"Test VM","Vm":{"Type":"VirtualMachine","Value":"vm-33"}},"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"Test VM on esxi01.pdotk.local in PKLAB has powered on","ChangeTag":"","Template":false},"datacontenttype":"application/json"}'))
 # Standard : VmPoweredOffEvent
-#handle('{"id":"d77a3767-1727-49a3-ac33-ddbdef294150","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"VmPoweredOffEvent","time":"2020-04-14T00:33:30.838669841Z","data":{"Key":7825,"ChainId":7821,"CreatedTime":"2020-04-14T00:33:30.252792Z","UserName":"Administrator","Datacenter":{"Name":"PKLAB","Datacenter":{"Type":"Datacenter","Value":"datacenter-3"}},"ComputeResource":{"Name":"esxi01.pdotk.local","ComputeResource":{"Type":"ComputeResource","Value":"domain-s29"}},"Host":{"Name":"esxi01.pdotk.local","Host":{"Type":"HostSystem","Value":"host-31"}},"Vm":{"Name":"Test VM","Vm":{"Type":"VirtualMachine","Value":"vm-33"}},"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"Test VM on  esxi01.pdotk.local in PKLAB is powered off","ChangeTag":"","Template":false},"datacontenttype":"application/json"}')
+#print(handle('{"id":"d77a3767-1727-49a3-ac33-ddbdef294150","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"VmPoweredOffEvent","time":"2020-04-14T00:33:30.838669841Z","data":{"Key":7825,"ChainId":7821,"CreatedTime":"2020-04-14T00:33:30.252792Z","UserName":"Administrator","Datacenter":{"Name":"PKLAB","Datacenter":{"Type":"Datacenter","Value":"datacenter-3"}},"ComputeResource":{"Name":"esxi01.pdotk.local","ComputeResource":{"Type":"ComputeResource","Value":"domain-s29"}},"Host":{"Name":"esxi01.pdotk.local","Host":{"Type":"HostSystem","Value":"host-31"}},"Vm":{"Name":"Test VM","Vm":{"Type":"VirtualMachine","Value":"vm-33"}},"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"Test VM on  esxi01.pdotk.local in PKLAB is powered off","ChangeTag":"","Template":false},"datacontenttype":"application/json"}'))
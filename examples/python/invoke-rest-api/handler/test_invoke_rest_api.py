@@ -0,0 +1,205 @@
+import sys, json, os, tempfile, threading, unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.modules.pop('handler', None) #every example function has a handler module, make sure this one is loaded
+import handler
+
+EVENT = '{"id":"453120cd-3d19-4c43-aadc-df0cdbce3887","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"VmPoweredOnEvent","time":"2020-04-13T23:46:10.402531287Z","data":{"Key":7441,"ChainId":7438,"CreatedTime":"2020-04-13T23:46:09.387283Z","UserName":"Administrator","Datacenter":{"Name":"PKLAB","Datacenter":{"Type":"Datacenter","Value":"datacenter-3"}},"ComputeResource":{"Name":"esxi01.pdotk.local","ComputeResource":{"Type":"ComputeResource","Value":"domain-s29"}},"Host":{"Name":"esxi01.pdotk.local","Host":{"Type":"HostSystem","Value":"host-31"}},"Vm":{"Name":"Test VM","Vm":{"Type":"VirtualMachine","Value":"vm-33"}},"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"Test VM on esxi01.pdotk.local in PKLAB has powered on","ChangeTag":"","Template":false},"datacontenttype":"application/json"}'
+
+class StandIn(BaseHTTPRequestHandler):
+    """Keep-alive HTTP server standing in for Slack/Jira/ServiceNow, counts connections and records bodies"""
+    protocol_version = 'HTTP/1.1'
+    connections = 0
+    bodies = []
+
+    def setup(self):
+        super().setup()
+        StandIn.connections += 1
+
+    def do_POST(self):
+        StandIn.bodies.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+        reply = b'{"ok":true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, format, *args):
+        pass
+
+class StandInTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        StandIn.connections = 0
+        StandIn.bodies = []
+
+        fd, self.config = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.writeconfig('Title')
+        self.saved = (handler.META_CONFIG, handler.WARM_PROCESS, handler.SESSION, handler.CONFIG_CACHE)
+        handler.META_CONFIG = self.config
+        handler.SESSION = None
+        handler.CONFIG_CACHE = handler.ConfigCache()
+
+    def tearDown(self):
+        if handler.SESSION is not None:
+            handler.SESSION.close()
+        handler.META_CONFIG, handler.WARM_PROCESS, handler.SESSION, handler.CONFIG_CACHE = self.saved
+        self.server.shutdown()
+        self.server.server_close()
+        os.remove(self.config)
+
+    def writeconfig(self, title, delivery=None):
+        config = {
+            'url': f'http://127.0.0.1:{self.server.server_port}/hook',
+            'headers': {'content-type': 'application/json'},
+            'auth': {},
+            'body': {'title': title, 'text': 'Description'},
+            'mappings': [{'push': 'text', 'pull': 'data/FullFormattedMessage'}]
+        }
+        if delivery:
+            config['delivery'] = delivery
+        with open(self.config, 'w') as configfile:
+            json.dump(config, configfile)
+
+    def invoke(self, times):
+        for _ in range(times):
+            res = json.loads(handler.handle(EVENT))
+            self.assertEqual(res['status'], '200', res['message'])
+
+class WarmProcessTest(StandInTest):
+
+    def test_warm_process_reuses_connection(self):
+        handler.WARM_PROCESS = True
+        self.invoke(5)
+        self.assertEqual(len(StandIn.bodies), 5)
+        self.assertEqual(StandIn.connections, 1)
+
+    def test_classic_mode_connects_per_event(self):
+        handler.WARM_PROCESS = False
+        self.invoke(3)
+        self.assertEqual(len(StandIn.bodies), 3)
+        self.assertEqual(StandIn.connections, 3)
+
+    def test_config_reloaded_on_mtime_change(self):
+        handler.WARM_PROCESS = True
+        self.invoke(1)
+        stat = os.stat(self.config)
+
+        # same mtime - cached config is used
+        self.writeconfig('Changed')
+        os.utime(self.config, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.invoke(1)
+
+        # newer mtime - config is parsed again
+        os.utime(self.config, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        self.invoke(1)
+
+        self.assertEqual([body['title'] for body in StandIn.bodies], ['Title', 'Title', 'Changed'])
+        self.assertEqual(StandIn.bodies[0]['text'], 'Test VM on esxi01.pdotk.local in PKLAB has powered on')
+        self.assertEqual(StandIn.connections, 1)
+
+class DeliveryTest(StandInTest):
+
+    def test_event_list_batched(self):
+        handler.WARM_PROCESS = True
+        self.writeconfig('Title', {'max_in_flight': 2, 'batch_size': 2})
+        events = [json.loads(EVENT) for _ in range(5)]
+        events.insert(2, {'data': {}})
+
+        res = json.loads(handler.handle(json.dumps(events)))
+
+        self.assertEqual([r['status'] for r in res], ['200', '200', '400', '200', '200', '200'])
+        self.assertEqual(sorted(len(body) for body in StandIn.bodies), [1, 2, 2])
+        self.assertTrue(all(item['title'] == 'Title' for body in StandIn.bodies for item in body))
+
+class FanOutTest(StandInTest):
+
+    def writetargets(self, *targets):
+        url = f'http://127.0.0.1:{self.server.server_port}/hook'
+        config = {'targets': [dict({'url': url, 'headers': {'content-type': 'application/json'}, 'auth': {}, 'mappings': []}, **target)
+                              for target in targets]}
+        with open(self.config, 'w') as configfile:
+            json.dump(config, configfile)
+
+    def test_event_sent_to_every_target(self):
+        handler.WARM_PROCESS = True
+        self.writetargets({'name': 'slack', 'body': {'text': 'VM ${data/Vm/Name} powered on'}},
+                          {'name': 'jira', 'body': {'fields': {'summary': 'x'}}, 'mappings': [{'push': 'fields/summary', 'pull': 'subject'}]})
+        res = json.loads(handler.handle(EVENT))
+        self.assertEqual(res['status'], '200', res)
+        self.assertEqual([(t['target'], t['status']) for t in res['targets']], [('slack', '200'), ('jira', '200')])
+        self.assertCountEqual(StandIn.bodies, [{'text': 'VM Test VM powered on'}, {'fields': {'summary': 'VmPoweredOnEvent'}}])
+
+    def test_failing_targets_isolated(self):
+        self.writetargets({'name': 'slack', 'body': {'text': ''}, 'mappings': [{'push': 'text', 'pull': 'subject'}]},
+                          {'name': 'down', 'url': 'http://127.0.0.1:1/hook', 'body': {'text': ''}},
+                          {'name': 'unmapped', 'body': {'text': ''}, 'mappings': [{'push': 'text', 'pull': 'data/Missing'}]})
+        res = json.loads(handler.handle(EVENT))
+        self.assertEqual(res['status'], '207')
+        self.assertEqual(res['message'], '1 of 3 targets succeeded')
+        self.assertEqual([t['status'] for t in res['targets']], ['200', '500', '400'])
+        self.assertEqual(StandIn.bodies, [{'text': 'VmPoweredOnEvent'}])
+
+    def test_event_list(self):
+        self.writetargets({'name': 'a', 'body': {'text': '${data/Vm/Vm/Value}'}}, {'name': 'b', 'body': {'id': '${id}'}})
+        events = [json.loads(EVENT) for _ in range(3)]
+        res = json.loads(handler.handle(json.dumps(events)))
+        self.assertEqual([(r['status'], len(r['targets'])) for r in res], [('200', 2)] * 3)
+        self.assertEqual(len(StandIn.bodies), 6)
+
+    def test_target_names_unique(self):
+        self.writetargets({'name': 'a', 'body': {}}, {'name': 'a', 'body': {}})
+        res = json.loads(handler.handle(EVENT))
+        self.assertEqual(res['status'], '400')
+        self.assertIn('unique', res['message'])
+
+    def test_required_keys_checked(self):
+        for key in ('url', 'auth', 'headers'):
+            self.writetargets({'name': 'a', 'body': {}})
+            with open(self.config) as configfile:
+                config = json.load(configfile)
+            del config['targets'][0][key]
+            with open(self.config, 'w') as configfile:
+                json.dump(config, configfile)
+            res = json.loads(handler.handle(EVENT))
+            self.assertEqual(res['status'], '400', key)
+            self.assertIn(key, res['message'])
+
+class TemplateTest(unittest.TestCase):
+
+    def render(self, body, mappings=()):
+        return handler.CompiledMappings(body, list(mappings)).render(json.loads(EVENT))
+
+    def test_interpolation(self):
+        body = {'text': 'VM ${data/Vm/Name} on ${data/Host/Name} powered on (100% ${subject}) $${USD}',
+                'blocks': [{'text': 'Event ${data/Key}'}, {'text': 'plain'}]}
+        self.assertEqual(self.render(body), {'text': 'VM Test VM on esxi01.pdotk.local powered on (100% VmPoweredOnEvent) ${USD}',
+                                             'blocks': [{'text': 'Event 7441'}, {'text': 'plain'}]})
+        self.assertEqual(body['text'], 'VM ${data/Vm/Name} on ${data/Host/Name} powered on (100% ${subject}) $${USD}')
+
+    def test_defaults(self):
+        body = {'text': 'datastore ${data/Ds/Name|none}, net ${data/Net}, ${data/Missing|n/a}', 'key': '${data/Key}',
+                'ds': '${data/Ds}', 'dvs': '${data/Dvs|-}', 'dc': '${data/Datacenter}'}
+        self.assertEqual(self.render(body), {'text': 'datastore none, net , n/a', 'key': 7441, 'ds': None, 'dvs': '-',
+                                             'dc': {'Name': 'PKLAB', 'Datacenter': {'Type': 'Datacenter', 'Value': 'datacenter-3'}}})
+
+    def test_mapping_wins(self):
+        body = {'text': 'VM ${data/Vm/Name}'}
+        self.assertEqual(self.render(body, [{'push': 'text', 'pull': 'subject'}]), {'text': 'VmPoweredOnEvent'})
+        # a mapping pushing a container replaces the templates inside it, the others are kept
+        body = {'attachments': [{'text': 'VM ${data/Vm/Name}'}], 'blocks': [{'text': '${subject}'}, {'text': 'Event ${data/Key}'}]}
+        self.assertEqual(self.render(body, [{'push': 'attachments', 'pull': 'data/Host/Name'}, {'push': 'blocks/0', 'pull': 'data/Key'}]),
+                         {'attachments': 'esxi01.pdotk.local', 'blocks': [7441, {'text': 'Event 7441'}]})
+        with self.assertRaises(ValueError):
+            handler.CompiledMappings({'a': {'b': 'x'}}, [{'push': 'a', 'pull': 'id'}, {'push': 'a/b', 'pull': 'id'}])
+
+    def test_not_closed(self):
+        with self.assertRaises(ValueError):
+            handler.CompiledMappings({'text': 'VM ${data/Vm/Name'}, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+#
+## Logging shared by the Python example functions - keep the copies in the function folders identical to
+## examples/python/shared/vebalog.py (see examples/python/shared/README.md)
+##
+## Messages are only formatted when a record is emitted: pass values as arguments instead of f-strings
+##     log.debug('Event > %s', pretty(cevent))
+## so a disabled debug level costs a level check, not a JSON serialization
+#
+import functools, json, logging, os, re, sys, time
+
+# keys whose values never show up in the logs, matched anywhere in the lowercased key (searching lowercased text is
+# much faster than re.I on large messages)
+SECRET_KEYS = re.compile(r'pass|pwd|secret|token|routing_key|authorization|api[-_]?key|session[-_]?id')
+# "key": "value" and key=value pairs in formatted messages, the value is redacted if the key is a secret key
+PAIRS = re.compile(r'''(?<![\w-])(["']?)([\w-]+)\1(\s*[:=]\s*)("[^"]*"|'[^']*'|[^\s,;}]+)''')
+REDACTED = '***'
+# attributes of every LogRecord, anything else was passed in extra and ends up in the JSON output
+RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+def redactpairs(message):
+    """Returns message with the values of secret key=value and "key": "value" pairs replaced"""
+    if not SECRET_KEYS.search(message.lower()):
+        return message
+    return PAIRS.sub(lambda m: m.group(0) if not secretkey(m.group(2)) else f'{m.group(1)}{m.group(2)}{m.group(1)}{m.group(3)}"{REDACTED}"', message)
+
+def getmessage(record):
+    """
+    Returns the message of record with secrets redacted. LazyJSON arguments are redacted when serialized,
+    the message and the other arguments are searched for secret key=value pairs
+    """
+    if not isinstance(record.args, tuple):
+        return redactpairs(record.getMessage())
+    args = tuple(arg if isinstance(arg, (LazyJSON, int, float)) else redactpairs(str(arg)) for arg in record.args)
+    message = redactpairs(str(record.msg))
+    return message % args if args else message
+
+@functools.lru_cache(maxsize=4096)
+def secretkey(key):
+    """True if the value of key must not be logged, cached as events repeat the same few keys"""
+    return isinstance(key, str) and SECRET_KEYS.search(key.lower()) is not None
+
+def redact(obj):
+    """
+    Returns obj with the values of secret keys replaced, lists and dicts are walked recursively and only
+    copied if they contain a secret
+    """
+    if isinstance(obj, dict):
+        redacted = None
+        for key, value in obj.items():
+            clean = REDACTED if secretkey(key) else redact(value)
+            if clean is not value and redacted is None:
+                redacted = dict(obj)
+            if redacted is not None:
+                redacted[key] = clean
+        return obj if redacted is None else redacted
+    if isinstance(obj, (list, tuple)):
+        values = [redact(value) for value in obj]
+        return obj if all(clean is value for clean, value in zip(values, obj)) else values
+    return obj
+
+class LazyJSON:
+    """
+    LazyJSON defers the (redacted) JSON serialization of obj until the log record is formatted
+    """
+    __slots__ = ('obj', 'indent', 'sort_keys')
+
+    def __init__(self, obj, indent=4, sort_keys=False):
+        self.obj = obj
+        self.indent = indent
+        self.sort_keys = sort_keys
+
+    def __str__(self):
+        try:
+            return json.dumps(redact(self.obj), indent=self.indent, sort_keys=self.sort_keys, default=str)
+        except (TypeError, ValueError):
+            return repr(self.obj)
+
+def pretty(obj, indent=4, sort_keys=False):
+    """obj as indented JSON with secrets redacted, serialized only if the record is emitted"""
+    return LazyJSON(obj, indent, sort_keys)
+
+class TextFormatter(logging.Formatter):
+    """plain text records: LEVEL logger: message, with secrets redacted"""
+
+    def format(self, record):
+        text = f'{record.levelname} {record.name}: {getmessage(record)}'
+        if record.exc_info:
+            text += '\n' + self.formatException(record.exc_info)
+        return text
+
+class JSONFormatter(logging.Formatter):
+    """one JSON object per record with time, level, logger, message and the fields passed in extra"""
+
+    def format(self, record):
+        entry = {'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'message': getmessage(record)}
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRS:
+                entry[key] = REDACTED if secretkey(key) else redact(value)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def getlogger(name, stream=None):
+    """
+    Returns the logger of a function, configured from the environment on first use:
+    write_debug - debug records are emitted (the level is warning otherwise)
+    log_level - explicit level, eg. INFO, overrides write_debug
+    log_format - text (default) or json
+
+    Records go to stderr, which only ends up in the function logs and not in the response
+
+    Arguments:
+        name {str} -- logger name, eg. the function name
+        stream {file} -- stream to write to, stderr by default
+
+    Returns:
+        logging.Logger
+    """
+    log = logging.getLogger(name)
+    if log.handlers:
+        return log
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JSONFormatter() if os.getenv('log_format', 'text').lower() == 'json' else TextFormatter())
+    log.addHandler(handler)
+    log.propagate = False
+    level = os.getenv('log_level') or ('DEBUG' if os.getenv('write_debug') else 'WARNING')
+    log.setLevel(level.upper())
+    if log.isEnabledFor(logging.DEBUG):
+        log.warning('DEBUG has been enabled for this function. Sensitive information could be printed to the logs')
+    return log
@@ -0,0 +1,136 @@
+#
+## CloudEvent decoding shared by the Python example functions - keep the copies in the function folders identical to
+## examples/python/shared/vecevent.py (see examples/python/shared/README.md)
+##
+## orjson is used when it is installed (add it to the requirements.txt of the function), the standard json module
+## otherwise. VCEvent is a view of the vCenter event envelope: the fields the functions use are looked up once
+## when the event is decoded instead of walking the nested dicts for every access
+##     event = decode(req)
+##     event.vm.value, event.host.name, event.message
+#
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# raised by loads and decode for invalid JSON, orjson.JSONDecodeError is a subclass
+DecodeError = json.JSONDecodeError
+
+# entities of the event data, each {"Name": ..., "<entity>": {"Type": ..., "Value": ...}} or null
+ENTITIES = (('datacenter', 'Datacenter'), ('compute_resource', 'ComputeResource'), ('host', 'Host'), ('vm', 'Vm'),
+            ('ds', 'Ds'), ('net', 'Net'), ('dvs', 'Dvs'))
+
+def loads(data):
+    """
+    Parses a JSON document
+
+    Arguments:
+        data {str, bytes} -- JSON document
+
+    Raises:
+        DecodeError -- data is not valid JSON
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass #eg. integers beyond 64 bit, which json accepts - json raises for invalid documents
+    return json.loads(data)
+
+def dumps(obj, indent=False):
+    """
+    Serializes obj to a JSON str, like json.dumps but with orjson when it is installed and obj is made of plain types
+
+    Arguments:
+        obj {object} -- dicts, lists, str, numbers, bool or None
+        indent {bool} -- indent nested values by 2 spaces
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode()
+        except TypeError:
+            pass #eg. non-str keys, json handles them as before
+    return json.dumps(obj, indent=2 if indent else None)
+
+class MoRef:
+    """
+    MoRef is an entity of the event data, the managed object reference with the name of the object
+    """
+    __slots__ = ('name', 'type', 'value')
+
+    def __init__(self, name, type, value):
+        self.name = name
+        self.type = type
+        self.value = value
+
+    def __repr__(self):
+        return f'MoRef({self.name!r}, {self.type!r}, {self.value!r})'
+
+def moref(data, entity):
+    """MoRef of entity (eg. 'Vm') in the event data, None if the event has none"""
+    obj = data.get(entity)
+    if not isinstance(obj, dict):
+        return None
+    ref = obj.get(entity)
+    if not isinstance(ref, dict):
+        return None
+    return MoRef(obj.get('Name'), ref.get('Type'), ref.get('Value'))
+
+class VCEvent:
+    """
+    VCEvent is a view of a vCenter CloudEvent. Fields missing in the event are None, the decoded document is kept in
+    raw and its data in data, so paths outside the envelope are still available
+    """
+    __slots__ = ('raw', 'id', 'source', 'subject', 'type', 'time', 'data', 'key', 'chain_id', 'created', 'user',
+                 'message') + tuple(attr for attr, _ in ENTITIES)
+
+    def __init__(self, cevent):
+        """
+        Arguments:
+            cevent {dict} -- decoded CloudEvent, other documents give a view with all fields None
+        """
+        self.raw = cevent
+        if not isinstance(cevent, dict):
+            cevent = {}
+        get = cevent.get
+        self.id = get('id')
+        self.source = get('source')
+        self.subject = get('subject')
+        self.type = get('type')
+        self.time = get('time')
+        data = get('data')
+        self.data = data = data if isinstance(data, dict) else {}
+        get = data.get
+        self.key = get('Key')
+        self.chain_id = get('ChainId')
+        self.created = get('CreatedTime')
+        self.user = get('UserName')
+        self.message = get('FullFormattedMessage')
+        for attr, entity in ENTITIES:
+            setattr(self, attr, moref(data, entity))
+
+    def require(self, *fields):
+        """
+        Raises:
+            KeyError -- with the first of fields (eg. 'vm', 'message') missing in the event
+        """
+        for field in fields:
+            if getattr(self, field) is None:
+                raise KeyError(field)
+
+def decode(req):
+    """
+    Parses a CloudEvent
+
+    Arguments:
+        req {str, bytes} -- CloudEvent as received by the function
+
+    Returns:
+        VCEvent
+
+    Raises:
+        DecodeError -- req is not valid JSON
+    """
+    return VCEvent(loads(req))
@@ -0,0 +1,52 @@
+#
+## Benchmark - per-event cost of decoding a CloudEvent, reading the fields a handler uses and serializing the response
+## Compares json.loads with nested dict lookups, as the handlers did, with vecevent using the standard json module
+## and vecevent using orjson (if installed), on a VmPoweredOnEvent and an eventex with many arguments
+##
+## Usage: python bench_decode.py [events, default 20000] [eventex arguments, default 200]
+#
+import sys, os, json, timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import vecevent
+from bench_logging import eventex
+
+VMPOWEREDON = '{"id":"453120cd-3d19-4c43-aadc-df0cdbce3887","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"VmPoweredOnEvent","time":"2020-04-13T23:46:10.402531287Z","data":{"Key":7441,"ChainId":7438,"CreatedTime":"2020-04-13T23:46:09.387283Z","UserName":"Administrator","Datacenter":{"Name":"PKLAB","Datacenter":{"Type":"Datacenter","Value":"datacenter-3"}},"ComputeResource":{"Name":"esxi01.pdotk.local","ComputeResource":{"Type":"ComputeResource","Value":"domain-s29"}},"Host":{"Name":"esxi01.pdotk.local","Host":{"Type":"HostSystem","Value":"host-31"}},"Vm":{"Name":"Test VM","Vm":{"Type":"VirtualMachine","Value":"vm-33"}},"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"Test VM on esxi01.pdotk.local in PKLAB has powered on","ChangeTag":"","Template":false},"datacontenttype":"application/json"}'
+RESPONSE = {'status': '200', 'message': 'Successfully executed > Event processed, dedup_key for this request: https://vcsa.pdotk.local/sdk|VmPoweredOnEvent|vm-33'}
+
+def dicts(req):
+    """the field accesses of the PagerDuty handler on the decoded dict"""
+    cevent = json.loads(req)
+    fields = (cevent['source'], cevent['subject'], cevent['data']['FullFormattedMessage'], cevent['data']['CreatedTime'],
+              cevent['data']['Vm']['Name'], cevent['data']['Host']['Name'], cevent['data']['UserName'],
+              cevent['data']['Vm']['Vm']['Value'])
+    return fields, json.dumps(RESPONSE)
+
+def view(req):
+    """the same fields through the VCEvent view"""
+    event = vecevent.decode(req)
+    fields = (event.source, event.subject, event.message, event.created, event.vm.name, event.host.name, event.user,
+              event.vm.value)
+    return fields, vecevent.dumps(RESPONSE)
+
+def measure(run, req, number):
+    return min(timeit.repeat(lambda: run(req), number=number, repeat=3)) / number * 1e6
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    arguments = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    payloads = (('VmPoweredOnEvent', VMPOWEREDON), (f'eventex ({arguments} args)', json.dumps(eventex(arguments))))
+    backend = vecevent.orjson
+
+    print(f'orjson {"installed" if backend is not None else "not installed"}, {number} events per run')
+    print(f'{"event":<24}{"bytes":>8}{"dicts us":>12}{"view+json us":>16}{"view+orjson us":>18}{"speedup":>10}')
+    for name, req in payloads:
+        legacy = measure(dicts, req, number)
+        vecevent.orjson = None
+        stdlib = measure(view, req, number)
+        vecevent.orjson = backend
+        fast = measure(view, req, number) if backend is not None else float('nan')
+        print(f'{name:<24}{len(req):>8}{legacy:>12.2f}{stdlib:>16.2f}{fast:>18.2f}{legacy / (fast if backend else stdlib):>9.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+#
+## Benchmark - per-event cost of rejecting an event the function does not handle
+## Compares the filter on the raw request (vefilter) with decoding the event and failing on the missing keys, as the
+## PagerDuty function did, for a UserLogoutSessionEvent (no VM), an event with another subject and one it accepts
+##
+## Usage: python bench_filter.py [events, default 50000]
+#
+import sys, os, timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import vecevent
+import vefilter
+from bench_decode import VMPOWEREDON
+
+USERLOGOUT = '{"id":"e0b5b1a4-0c3b-4a0e-9a8b-1f4cbd6e2b7e","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"UserLogoutSessionEvent","time":"2020-04-13T23:47:10.402531287Z","data":{"Key":7450,"ChainId":7450,"CreatedTime":"2020-04-13T23:47:09.387283Z","UserName":"VSPHERE.LOCAL\\\\Administrator","Datacenter":null,"ComputeResource":null,"Host":null,"Vm":null,"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"User VSPHERE.LOCAL\\\\Administrator@10.0.0.10 logged out (login time: 2020-04-13T23:40:00Z, number of API invocations: 12, user agent: pyvmomi Python/3.8.2)","ChangeTag":"","IpAddress":"10.0.0.10","UserAgent":"pyvmomi Python/3.8.2","CallCount":12,"SessionId":"52b1f2c0-aaaa-bbbb-cccc-d2e9f5a1b7c3","LoginTime":"2020-04-13T23:40:00Z"},"datacontenttype":"application/json"}'
+FILTER = vefilter.EventFilter(['VmPoweredOnEvent', 'VmPoweredOffEvent'], require=['data.Vm', 'data.Host'])
+
+def decoded(req):
+    """the PagerDuty function before the filter, the event is decoded before a missing key is found"""
+    event = vecevent.decode(req)
+    try:
+        event.require('source', 'subject', 'message', 'created', 'user', 'vm', 'host')
+    except KeyError:
+        return False
+    return True
+
+def measure(run, req, number):
+    return min(timeit.repeat(lambda: run(req), number=number, repeat=3)) / number * 1e6
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    payloads = (('UserLogoutSessionEvent', USERLOGOUT), ('VmSuspendedEvent', VMPOWEREDON.replace('VmPoweredOnEvent', 'VmSuspendedEvent')),
+                ('VmPoweredOnEvent (passed)', VMPOWEREDON))
+    print(f'{number} events per run')
+    print(f'{"event":<28}{"decode us":>12}{"filter us":>12}  filter')
+    for name, req in payloads:
+        print(f'{name:<28}{measure(decoded, req, number):>12.2f}{measure(FILTER.reject, req, number):>12.2f}  {FILTER.reject(req) or "passed"}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#
+## Benchmark - per-event cost of the debug statements of the PagerDuty handler
+## Compares the former f-string debug() helper, whose messages (incl. the pretty printed event) were built even with
+## debug disabled, with vebalog, which formats a record only when it is emitted. Enabled output goes to /dev/null
+##
+## Usage: python bench_logging.py [events, default 2000] [eventex arguments, default 200]
+#
+import sys, os, json, time, logging
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import vebalog
+
+def eventex(arguments):
+    return {"id": "0707d7e0-269f-42e7-ae1c-18458ecabf3d", "source": "https://vcsa.pdotk.local/sdk", "specversion": "1.0",
+            "type": "com.vmware.event.router/eventex", "subject": "vim.event.ResourceExhaustionStatusChangedEvent",
+            "time": "2020-04-14T00:20:15.100325334Z",
+            "data": {"Key": 7715, "ChainId": 7715, "CreatedTime": "2020-04-14T00:20:13.76967Z", "UserName": "machine-bb9a7f",
+                     "Datacenter": {"Name": "PKLAB", "Datacenter": {"Type": "Datacenter", "Value": "datacenter-3"}},
+                     "ComputeResource": None, "Host": {"Name": "esxi01.pdotk.local", "Host": {"Type": "HostSystem", "Value": "host-31"}},
+                     "Vm": {"Name": "Test VM", "Vm": {"Type": "VirtualMachine", "Value": "vm-33"}}, "Ds": None, "Net": None, "Dvs": None,
+                     "FullFormattedMessage": "vCenter Log File System Resource status changed from Yellow to Green on vcsa.pdotk.local",
+                     "EventTypeId": "vim.event.ResourceExhaustionStatusChangedEvent", "Severity": "info",
+                     "Arguments": [{"Key": f"argument{i}", "Value": f"value of argument {i} " * 4} for i in range(arguments)]},
+            "datacontenttype": "application/json"}
+
+class bgc:
+    HEADER = '\033[95m'
+    OKBLUE = '\033[94m'
+    OKGREEN = '\033[92m'
+    ENDC = '\033[0m'
+
+def former(debugging, out):
+    """the debug statements of handle() with the former helper"""
+    def debug(s):
+        if debugging:
+            out.write(s+" \n")
+
+    def run(req, pdconfig, obj):
+        debug(f'{bgc.HEADER}---Validating CloudEvent--- {bgc.ENDC}')
+        debug(f'{bgc.OKBLUE}Event (raw) > {bgc.ENDC}{req}')
+        cevent = json.loads(req)
+        debug(f'{bgc.OKGREEN}Successfully parsed Event into JSON!{bgc.ENDC}')
+        debug(f'{bgc.OKBLUE}Event (JSON) > {bgc.ENDC}{json.dumps(cevent, indent=4, sort_keys=True)}')
+        debug(f'{bgc.HEADER}---Validating Config--- {bgc.ENDC}')
+        debug(f'{bgc.OKBLUE}Configuration > {bgc.ENDC}{json.dumps(pdconfig,indent=4)}')
+        debug(f'{bgc.HEADER}---Building HTTP Request body--- {bgc.ENDC}')
+        debug(f'{bgc.OKBLUE}Built API Request Body > {bgc.ENDC}{json.dumps(obj,indent=4)}')
+        debug(f'{bgc.HEADER}---Attemping API Request to PagerDuty--- {bgc.ENDC}')
+    return run
+
+def lazy(debugging, out):
+    """the same statements with vebalog"""
+    log = logging.getLogger(f'bench-{debugging}')
+    log.handlers.clear()
+    handler = logging.StreamHandler(out)
+    handler.setFormatter(vebalog.TextFormatter())
+    log.addHandler(handler)
+    log.propagate = False
+    log.setLevel(logging.DEBUG if debugging else logging.WARNING)
+    pretty = vebalog.pretty
+
+    def run(req, pdconfig, obj):
+        log.debug('---Validating CloudEvent---')
+        log.debug('Event (raw) > %s', req)
+        cevent = json.loads(req)
+        log.debug('Successfully parsed Event into JSON!')
+        log.debug('Event (JSON) > %s', pretty(cevent, sort_keys=True))
+        log.debug('---Validating Config---')
+        log.debug('Configuration > %s', pretty(pdconfig))
+        log.debug('---Building HTTP Request body---')
+        log.debug('Built API Request Body > %s', pretty(obj))
+        log.debug('---Attemping API Request to PagerDuty---')
+    return run
+
+def measure(run, count, req, pdconfig, obj):
+    start = time.perf_counter()
+    for _ in range(count):
+        run(req, pdconfig, obj)
+    return (time.perf_counter() - start) / count * 1e6
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    arguments = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    cevent = eventex(arguments)
+    req = json.dumps(cevent)
+    pdconfig = {'routing_key': 'R0UT1NGK3Y', 'event_action': 'trigger'}
+    obj = {'routing_key': 'R0UT1NGK3Y', 'event_action': 'trigger', 'payload': {'summary': cevent['data']['FullFormattedMessage'],
+           'custom_details': cevent['data']}}
+    # cost of the statement-free part (parsing the event), subtracted to show the logging overhead
+    baseline = measure(lambda req, pdconfig, obj: json.loads(req), count, req, pdconfig, obj)
+
+    print(f'{count} events, {len(req)} bytes each ({arguments} eventex arguments), json.loads alone {baseline:.1f}us/event')
+    print(f'{"logging":<24}{"debug":>8}{"us/event":>12}{"overhead us":>14}')
+    with open(os.devnull, 'w') as out:
+        for name, factory in (('former debug()', former), ('vebalog', lazy)):
+            for debugging in (False, True):
+                cost = measure(factory(debugging, out), count, req, pdconfig, obj)
+                print(f'{name:<24}{"on" if debugging else "off":>8}{cost:>12.1f}{cost - baseline:>14.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+#
+## Benchmark - replays a corpus of CloudEvents through the handle() of every Python example function
+## The functions talk to the stand-in servers of their tests (PagerDuty Events API, REST endpoint, vCenter REST
+## and SOAP API) on localhost, each function runs in its own process so imports and peak RSS don't mix.
+## Reports latency percentiles, events per second, memory allocated per event and peak RSS per function
+##
+## Usage:
+##   python bench_replay.py run [--events 2000] [--functions pagerduty,tagging] [--mode warm|classic] [--out run.json]
+##   python bench_replay.py corpus [--events 2000] > corpus.ndjson
+##   python bench_replay.py compare before.json after.json [--threshold 15]
+##
+## The corpus is built from the sample events in the comments of the pagerduty and invoke-rest-api handlers, plus
+## variants of them with other ids, VMs, hosts and eventex arguments. compare exits with 1 if a metric regressed by
+## more than threshold percent
+#
+import sys, os, io, json, time, random, argparse, contextlib, platform, resource, subprocess, tempfile, threading, tracemalloc
+import re
+from collections import Counter, deque
+from http.server import ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+SAMPLES = ['trigger-pagerduty-incident/handler/handler.py', 'invoke-rest-api/handler/handler.py']
+SAMPLE = re.compile(r"^#print\(handle\('(\{.*\})'\)\)\s*$")
+HOSTS = 64 #hosts of the vCenter stand-ins, events reference host-1 .. host-64
+
+# folder of each function and its test module providing the stand-in server
+FUNCTIONS = {
+    'echo': ('echo/handler', None),
+    'pagerduty': ('trigger-pagerduty-incident/handler', 'test_trigger_pagerduty_incident'),
+    'invoke-rest-api': ('invoke-rest-api/handler', 'test_invoke_rest_api'),
+    'tagging': ('tagging/handler', 'test_tagging'),
+    'esx-mtu-fixer': ('esx-mtu-fixer/esx-mtu-fixer', 'test_esx_mtu_fixer'),
+}
+
+# metric -> direction, +1 if higher is worse
+METRICS = {'p50_ms': 1, 'p95_ms': 1, 'p99_ms': 1, 'events_per_s': -1, 'alloc_kb_per_event': 1, 'peak_rss_mb': 1}
+
+#
+## Corpus
+#
+
+def samples():
+    """the CloudEvents of the #print(handle('...')) comments, deduplicated by id"""
+    events = {}
+    for path in SAMPLES:
+        with open(os.path.join(ROOT, path)) as source:
+            for line in source:
+                match = SAMPLE.match(line)
+                if match:
+                    cevent = json.loads(match.group(1))
+                    if 'specversion' in cevent:
+                        events[cevent['id']] = cevent
+    return list(events.values())
+
+def variant(cevent, i, rnd):
+    """cevent with a new id, time and key, a VM and host of the stand-in inventory and, for eventex, more arguments"""
+    cevent = json.loads(json.dumps(cevent))
+    cevent['id'] = '%08x-0000-4000-8000-%012x' % (rnd.getrandbits(32), i)
+    cevent['time'] = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(1586822770 + i)) + '.000000000Z'
+    data = cevent['data']
+    data['Key'] = data['ChainId'] = 10000 + i
+    if data.get('Vm'):
+        data['Vm']['Name'] = f'VM {i % 500}'
+        data['Vm']['Vm']['Value'] = f'vm-{i % 500}'
+    if data.get('Host'):
+        host = rnd.randint(1, HOSTS)
+        data['Host']['Name'] = 'esxi%02d.pdotk.local' % host
+        data['Host']['Host']['Value'] = f'host-{host}'
+    if 'Arguments' in data:
+        data['Arguments'] = [{'Key': f'argument{n}', 'Value': f'value {n}'} for n in range(rnd.choice((2, 20, 200)))]
+    return cevent
+
+def corpus(events, seed=1):
+    """the samples followed by generated variants, events CloudEvents as JSON strings"""
+    rnd = random.Random(seed)
+    base = samples()
+    lines = [json.dumps(cevent) for cevent in base]
+    while len(lines) < events:
+        lines.append(json.dumps(variant(rnd.choice(base), len(lines), rnd)))
+    return lines[:events]
+
+#
+## Stand-ins, set up in the process of the function
+#
+
+def serve(handlerclass):
+    # replies are written as headers and body, with Nagle the client waits for the delayed ack of the headers
+    handlerclass.disable_nagle_algorithm = True
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handlerclass)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def standin(name, tests, tmp):
+    """points the handler of the function at its stand-in, returns the handle function"""
+    if name == 'echo':
+        sys.modules.pop('handler', None)
+        import echo
+        return echo.handle
+    handler = tests.handler
+    if name == 'pagerduty':
+        tests.EventsAPI.bodies = deque(maxlen=100)
+        server = serve(tests.EventsAPI)
+        handler.PAGERDUTY_API_PATH = f'http://127.0.0.1:{server.server_port}/v2/enqueue'
+        handler.PD_CONFIG = os.path.join(tmp, 'pdconfig.json')
+        with open(handler.PD_CONFIG, 'w') as config:
+            json.dump({'routing_key': 'R0UT1NGK3Y', 'event_action': 'trigger'}, config)
+    elif name == 'invoke-rest-api':
+        tests.StandIn.bodies = deque(maxlen=100)
+        server = serve(tests.StandIn)
+        with open(os.path.join(ROOT, 'invoke-rest-api', 'metaconfig-slack.json')) as config:
+            metaconfig = json.load(config)
+        metaconfig['url'] = f'http://127.0.0.1:{server.server_port}/hook'
+        handler.META_CONFIG = os.path.join(tmp, 'metaconfig.json')
+        with open(handler.META_CONFIG, 'w') as config:
+            json.dump(metaconfig, config)
+    elif name == 'tagging':
+        tests.FakeVAPI.reset()
+        tests.FakeVAPI.calls = deque(maxlen=100)
+        server = serve(tests.FakeVAPI)
+        handler.VC_CONFIG = os.path.join(tmp, 'vcconfig.toml')
+        with open(handler.VC_CONFIG, 'w') as config:
+            config.write(f'[vcenter]\nserver = "127.0.0.1:{server.server_port}"\nuser = "tagger@vsphere.local"\npassword = "secret"\n\n{tests.TAG}')
+        if handler.WARM_PROCESS:
+            handler.SESSION = tests.fakesession()
+        else:
+            handler.getsession = tests.fakesession #a new session per event, with the https to http adapter of the tests
+    elif name == 'esx-mtu-fixer':
+        from pyVmomi import vim, SoapAdapter
+        tests.FakeVim.reset(count=HOSTS, low=range(1, HOSTS + 1, 4))
+        tests.FakeVim.calls = deque(maxlen=100)
+        server = serve(tests.FakeVim)
+        stub = SoapAdapter.SoapStubAdapter(host='127.0.0.1', port=-server.server_port, version=tests.VERSION)
+        si = vim.ServiceInstance('ServiceInstance', stub)
+        for secret, value in (('VC_HOST', '127.0.0.1'), ('VC_USER', 'administrator@vsphere.local'), ('VC_PASSWORD', 'secret')):
+            setattr(handler, secret, os.path.join(tmp, secret))
+            with open(getattr(handler, secret), 'w') as config:
+                config.write(value)
+        handler.connect.SmartConnect = lambda **kwargs: si
+    return handler.handle
+
+def status(res):
+    """status of a response, functions without one (echo, esx-mtu-fixer) answer 200"""
+    try:
+        res = json.loads(res)
+    except (TypeError, ValueError):
+        return '200'
+    return str(res.get('status', '200')) if isinstance(res, dict) else '200'
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+def worker(name, corpusfile, warm, warmup):
+    """replays the corpus through one function, in a process of its own, and returns its metrics"""
+    folder, testmodule = FUNCTIONS[name]
+    sys.path.insert(0, os.path.join(ROOT, folder))
+    os.environ.pop('write_debug', None)
+    if warm:
+        os.environ['warm_process'] = 'true'
+    tests = __import__(testmodule) if testmodule else None
+    with open(corpusfile) as lines:
+        events = [line.rstrip('\n') for line in lines if line.strip()]
+
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()) as out:
+        handle = standin(name, tests, tmp)
+        for req in events[:warmup]:
+            handle(req)
+            out.truncate(0)
+
+        statuses = Counter()
+        latencies = []
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        for req in events:
+            began = time.perf_counter()
+            res = handle(req)
+            latencies.append(time.perf_counter() - began)
+            statuses[status(res)] += 1
+            out.seek(0)
+            out.truncate(0)
+        elapsed = time.perf_counter() - start
+        retained = sys.getallocatedblocks() - blocks
+
+        # memory allocated per event, in a pass of its own as tracing slows the function down
+        sample = events[:min(len(events), 200)]
+        tracemalloc.start()
+        allocated = 0
+        for req in sample:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            handle(req)
+            allocated += tracemalloc.get_traced_memory()[1] - before
+            out.seek(0)
+            out.truncate(0)
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {'events': len(events), 'statuses': dict(statuses),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3),
+            'events_per_s': round(len(events) / elapsed, 1),
+            'alloc_kb_per_event': round(allocated / len(sample) / 1024, 1),
+            'retained_blocks': retained,
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+#
+## Commands
+#
+
+def run(args):
+    names = args.functions.split(',') if args.functions else list(FUNCTIONS)
+    with tempfile.TemporaryDirectory() as tmp:
+        corpusfile = args.corpus
+        if not corpusfile:
+            corpusfile = os.path.join(tmp, 'corpus.ndjson')
+            with open(corpusfile, 'w') as out:
+                out.write('\n'.join(corpus(args.events)) + '\n')
+        results = {'meta': {'python': platform.python_version(), 'mode': args.mode, 'corpus': args.corpus or f'generated:{args.events}',
+                            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())},
+                   'functions': {}}
+        for name in names:
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), 'worker', name, corpusfile,
+                                   '--mode', args.mode, '--warmup', str(args.warmup)], capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f'{name}: failed\n{proc.stderr}', file=sys.stderr)
+                continue
+            results['functions'][name] = json.loads(proc.stdout.splitlines()[-1])
+
+    print(f'{"function":<18}{"events":>8}{"ev/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"alloc KB/ev":>13}{"RSS MB":>9}  statuses')
+    for name, m in results['functions'].items():
+        print(f'{name:<18}{m["events"]:>8}{m["events_per_s"]:>10.1f}{m["p50_ms"]:>10.3f}{m["p95_ms"]:>10.3f}{m["p99_ms"]:>10.3f}'
+              f'{m["alloc_kb_per_event"]:>13.1f}{m["peak_rss_mb"]:>9.1f}  {m["statuses"]}')
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump(results, out, indent=2)
+
+def compare(args):
+    with open(args.before) as before, open(args.after) as after:
+        old, new = json.load(before)['functions'], json.load(after)['functions']
+    regressions = 0
+    print(f'{"function":<18}{"metric":<20}{"before":>12}{"after":>12}{"change":>10}')
+    for name in [name for name in old if name in new]:
+        for metric, worse in METRICS.items():
+            a, b = old[name].get(metric), new[name].get(metric)
+            if not a or b is None:
+                continue
+            change = (b - a) / a * 100
+            regressed = change * worse > args.threshold
+            regressions += regressed
+            print(f'{name:<18}{metric:<20}{a:>12.3f}{b:>12.3f}{change:>+9.1f}%{"  REGRESSION" if regressed else ""}')
+    for name in sorted(set(old) ^ set(new)):
+        print(f'{name:<18}only in {"before" if name in old else "after"}')
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser(description='replays CloudEvents through the example functions')
+    commands = parser.add_subparsers(dest='command', required=True)
+    runner = commands.add_parser('run', help='replay the corpus through the functions')
+    runner.add_argument('--events', type=int, default=2000, help='events of the generated corpus')
+    runner.add_argument('--corpus', help='NDJSON file of CloudEvents instead of the generated corpus')
+    runner.add_argument('--functions', help='comma separated, default all: ' + ','.join(FUNCTIONS))
+    runner.add_argument('--mode', choices=('warm', 'classic'), default='warm', help='warm-process (of-watchdog http mode) or one process per event settings')
+    runner.add_argument('--warmup', type=int, default=50, help='events replayed before measuring')
+    runner.add_argument('--out', help='write the results as JSON, for compare')
+    generator = commands.add_parser('corpus', help='write the generated corpus as NDJSON to stdout')
+    generator.add_argument('--events', type=int, default=2000)
+    comparison = commands.add_parser('compare', help='diff the results of two runs')
+    comparison.add_argument('before')
+    comparison.add_argument('after')
+    comparison.add_argument('--threshold', type=float, default=15, help='percent a metric may get worse')
+    work = commands.add_parser('worker')
+    work.add_argument('function', choices=list(FUNCTIONS))
+    work.add_argument('corpus')
+    work.add_argument('--mode', default='warm')
+    work.add_argument('--warmup', type=int, default=50)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'corpus':
+        print('\n'.join(corpus(args.events)))
+    elif args.command == 'compare':
+        sys.exit(compare(args))
+    else:
+        print(json.dumps(worker(args.function, args.corpus, args.mode == 'warm', args.warmup)))
+
+if __name__ == '__main__':
+    main()
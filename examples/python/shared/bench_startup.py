@@ -0,0 +1,131 @@
+#
+## Benchmark - cold start of every Python example function, as after a scale from zero: a new interpreter imports the
+## handler and answers its first event. Every run is a new process started with python -X importtime, the medians of
+## the runs are reported per function
+##   import_ms  process start until the handler module is imported
+##   reject_ms  process start until the answer to an event rejected before any dependency is used (invalid JSON)
+##   first_ms   process start until the answer to a regular event, sent to the stand-in server of the tests (the
+##              import of the test module and the start of the stand-in are included)
+## followed by the modules imported by the handler that take longest (cumulative, from the -X importtime report)
+##
+## Usage:
+##   python bench_startup.py [--runs 5] [--functions pagerduty,tagging] [--top 5] [--out startup.json]
+##   python bench_startup.py --baseline startup.json [--threshold 20]
+## With a baseline the run exits with 1 if import_ms or first_ms of a function is more than threshold percent slower
+#
+import sys, os, json, time, argparse, statistics, subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+from bench_replay import FUNCTIONS, ROOT, corpus
+
+MARKER = 'STARTUP '
+METRICS = ('import_ms', 'reject_ms', 'first_ms')
+
+# runs in the folder of the function, prints the monotonic clock (shared by all processes) at each step
+CHILD = '''
+import sys, time, json, tempfile, importlib
+imported = done = None
+name, module, tests, mode, event = sys.argv[1:6]
+try:
+    if mode == 'reject':
+        handle = __import__(module).handle #the import statement path, reported by -X importtime
+        imported = time.monotonic()
+        handle(event)
+    else:
+        sys.path.insert(1, {here!r})
+        import bench_replay
+        handle = bench_replay.standin(name, importlib.import_module(tests) if tests != '-' else None, tempfile.mkdtemp())
+        handle(event)
+    done = time.monotonic()
+except Exception as err:
+    sys.stderr.write(f'{{type(err).__name__}}: {{err}}\\n')
+print({marker!r} + json.dumps({{'imported': imported, 'done': done}}), flush=True)
+import os
+os._exit(0) #warm-process threads and atexit hooks are not part of the start
+'''.format(here=HERE, marker=MARKER)
+
+def importtimes(stderr, module, top):
+    """the modules imported directly by module that took longest, (name, cumulative ms), from the -X importtime lines"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entries.append((depth, name.strip(), int(cumulative) / 1000))
+    # the modules of a subtree are reported before the module itself
+    for i, (depth, name, _) in enumerate(entries):
+        if depth == 0 and name == module:
+            start = i
+            while start > 0 and entries[start - 1][0] > 0:
+                start -= 1
+            children = [(child, ms) for d, child, ms in entries[start:i] if d == 1]
+            return sorted(children, key=lambda child: -child[1])[:top]
+    return []
+
+def run(name, mode, event):
+    folder, tests = FUNCTIONS[name]
+    module = 'echo' if name == 'echo' else 'handler'
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='')
+    start = time.monotonic()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD, name, module, tests or '-', mode, event],
+                          cwd=os.path.join(ROOT, folder), env=env, capture_output=True, text=True, timeout=120)
+    stamps = next((json.loads(line[len(MARKER):]) for line in proc.stdout.splitlines() if line.startswith(MARKER)), {})
+    ms = lambda stamp: round((stamp - start) * 1000, 1) if stamp is not None else None
+    return ms(stamps.get('imported')), ms(stamps.get('done')), proc.stderr, module
+
+def measure(name, runs, top):
+    event = corpus(1)[0]
+    imports, rejects, firsts, slowest = [], [], [], []
+    for _ in range(runs):
+        imported, rejected, stderr, module = run(name, 'reject', '{"id":')
+        imports.append(imported)
+        rejects.append(rejected)
+        slowest.append(importtimes(stderr, module, top))
+        firsts.append(run(name, 'first', event)[1])
+    median = lambda values: round(statistics.median(values), 1) if values and None not in values else None
+    modules = {}
+    for report in slowest:
+        for child, ms in report:
+            modules.setdefault(child, []).append(ms)
+    return {'import_ms': median(imports), 'reject_ms': median(rejects), 'first_ms': median(firsts),
+            'slowest_imports': sorted(((child, round(statistics.median(values), 1)) for child, values in modules.items()),
+                                      key=lambda child: -child[1])[:top]}
+
+def main():
+    parser = argparse.ArgumentParser(description='cold start of the Python example functions')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--functions', default=','.join(FUNCTIONS))
+    parser.add_argument('--top', type=int, default=5)
+    parser.add_argument('--out')
+    parser.add_argument('--baseline')
+    parser.add_argument('--threshold', type=float, default=20)
+    args = parser.parse_args()
+
+    results = {name: measure(name, args.runs, args.top) for name in args.functions.split(',')}
+    fmt = lambda value: f'{value:.1f}' if value is not None else '-'
+    print(f'{"function":<18}' + ''.join(f'{metric:>12}' for metric in METRICS) + '  slowest imports (cumulative ms)')
+    for name, result in results.items():
+        imports = ', '.join(f'{child} {ms:.1f}' for child, ms in result['slowest_imports'])
+        print(f'{name:<18}' + ''.join(f'{fmt(result[metric]):>12}' for metric in METRICS) + f'  {imports}')
+
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump({'python': sys.version.split()[0], 'runs': args.runs, 'functions': results}, out, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            before = json.load(baseline)['functions']
+        regressions = []
+        for name, result in results.items():
+            for metric in ('import_ms', 'first_ms'):
+                old, new = before.get(name, {}).get(metric), result[metric]
+                if old and new and (new - old) / old * 100 > args.threshold:
+                    regressions.append(f'{name} {metric} {old:.1f} -> {new:.1f} ms')
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+import io, json, os, socket, subprocess, sys, urllib.request, unittest
+from unittest import mock
+
+import vebalog
+import vebatch
+import vecevent
+import vefilter
+import velazy
+import vetiming
+
+SHARED = os.path.dirname(os.path.abspath(__file__))
+COPIES = {
+    'vebalog.py': ['invoke-rest-api/handler', 'trigger-pagerduty-incident/handler'],
+    'vebatch.py': ['echo/handler', 'esx-mtu-fixer/esx-mtu-fixer', 'invoke-rest-api/handler', 'tagging/handler',
+                   'trigger-pagerduty-incident/handler'],
+    'vecevent.py': ['echo/handler', 'esx-mtu-fixer/esx-mtu-fixer', 'invoke-rest-api/handler', 'tagging/handler',
+                    'trigger-pagerduty-incident/handler'],
+    'vefilter.py': ['invoke-rest-api/handler', 'tagging/handler', 'trigger-pagerduty-incident/handler'],
+    'velazy.py': ['esx-mtu-fixer/esx-mtu-fixer', 'invoke-rest-api/handler', 'tagging/handler', 'trigger-pagerduty-incident/handler'],
+    'vetiming.py': ['esx-mtu-fixer/esx-mtu-fixer', 'invoke-rest-api/handler', 'tagging/handler', 'trigger-pagerduty-incident/handler'],
+}
+
+class CopiesTest(unittest.TestCase):
+
+    def test_copies_identical(self):
+        for module, folders in COPIES.items():
+            with open(os.path.join(SHARED, module)) as shared:
+                source = shared.read()
+            for folder in folders:
+                with open(os.path.join(SHARED, '..', folder, module)) as copy:
+                    self.assertEqual(copy.read(), source, f'{folder}/{module} differs from shared/{module}')
+
+class LazyObject:
+    """counts how often it is turned into a string"""
+    formatted = 0
+
+    def __str__(self):
+        LazyObject.formatted += 1
+        return 'lazy'
+
+class LoggingTest(unittest.TestCase):
+
+    def logger(self, name, **env):
+        stream = io.StringIO()
+        with mock.patch.dict(os.environ, env, clear=True):
+            log = vebalog.getlogger(name, stream)
+        self.addCleanup(log.handlers.clear)
+        return log, stream
+
+    def test_disabled_debug_not_formatted(self):
+        log, stream = self.logger('test-disabled')
+        LazyObject.formatted = 0
+        log.debug('Event > %s', LazyObject())
+        log.debug('Event > %s', vebalog.pretty({'obj': LazyObject()}))
+        self.assertEqual(LazyObject.formatted, 0)
+        self.assertEqual(stream.getvalue(), '')
+
+    def test_debug_enabled(self):
+        log, stream = self.logger('test-enabled', write_debug='true')
+        log.debug('Event > %s', vebalog.pretty({'subject': 'VmPoweredOnEvent'}))
+        lines = stream.getvalue()
+        self.assertIn('WARNING test-enabled: DEBUG has been enabled', lines)
+        self.assertIn('DEBUG test-enabled: Event > {\n    "subject": "VmPoweredOnEvent"\n}', lines)
+
+    def test_secrets_redacted(self):
+        log, stream = self.logger('test-redacted', write_debug='true')
+        log.debug('Config > %s', vebalog.pretty({'routing_key': 'R0UT1NGK3Y', 'auth': {'basic': {'username': 'admin', 'password': 'VMware1!'}},
+                                                  'headers': {'Authorization': 'Bearer abc'}}))
+        log.debug('Connecting with user=admin password=VMware1! token: "abc"')
+        lines = stream.getvalue()
+        for secret in ('R0UT1NGK3Y', 'VMware1!', 'Bearer abc', '"abc"'):
+            self.assertNotIn(secret, lines)
+        self.assertIn('"username": "admin"', lines)
+        self.assertIn('user=admin', lines)
+
+    def test_json_format(self):
+        log, stream = self.logger('test-json', log_format='json', log_level='INFO')
+        log.debug('not emitted')
+        log.info('Delivered %d events', 3, extra={'endpoint': 'https://example.com', 'api_key': 'secret'})
+        entry = json.loads(stream.getvalue())
+        self.assertEqual((entry['level'], entry['logger'], entry['message']), ('INFO', 'test-json', 'Delivered 3 events'))
+        self.assertEqual((entry['endpoint'], entry['api_key']), ('https://example.com', '***'))
+
+EVENT = '{"id":"453120cd-3d19-4c43-aadc-df0cdbce3887","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"VmPoweredOnEvent","time":"2020-04-13T23:46:10.402531287Z","data":{"Key":7441,"ChainId":7438,"CreatedTime":"2020-04-13T23:46:09.387283Z","UserName":"Administrator","Datacenter":{"Name":"PKLAB","Datacenter":{"Type":"Datacenter","Value":"datacenter-3"}},"ComputeResource":{"Name":"esxi01.pdotk.local","ComputeResource":{"Type":"ComputeResource","Value":"domain-s29"}},"Host":{"Name":"esxi01.pdotk.local","Host":{"Type":"HostSystem","Value":"host-31"}},"Vm":{"Name":"Test VM","Vm":{"Type":"VirtualMachine","Value":"vm-33"}},"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"Test VM on esxi01.pdotk.local in PKLAB has powered on","ChangeTag":"","Template":false},"datacontenttype":"application/json"}'
+
+class DecodeTest(unittest.TestCase):
+
+    def backends(self):
+        """runs the test with orjson (if installed) and with the standard json module"""
+        backends = [None] + ([vecevent.orjson] if vecevent.orjson is not None else [])
+        for backend in backends:
+            with mock.patch.object(vecevent, 'orjson', backend), self.subTest(orjson=backend is not None):
+                yield
+
+    def test_envelope_view(self):
+        for _ in self.backends():
+            event = vecevent.decode(EVENT)
+            self.assertEqual((event.subject, event.source, event.key, event.user), ('VmPoweredOnEvent', 'https://vcsa.pdotk.local/sdk', 7441, 'Administrator'))
+            self.assertEqual((event.vm.name, event.vm.type, event.vm.value), ('Test VM', 'VirtualMachine', 'vm-33'))
+            self.assertEqual((event.host.name, event.host.value, event.datacenter.value), ('esxi01.pdotk.local', 'host-31', 'datacenter-3'))
+            self.assertIsNone(event.ds)
+            self.assertEqual(event.data['ChangeTag'], '')
+            event.require('vm', 'host', 'message')
+            with self.assertRaisesRegex(KeyError, 'dvs'):
+                event.require('vm', 'dvs')
+
+    def test_other_documents(self):
+        for _ in self.backends():
+            with self.assertRaises(vecevent.DecodeError):
+                vecevent.decode('{"id":')
+            for req in ('[1, 2]', '{"subject": "UserLogoutSessionEvent", "data": {"Vm": null, "Host": {"Name": "esxi01"}}}'):
+                event = vecevent.decode(req)
+                self.assertIsNone(event.vm)
+                self.assertIsNone(event.host)
+            self.assertEqual(vecevent.loads('{"Key": 18446744073709551616}'), {'Key': 2 ** 64})
+
+    def test_dumps(self):
+        for _ in self.backends():
+            self.assertEqual(json.loads(vecevent.dumps({'status': '200', 'message': 'ok'})), {'status': '200', 'message': 'ok'})
+            self.assertEqual(json.loads(vecevent.dumps({1: 'non-str key'})), {'1': 'non-str key'})
+            self.assertEqual(vecevent.dumps({'a': [1]}, indent=True), '{\n  "a": [\n    1\n  ]\n}')
+
+class TimingTest(unittest.TestCase):
+
+    def handle(self, timings):
+        @timings.timed
+        def handle(req):
+            with timings.stage('decode'):
+                pass
+            for _ in range(2):
+                with timings.stage('dispatch'):
+                    pass
+            return req
+        return handle
+
+    def test_disabled(self):
+        timings = vetiming.Timings('test', warm=False, enabled=False, stream=io.StringIO())
+        self.assertEqual(self.handle(timings)('ok'), 'ok')
+        self.assertIs(timings.stage('decode'), vetiming.NULL_STAGE)
+        self.assertEqual(timings.stream.getvalue(), '')
+
+    def test_classic_trailer(self):
+        timings = vetiming.Timings('test', warm=False, enabled=True, stream=io.StringIO())
+        self.handle(timings)('ok')
+        trailer = json.loads(timings.stream.getvalue())
+        self.assertEqual(trailer['function'], 'test')
+        self.assertEqual(sorted(trailer['stages_ms']), ['decode', 'dispatch', 'total'])
+
+    def test_warm_histogram_served(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        timings = vetiming.Timings('test', warm=True, enabled=True, port=port)
+        handle = self.handle(timings)
+        for _ in range(3):
+            handle('ok')
+        self.addCleanup(timings.server.server_close)
+        self.addCleanup(timings.server.shutdown)
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics') as resp:
+            text = resp.read().decode()
+        self.assertIn('veba_function_stage_seconds_count{function="test",stage="dispatch"} 6', text)
+        self.assertIn('veba_function_stage_seconds_bucket{function="test",stage="total",le="+Inf"} 3', text)
+
+    def test_warm_stats_served(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        timings = vetiming.Timings('test', warm=True, enabled=False, port=port)
+        depth = [3]
+        timings.report('queue', lambda: {'depth': depth[0]})
+        self.addCleanup(timings.server.server_close)
+        self.addCleanup(timings.server.shutdown)
+        depth[0] = 4
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/stats') as resp:
+            self.assertEqual(resp.headers['Content-Type'], 'application/json')
+            self.assertEqual(json.loads(resp.read()), {'queue': {'depth': 4}})
+
+class FilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.filter = vefilter.EventFilter(['VmPoweredOnEvent', 'VmPoweredOffEvent'], ['com.vmware.event.router/event'],
+                                           ['data.Vm.Vm.Value', 'data.Host'])
+
+    def event(self, subject='VmPoweredOnEvent', vm={'Name': 'Test VM', 'Vm': {'Type': 'VirtualMachine', 'Value': 'vm-33'}}, **envelope):
+        cevent = {'id': '1', 'source': 'https://vcsa/sdk', 'subject': subject, 'type': 'com.vmware.event.router/event',
+                  'data': {'Key': 1, 'Host': {'Name': 'esxi01', 'Host': {'Type': 'HostSystem', 'Value': 'host-31'}}, 'Vm': vm}}
+        cevent.update(envelope)
+        return json.dumps(cevent)
+
+    def test_accepted(self):
+        self.assertIsNone(self.filter.reject(self.event()))
+        self.assertIsNone(self.filter.reject(json.dumps(json.loads(self.event('VmPoweredOffEvent')), indent=2)))
+
+    def test_rejected(self):
+        self.assertEqual(self.filter.reject(self.event('UserLogoutSessionEvent')), 'subject UserLogoutSessionEvent not accepted')
+        self.assertEqual(self.filter.reject(self.event(type='com.vmware.event.router/other')), 'type com.vmware.event.router/other not accepted')
+        self.assertEqual(self.filter.reject(self.event(vm=None)), 'no value for Vm')
+        self.assertEqual(self.filter.reject('{"id":'), 'no subject')
+
+    def test_undecided_passed_on(self):
+        self.assertIsNone(self.filter.reject(self.event('VmPowered\u004fnEvent')))
+        self.assertIsNone(self.filter.reject(self.event(['VmPoweredOnEvent'])))
+
+    def test_disabled(self):
+        with mock.patch.dict(os.environ, {'filter_subjects': ' ', 'filter_require': ''}):
+            self.assertFalse(vefilter.EventFilter.fromenv().enabled)
+        with mock.patch.dict(os.environ, {'filter_subjects': 'VmPoweredOnEvent, VmPoweredOffEvent'}):
+            self.assertEqual(vefilter.EventFilter.fromenv().subjects, {'VmPoweredOnEvent', 'VmPoweredOffEvent'})
+
+class BatchTest(unittest.TestCase):
+
+    def test_isbatch(self):
+        self.assertTrue(vebatch.isbatch('{"id":"1"}\n{"id":"2"}\n'))
+        self.assertFalse(vebatch.isbatch('{"id":"1"}\n'))
+        self.assertFalse(vebatch.isbatch(json.dumps({'id': '1', 'data': {'Vm': {'Name': 'a'}}}, indent=2)))
+        eventex = {'id': '1', 'data': {'Arguments': [{'Key': 'resourceName', 'Value': 'storage'}]}}
+        self.assertFalse(vebatch.isbatch(json.dumps(eventex, indent=0)))
+        self.assertFalse(vebatch.isbatch(json.dumps([eventex, eventex], indent=0)))
+        self.assertFalse(vebatch.isbatch('[{"id":"1"}\n,{"id":"2"}]'))
+
+    def test_lines(self):
+        self.assertEqual(list(vebatch.lines('{"id":"1"}\r\n\n  {"id":"2"}')), ['{"id":"1"}', '{"id":"2"}'])
+        self.assertEqual(list(vebatch.lines(io.StringIO('{"id":"1"}\n\n{"id":"2"}\n'))), ['{"id":"1"}', '{"id":"2"}'])
+
+    def test_results_in_order_and_bounded(self):
+        read = []
+        def events():
+            for i in range(20):
+                read.append(i)
+                yield str(i)
+        def handle(req):
+            if req == '3':
+                raise RuntimeError('lost connection')
+            return req
+        results = vebatch.results(handle, events(), concurrency=4)
+        self.assertEqual(next(results), '0')
+        self.assertLessEqual(len(read), 4)
+        rest = list(results)
+        self.assertEqual(json.loads(rest[2])['status'], '500')
+        self.assertEqual(rest[:2] + rest[3:], [str(i) for i in range(1, 20) if i != 3])
+
+    def test_batched(self):
+        scopes = []
+        class Scope:
+            def __enter__(self):
+                scopes.append('enter')
+            def __exit__(self, *exc):
+                scopes.append('exit')
+        handle = vebatch.batched(Scope)(lambda req: json.loads(req)['id'])
+        self.assertEqual(handle('{"id":"1"}'), '1')
+        self.assertEqual(scopes, [])
+        self.assertEqual(handle('{"id":"1"}\n{"id":"2"}\n{"id":"3"}'), '1\n2\n3')
+        self.assertEqual(scopes, ['enter', 'exit'])
+        out = io.StringIO()
+        self.assertEqual(vebatch.stream(handle.single, io.StringIO('{"id":"4"}\n{"id":"5"}\n'), out, handle.scope), 2)
+        self.assertEqual(out.getvalue(), '4\n5\n')
+
+class LazyTest(unittest.TestCase):
+
+    def test_imported_on_first_use(self):
+        sys.modules.pop('colorsys', None)
+        colorsys = velazy.lazy('colorsys')
+        self.assertNotIn('colorsys', sys.modules)
+        self.assertEqual(colorsys.rgb_to_hsv(1.0, 0.0, 0.0), (0.0, 1.0, 1.0))
+        self.assertIn('colorsys', sys.modules)
+        self.assertIn('loaded', repr(colorsys))
+
+    def test_attribute_and_submodule(self):
+        self.assertIs(velazy.lazy('os', 'path').join, os.path.join)
+        # xml does not import its subpackages
+        self.assertEqual(velazy.lazy('xml').dom.Node.ELEMENT_NODE, 1)
+        self.assertFalse(hasattr(velazy.lazy('xml'), 'nothing'))
+
+    def test_patch_goes_to_module(self):
+        lazyos = velazy.lazy('os')
+        with mock.patch.object(lazyos, 'getcwd', lambda: '/patched'):
+            self.assertEqual(os.getcwd(), '/patched')
+        self.assertNotEqual(os.getcwd(), '/patched')
+
+    def test_handlers_start_without_dependencies(self):
+        check = 'import sys, handler; print(",".join(m for m in ("requests", "urllib3", "dpath", "toml", "pyVmomi") if m in sys.modules))'
+        for folder in COPIES['velazy.py']:
+            imported = subprocess.run([sys.executable, '-c', check], cwd=os.path.join(SHARED, '..', folder),
+                                      capture_output=True, text=True, check=True).stdout.strip()
+            self.assertEqual(imported, '', f'{folder} imports {imported} on start')
+
+if __name__ == '__main__':
+    unittest.main()
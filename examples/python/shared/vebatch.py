@@ -0,0 +1,131 @@
+#
+## Batch input shared by the Python example functions - keep the copies in the function folders identical to
+## examples/python/shared/vebatch.py (see examples/python/shared/README.md)
+##
+## A request body of newline-delimited CloudEvents (NDJSON, one event per line) is handled event by event and answered
+## with one result line per event, in the order of the events. The function keeps its connections and configuration
+## for the whole batch (scope), as in warm-process mode
+##     @batched(batchscope)
+##     @TIMINGS.timed
+##     def handle(req):
+## For backfills and replays a file or a stream is piped through the function from its folder, the events are read and
+## the results written line by line, at most batch_concurrency events are held in memory
+##     python vebatch.py events.ndjson > results.ndjson
+##     kubectl logs ... | python vebatch.py > results.ndjson
+#
+import contextlib, functools, importlib, json, os, sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# events handled at the same time, the results are still written in the order of the events
+CONCURRENCY = int(os.getenv('batch_concurrency', '4'))
+
+def isbatch(req):
+    """NDJSON has a complete event on its first line and more lines after it, a single (even pretty-printed) event or
+    a JSON array of events has not"""
+    if not isinstance(req, str):
+        return False
+    req = req.strip()
+    end = req.find('\n')
+    if end < 0 or not req.startswith('{'):
+        return False
+    try:
+        return isinstance(json.loads(req[:end]), dict)
+    except ValueError:
+        return False
+
+def lines(source):
+    """the non-empty lines of a str or a file, a str is not split up front"""
+    if isinstance(source, str):
+        start, size = 0, len(source)
+        while start < size:
+            end = source.find('\n', start)
+            if end < 0:
+                end = size
+            line = source[start:end].strip()
+            start = end + 1
+            if line:
+                yield line
+        return
+    for line in source:
+        line = line.strip()
+        if line:
+            yield line
+
+def safe(handle):
+    """handle(req) answering an exception with a result line, one failed event does not end the batch"""
+    def safehandle(req):
+        try:
+            return handle(req)
+        except Exception as err:
+            return json.dumps({'status': '500', 'message': 'Unexpected error occurred > {0}: {1}'.format(type(err).__name__, err)})
+    return safehandle
+
+def results(handle, events, concurrency=None):
+    """handle() of every event in order, with at most concurrency events read ahead and in flight"""
+    concurrency = CONCURRENCY if concurrency is None else concurrency
+    handle = safe(handle)
+    if concurrency <= 1:
+        for event in events:
+            yield handle(event)
+        return
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch') as pool:
+        window = deque()
+        for event in events:
+            window.append(pool.submit(handle, event))
+            if len(window) >= concurrency:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+def stream(handle, source, out, scope=None, concurrency=None):
+    """
+    Writes the result of every event in source to out, one per line
+
+    Arguments:
+        handle {function} -- handle(req) of a single event
+        source {str|file} -- NDJSON events
+        out {file} -- where the result lines go
+        scope {function} -- context manager keeping connections and configuration for the batch
+
+    Returns:
+        int -- number of events
+    """
+    count = 0
+    with scope() if scope is not None else contextlib.nullcontext():
+        for result in results(handle, lines(source), concurrency):
+            out.write(result + '\n')
+            count += 1
+    return count
+
+def batched(scope=None):
+    """decorates handle(req), NDJSON request bodies are handled as a batch, see the top of this file"""
+    def decorate(handle):
+        @functools.wraps(handle)
+        def batchhandle(req):
+            if not isbatch(req):
+                return handle(req)
+            with scope() if scope is not None else contextlib.nullcontext():
+                return '\n'.join(results(handle, lines(req)))
+        batchhandle.single = handle
+        batchhandle.scope = scope
+        return batchhandle
+    return decorate
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Handles the NDJSON CloudEvents of a file or stdin with the function of the current folder')
+    parser.add_argument('events', nargs='?', help='NDJSON file, stdin by default')
+    parser.add_argument('--module', default='handler', help='module of the function (default: handler)')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='events handled at the same time')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.getcwd())
+    handle = importlib.import_module(args.module).handle
+    single, scope = getattr(handle, 'single', handle), getattr(handle, 'scope', None)
+    with open(args.events) if args.events else contextlib.nullcontext(sys.stdin) as source:
+        count = stream(single, source, sys.stdout, scope, args.concurrency)
+    sys.stderr.write(f'{count} events\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#
+## Lazy imports shared by the Python example functions - keep the copies in the function folders identical to
+## examples/python/shared/velazy.py (see examples/python/shared/README.md)
+##
+## Heavy dependencies are bound to a placeholder that imports them on first use, the import cost then lands on the
+## first event that needs the module instead of on the start of the process, events answered before (filtered,
+## invalid JSON, coalesced) never pay it
+##     requests = lazy('requests')            # import requests
+##     vim = lazy('pyVmomi', 'vim')           # from pyVmomi import vim
+## In warm-process mode preload() imports them in a background thread as soon as the handler is loaded, so they are
+## usually ready before the first event arrives
+#
+import importlib, sys, threading
+
+class LazyModule:
+    """
+    LazyModule stands in for a module (or an attribute of one) until an attribute of it is used
+    """
+
+    def __init__(self, name, attr=None):
+        object.__setattr__(self, '_lazy', (name, attr, threading.Lock()))
+        object.__setattr__(self, '_module', None)
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            name, attr, lock = self._lazy
+            with lock:
+                module = self._module
+                if module is None:
+                    module = importlib.import_module(name)
+                    if attr is not None:
+                        module = getattr(module, attr, None) or importlib.import_module(name + '.' + attr)
+                    object.__setattr__(self, '_module', module)
+        return module
+
+    def __getattr__(self, name):
+        module = self._load()
+        try:
+            return getattr(module, name)
+        except AttributeError:
+            pass
+        try:
+            # a submodule that its package does not import, eg. dpath.util
+            return importlib.import_module(module.__name__ + '.' + name)
+        except ImportError:
+            raise AttributeError(f'module {module.__name__!r} has no attribute {name!r}') from None
+
+    # writes go to the module, eg. mock.patch.object(connect, 'SmartConnect', ...) in the tests
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._load(), name)
+
+    def __repr__(self):
+        name, attr, _ = self._lazy
+        return f'<lazy {name}{"." + attr if attr else ""}{" (loaded)" if self._module is not None else ""}>'
+
+def lazy(name, attr=None):
+    """
+    Arguments:
+        name {str} -- module to import on first use
+        attr {str} -- attribute (or submodule) of the module to stand in for, as in from name import attr
+
+    Returns:
+        LazyModule -- placeholder of the module
+    """
+    return LazyModule(name, attr)
+
+def preload(*modules):
+    """imports the lazy modules in a background thread, failures are left to the first use"""
+    def load():
+        for module in modules:
+            try:
+                module._load()
+            except ImportError as err:
+                sys.stderr.write(f'preload of {module!r} failed: {err}\n')
+    threading.Thread(target=load, name='preload', daemon=True).start()
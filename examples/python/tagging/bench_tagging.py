@@ -0,0 +1,72 @@
+#
+## Benchmark - objects tagged per second against the fake VAPI server used by the tests
+## Compares one tag-association call per event with the bulk mode, for events arriving concurrently, and the tag calls
+## for the same VMs powered on again (e.g. daily reboots) with and without the association cache
+##
+## Usage: python bench_tagging.py [number of events, default 300] [fake VAPI latency in ms, default 20]
+#
+import sys, os, json, time, tempfile, threading, contextlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'handler'))
+import handler
+from tagbatch import TagBatcher
+from tagcache import AssociationCache
+from test_tagging import FakeVAPI, fakesession, event
+
+CONCURRENCY = 128
+
+class BenchServer(ThreadingHTTPServer):
+    request_queue_size = CONCURRENCY # connections of all callers are accepted, not reset
+
+def run(count, batcher, associations=None, rounds=1):
+    FakeVAPI.calls = []
+    FakeVAPI.attached = {}
+    handler.BATCHER = batcher
+    handler.ASSOCIATIONS = associations
+    events = [event(f'vm-{i}') for i in range(count)] * rounds
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool, open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results = list(pool.map(handler.handle, events))
+    elapsed = time.perf_counter() - start
+    assert all(json.loads(res)['status'] == '200' for res in results)
+    return len(events) / elapsed, sum(1 for call in FakeVAPI.calls if 'tag-association' in call[1])
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    FakeVAPI.reset()
+    FakeVAPI.delay = (float(sys.argv[2]) if len(sys.argv) > 2 else 20) / 1000
+
+    server = BenchServer(('127.0.0.1', 0), FakeVAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    fd, config = tempfile.mkstemp(suffix='.toml')
+    with os.fdopen(fd, 'w') as configfile:
+        configfile.write(f'[vcenter]\nserver = "127.0.0.1:{server.server_port}"\nuser = "bench"\npassword = "bench"\n\n'
+                         '[tag]\nurn = "urn:vmomi:InventoryServiceTag:bench:GLOBAL"\naction = "attach"\n')
+    handler.VC_CONFIG = config
+    handler.WARM_PROCESS = True
+    handler.SESSION = fakesession()
+
+    print(f'{count} events from {CONCURRENCY} concurrent callers, fake VAPI latency {FakeVAPI.delay*1000:.0f}ms')
+    print(f'{"mode":<28}{"objects/s":>12}{"tag calls":>12}')
+    rate, calls = run(count, None)
+    print(f'{"per object":<28}{rate:>12.0f}{calls:>12}')
+    for window, max_objects in [(0.02, 100), (0.05, 100), (0.05, 500)]:
+        rate, calls = run(count, TagBatcher(handler.flushbatch, window, max_objects))
+        print(f'{f"bulk {window*1000:.0f}ms / {max_objects} objects":<28}{rate:>12.0f}{calls:>12}')
+
+    print(f'\nthe same {count} VMs powered on 3 times')
+    rate, calls = run(count, None, rounds=3)
+    print(f'{"per object":<28}{rate:>12.0f}{calls:>12}')
+    rate, calls = run(count, None, AssociationCache(300), rounds=3)
+    print(f'{"per object + cache":<28}{rate:>12.0f}{calls:>12}')
+    rate, calls = run(count, TagBatcher(handler.flushbatch, 0.05, 100), AssociationCache(300), rounds=3)
+    print(f'{"bulk 50ms + cache":<28}{rate:>12.0f}{calls:>12}')
+
+    handler.shutdown()
+    server.shutdown()
+    os.remove(config)
+
+if __name__ == '__main__':
+    main()
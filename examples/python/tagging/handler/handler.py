@@ -1,16 +1,55 @@
-import sys, json, os
-import urllib3
-import requests
-import toml
+import sys, json, os, re
+import atexit, contextlib, signal, threading
 
-# Surpress SSL warnings
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+try:
+    from .tagbatch import TagBatcher
+    from .tagcache import AssociationCache
+    from .tagrules import RuleIndex
+    from .vebatch import batched
+    from .vecevent import DecodeError, decode, dumps
+    from .vefilter import EventFilter
+    from .velazy import lazy, preload
+    from .vetiming import Timings
+except ImportError:
+    from tagbatch import TagBatcher
+    from tagcache import AssociationCache
+    from tagrules import RuleIndex
+    from vebatch import batched
+    from vecevent import DecodeError, decode, dumps
+    from vefilter import EventFilter
+    from velazy import lazy, preload
+    from vetiming import Timings
+
+# imported on first use, see velazy.py
+requests = lazy('requests')
+urllib3 = lazy('urllib3')
+toml = lazy('toml')
 
 ### VAPI REST endpoints
 VAPI_SESSION_PATH='/rest/com/vmware/cis/session'
+VAPI_SESSION_HEADER='vmware-api-session-id'
 VAPI_TAG_PATH='/rest/com/vmware/cis/tagging/tag-association/id:'
+VAPI_BULK_ACTIONS={'attach': 'attach-tag-to-multiple-objects', 'detach': 'detach-tag-from-multiple-objects'}
+VAPI_MULTI_TAG_PATH='/rest/com/vmware/cis/tagging/tag-association'
+VAPI_MULTI_TAG_ACTIONS={'attach': 'attach-multiple-tags-to-object', 'detach': 'detach-multiple-tags-from-object'}
 VC_CONFIG='/var/openfaas/secrets/vcconfig'
 
+### Warm-process mode (of-watchdog http mode, eg. the python3-flask template)
+### vCenter sessions are kept and reused across invocations and logged out when the process shuts down
+WARM_PROCESS = bool(os.getenv("warm_process")) or os.getenv("mode") == "http"
+if WARM_PROCESS:
+    preload(requests, urllib3, toml)
+
+### Bulk mode (warm-process mode only)
+### objects from concurrent events are buffered for bulk_window_ms (or up to bulk_max_objects) and tagged with one request
+BULK_WINDOW = int(os.getenv("bulk_window_ms", "0")) / 1000
+BULK_MAX_OBJECTS = int(os.getenv("bulk_max_objects", "100"))
+
+### Association cache (warm-process mode only)
+### the objects of a tag are listed once per tag_cache_ttl seconds, attaching a tag an object already carries (or
+### detaching one it does not carry) is then answered without a request, 0 disables the cache
+TAG_CACHE_TTL = float(os.getenv("tag_cache_ttl", "300"))
+
 ### Simple VAPI REST tagging implementation
 class FaaSResponse:
     """FaaSResponse is a helper class to construct a properly formatted message returned by this function.
@@ -27,6 +66,159 @@ class FaaSResponse:
         self.status=status
         self.message=message
 
+def objkey(obj):
+    """the (type, id) of a ManagedObjectReference, as listed by list-attached-objects"""
+    return (obj['object_id']['type'], obj['object_id']['id'])
+
+def combine(results):
+    """combines the results of several tagging calls for one event into a single FaaSResponse"""
+    if len(results) == 1:
+        return results[0]
+    status = '200' if all(res.status == '200' for res in results) else '500'
+    return FaaSResponse(status, '; '.join(res.message for res in results))
+
+class TagConfig:
+    """TagConfig is the parsed vcconfig.toml. The tagging rules are compiled into a RuleIndex when the
+    file is loaded, the legacy [tag] table is treated as a rule matching every event.
+    """
+
+    def __init__(self, vcconfig):
+        """
+        
+        Arguments:
+
+            vcconfig {dict} -- contents of vcconfig.toml
+
+        Raises:
+            KeyError -- mandatory configuration key not found
+            ValueError -- invalid tagging rule
+        """
+        self.vc=vcconfig['vcenter']['server']
+        self.username=vcconfig['vcenter']['user']
+        self.password=vcconfig['vcenter']['password']
+        rules=list(vcconfig.get('rules', []))
+        self.tagurn=None
+        self.action=None
+        if 'tag' in vcconfig or not rules:
+            self.tagurn=vcconfig['tag']['urn']
+            self.action=vcconfig['tag']['action'].lower()
+            rules.append({'tags': [self.tagurn], 'action': self.action})
+        self.rules=RuleIndex(rules)
+
+class ConfigCache:
+    """ConfigCache keeps the parsed configuration until the secret file changes."""
+
+    def __init__(self):
+        self.key=None
+        self.config=None
+        self.lock=threading.Lock()
+
+    def load(self, path):
+        """returns the configuration for path, parsing it again only if the file has changed
+        
+        Returns:
+            TagConfig -- parsed configuration
+        """
+        key=(path, os.stat(path).st_mtime_ns)
+        with self.lock:
+            if key != self.key:
+                with open(path, 'r') as vcconfigfile:
+                    self.config=TagConfig(toml.load(vcconfigfile))
+                self.key=key
+            return self.config
+
+CONFIG_CACHE=ConfigCache()
+
+class SessionCache:
+    """SessionCache holds vCenter REST API session tokens keyed by server and user."""
+
+    def __init__(self):
+        self.tokens={}
+        self.lock=threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.tokens.get(key)
+
+    def put(self, key, token):
+        with self.lock:
+            self.tokens[key]=token
+
+    def invalidate(self, key, token):
+        """drops the token for key unless it has already been replaced by a newer one"""
+        with self.lock:
+            if self.tokens.get(key) == token:
+                del self.tokens[key]
+
+    def logout(self, conn):
+        """logs out all cached sessions
+        
+        Arguments:
+
+            conn {Session} -- connection to vCenter REST API
+        """
+        with self.lock:
+            tokens, self.tokens = self.tokens, {}
+        for (server, _), token in tokens.items():
+            try:
+                conn.delete('https://'+server+VAPI_SESSION_PATH, headers={VAPI_SESSION_HEADER: token})
+            except requests.RequestException as err:
+                sys.stderr.write(f'could not log out of vCenter {server}: {err}\n')
+
+SESSIONS=SessionCache()
+SESSION=None
+
+def getsession():
+    """returns the connection to the VAPI REST endpoint, in warm-process mode the same one is reused
+    
+    Returns:
+        Session -- connection to vCenter REST API
+    """
+    global SESSION
+    if WARM_PROCESS and SESSION is not None:
+        return SESSION
+    # Surpress SSL warnings
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    s=requests.Session()
+    s.verify=False
+    if WARM_PROCESS:
+        SESSION=s
+    return s
+
+def shutdown():
+    """logs out the cached vCenter sessions, registered for process exit in warm-process mode"""
+    if SESSION is not None:
+        SESSIONS.logout(SESSION)
+        SESSION.close()
+
+@contextlib.contextmanager
+def batchscope():
+    """the session and the vCenter logins are kept for a batch of events (see vebatch.py), as in warm-process mode"""
+    global WARM_PROCESS, SESSION
+    warm, WARM_PROCESS = WARM_PROCESS, True
+    try:
+        getsession() #created before the events of the batch are handled concurrently
+        yield
+    finally:
+        WARM_PROCESS = warm
+        if not warm and SESSION is not None:
+            shutdown()
+            SESSION = None
+
+if WARM_PROCESS:
+    atexit.register(shutdown)
+    previous = signal.getsignal(signal.SIGTERM)
+    def onterm(signum, frame):
+        shutdown()
+        if callable(previous):
+            previous(signum, frame)
+        else:
+            sys.exit(0)
+    try:
+        signal.signal(signal.SIGTERM, onterm)
+    except ValueError:
+        pass # not imported from the main thread, rely on atexit
+
 class Tagger:
     """Tagger is a vSphere REST API tagging client used to connect and tag objects in vCenter."""    
 
@@ -39,99 +231,341 @@ class Tagger:
         """        
 
         try:
-            with open(VC_CONFIG, 'r') as vcconfigfile:
-                vcconfig = toml.load(vcconfigfile)
-                self.vc=vcconfig['vcenter']['server']
-                self.username=vcconfig['vcenter']['user']
-                self.password=vcconfig['vcenter']['password']
-                self.tagurn=vcconfig['tag']['urn']
-                self.action=vcconfig['tag']['action'].lower()
+            vcconfig = CONFIG_CACHE.load(VC_CONFIG)
+            self.vc=vcconfig.vc
+            self.username=vcconfig.username
+            self.password=vcconfig.password
+            self.tagurn=vcconfig.tagurn
+            self.action=vcconfig.action
+            self.rules=vcconfig.rules
+            self.token=None
         except OSError as e:
             print(f'could not read vcenter configuration: {e}')
             sys.exit(1)
         except KeyError as e:
             print(f'mandatory configuration key not found: {e}')
             sys.exit(1)
+        except ValueError as e:
+            print(f'invalid vcenter configuration: {e}')
+            sys.exit(1)
         self.session=conn
 
     # vCenter connection handling    
-    def connect(self):
-        """performs a login to vCenter
+    def connect(self, force=False):
+        """performs a login to vCenter unless a session for this server and user is cached
         
+        Arguments:
+
+            force {bool} -- ignore the cached session and log in again
+
         Returns:
             FaaSResponse -- status code and message
         """        
+        key=(self.vc, self.username)
+        self.token=None if force else SESSIONS.get(key)
+        if self.token:
+            return FaaSResponse('200', 'reusing vCenter session')
         try:
             resp = self.session.post('https://'+self.vc+VAPI_SESSION_PATH,auth=(self.username,self.password))
             resp.raise_for_status()
+            self.token=resp.json()['value']
+            SESSIONS.put(key, self.token)
             return FaaSResponse('200', 'successfully connected to vCenter')
         except (requests.HTTPError, requests.ConnectionError) as err:
             return FaaSResponse('500', 'could not connect to vCenter {0}'.format(err))
+        except (ValueError, KeyError) as err:
+            return FaaSResponse('500', 'could not read vCenter session token {0}'.format(err))
+
+    def disconnect(self):
+        """logs out of the vCenter session used by this tagger"""
+        if self.token:
+            SESSIONS.invalidate((self.vc, self.username), self.token)
+            try:
+                self.session.delete('https://'+self.vc+VAPI_SESSION_PATH,headers={VAPI_SESSION_HEADER: self.token})
+            except requests.RequestException as err:
+                sys.stderr.write(f'could not log out of vCenter: {err}\n')
+            self.token=None
+
+    def request(self, method, path, **kwargs):
+        """sends an authenticated request, logging in again once if the session has expired (401)
+        
+        Returns:
+            Response -- the VAPI REST response
+        """
+        resp = self.session.request(method,'https://'+self.vc+path,headers={VAPI_SESSION_HEADER: self.token},**kwargs)
+        if resp.status_code == 401:
+            SESSIONS.invalidate((self.vc, self.username), self.token)
+            if self.connect(force=True).status == '200':
+                resp = self.session.request(method,'https://'+self.vc+path,headers={VAPI_SESSION_HEADER: self.token},**kwargs)
+        return resp
 
     # VAPI REST tagging implementation        
-    def tag(self,obj):
+    def tag(self,obj,tagurn=None,action=None):
         """tags an object in vCenter
         
         Arguments:
 
             obj {dict} -- ManagedObjectReference
+            tagurn {str} -- tag to attach or detach, defaults to the [tag] urn of the configuration
+            action {str} -- attach or detach, defaults to the [tag] action of the configuration
+
+        Returns:
+            FaaSResponse -- status code and message
+        """        
+        tagurn=tagurn or self.tagurn
+        action=action or self.action
+        if self.unchanged(obj, tagurn, action):
+            return FaaSResponse('200', 'tag already {0}ed on: {1}'.format(action, obj['object_id']['id']))
+        try:
+            resp = self.request('post',VAPI_TAG_PATH+tagurn+'?~action='+action,json=obj)
+            resp.raise_for_status()
+            self.remember([tagurn], action, [obj])
+            return FaaSResponse('200', 'successfully {0}ed tag on: {1}'.format(action, obj['object_id']['id']))
+        except (requests.HTTPError, requests.ConnectionError) as err:
+            self.forget([tagurn])
+            return FaaSResponse('500', 'could not tag object {0}'.format(err))
+
+    def tagmulti(self,obj,tagurns,action):
+        """attaches or detaches several tags on one object with a single request
+        
+        Arguments:
+
+            obj {dict} -- ManagedObjectReference
+            tagurns {list} -- tags to attach or detach
+            action {str} -- attach or detach
 
         Returns:
             FaaSResponse -- status code and message
         """        
+        tagurns=[tagurn for tagurn in tagurns if not self.unchanged(obj, tagurn, action)]
+        if not tagurns:
+            return FaaSResponse('200', 'tags already {0}ed on: {1}'.format(action, obj['object_id']['id']))
         try:
-            resp = self.session.post('https://'+self.vc+VAPI_TAG_PATH+self.tagurn+'?~action='+self.action,json=obj)
+            resp = self.request('post',VAPI_MULTI_TAG_PATH+'?~action='+VAPI_MULTI_TAG_ACTIONS[action],json={'object_id': obj['object_id'], 'tag_ids': tagurns})
             resp.raise_for_status()
-            print(resp.text)
-            return FaaSResponse('200', 'successfully {0}ed tag on: {1}'.format(self.action, obj['object_id']['id']))
-        except requests.HTTPError as err:
+            result = resp.json().get('value') or {}
+        except (requests.HTTPError, requests.ConnectionError) as err:
+            self.forget(tagurns)
             return FaaSResponse('500', 'could not tag object {0}'.format(err))
+        except (ValueError, KeyError) as err:
+            self.forget(tagurns)
+            return FaaSResponse('500', 'unexpected tagging response {0}'.format(err))
+        errors = result.get('error_messages') or []
+        success = result.get('success', True)
+        if not (success or (success is not False and not errors)):
+            self.forget(tagurns)
+            return FaaSResponse('500', 'could not tag object {0}: {1}'.format(obj['object_id']['id'], errors or 'request failed without error messages'))
+        self.remember(tagurns, action, [obj])
+        return FaaSResponse('200', 'successfully {0}ed {1} tags on: {2}'.format(action, len(tagurns), obj['object_id']['id']))
+
+    def apply(self,obj,actions):
+        """performs the tagging actions matched by the rules on an object, one request per action
+        
+        Arguments:
+
+            obj {dict} -- ManagedObjectReference
+            actions {dict} -- action to list of tag urns, see RuleIndex.match()
+
+        Returns:
+            FaaSResponse -- status code and message
+        """        
+        results=[]
+        for action, tagurns in actions.items():
+            if len(tagurns) == 1:
+                results.append(self.tag(obj, tagurns[0], action))
+            else:
+                results.append(self.tagmulti(obj, tagurns, action))
+        return combine(results)
+
+    def tagmany(self,objs,tagurn=None,action=None):
+        """tags several objects in vCenter with a single bulk request
+        
+        Arguments:
+
+            objs {list} -- objects as passed to tag()
+            tagurn {str} -- tag to attach or detach, defaults to the [tag] urn of the configuration
+            action {str} -- attach or detach, defaults to the [tag] action of the configuration
+
+        Returns:
+            list -- FaaSResponse for every object, in the same order
+        """        
+        tagurn=tagurn or self.tagurn
+        action=action or self.action
+        unchanged = [self.unchanged(obj, tagurn, action) for obj in objs]
+        if any(unchanged):
+            results = iter(self.tagmany([obj for obj, skip in zip(objs, unchanged) if not skip], tagurn, action) if not all(unchanged) else [])
+            return [FaaSResponse('200', 'tag already {0}ed on: {1}'.format(action, obj['object_id']['id'])) if skip else next(results)
+                    for obj, skip in zip(objs, unchanged)]
+        try:
+            ids = [obj['object_id'] for obj in objs]
+            resp = self.request('post',VAPI_TAG_PATH+tagurn+'?~action='+VAPI_BULK_ACTIONS[action],json={'object_ids': ids})
+            resp.raise_for_status()
+            result = resp.json().get('value') or {}
+        except (requests.HTTPError, requests.ConnectionError) as err:
+            self.forget([tagurn])
+            return [FaaSResponse('500', 'could not tag object {0}'.format(err))] * len(objs)
+        except (ValueError, KeyError) as err:
+            self.forget([tagurn])
+            return [FaaSResponse('500', 'unexpected bulk tagging response {0}'.format(err))] * len(objs)
+
+        errors = result.get('error_messages') or []
+        success = result.get('success', True)
+        if success or (success is not False and not errors):
+            self.remember([tagurn], action, objs)
+            return [FaaSResponse('200', 'successfully {0}ed tag on: {1}'.format(action, obj['object_id']['id'])) for obj in objs]
+        if not errors:
+            # failed without saying for which objects, none of them is known to be tagged
+            self.forget([tagurn])
+            return [FaaSResponse('500', 'could not tag object {0}: bulk request failed without error messages'.format(obj['object_id']['id']))
+                    for obj in objs]
 
+        # map the error messages back to the objects they mention, fail all of them if that is not possible
+        failed = {}
+        for msg in errors:
+            text = msg.get('default_message', json.dumps(msg)) if isinstance(msg, dict) else str(msg)
+            args = msg.get('args', []) if isinstance(msg, dict) else []
+            for obj in objs:
+                oid = obj['object_id']['id']
+                if oid in args or re.search(r'(?<![\w-])'+re.escape(oid)+r'(?![\w-])', text):
+                    failed[oid] = text
+        res = []
+        for obj in objs:
+            oid = obj['object_id']['id']
+            if oid in failed or not failed:
+                res.append(FaaSResponse('500', 'could not tag object {0}: {1}'.format(oid, failed.get(oid) or errors)))
+            else:
+                res.append(FaaSResponse('200', 'successfully {0}ed tag on: {1}'.format(action, oid)))
+        self.remember([tagurn], action, [obj for obj, r in zip(objs, res) if r.status == '200'])
+        return res
+
+    # association cache, see tagcache.py
+    def unchanged(self,obj,tagurn,action):
+        """whether the action would leave the object as it is, attaching a tag it carries or detaching one it does not
+        
+        Returns:
+            bool -- True if the association cache knows the object is already tagged that way
+        """
+        if ASSOCIATIONS is None:
+            return False
+        attached = ASSOCIATIONS.attached(self.vc, tagurn, objkey(obj), lambda: self.listattached(tagurn))
+        return attached is not None and attached == (action == 'attach')
+
+    def listattached(self,tagurn):
+        """lists the objects a tag is attached to with one list-attached-objects request
+        
+        Returns:
+            set -- (type, id) of the objects, None if they could not be listed
+        """
+        try:
+            resp = self.request('post',VAPI_TAG_PATH+tagurn+'?~action=list-attached-objects')
+            resp.raise_for_status()
+            return {(obj['type'], obj['id']) for obj in resp.json().get('value') or []}
+        except (requests.HTTPError, requests.ConnectionError) as err:
+            sys.stderr.write(f'could not list the objects of tag {tagurn}: {err}\n')
+        except (ValueError, KeyError, TypeError) as err:
+            sys.stderr.write(f'unexpected list-attached-objects response for tag {tagurn}: {err}\n')
+        return None
+
+    def remember(self,tagurns,action,objs):
+        """records successful writes in the association cache"""
+        if ASSOCIATIONS is not None and objs:
+            for tagurn in tagurns:
+                ASSOCIATIONS.update(self.vc, tagurn, action, [objkey(obj) for obj in objs])
+
+    def forget(self,tagurns):
+        """drops the tags from the association cache after a write with an unknown outcome"""
+        if ASSOCIATIONS is not None:
+            for tagurn in tagurns:
+                ASSOCIATIONS.invalidate(self.vc, tagurn)
+
+def flushbatch(key, objs):
+    """tags a batch of objects collected by the TagBatcher with one bulk request
+    
+    Arguments:
+
+        key {tuple} -- server, user, tag urn and action the objects were submitted for
+        objs {list} -- objects to tag
+
+    Returns:
+        list -- FaaSResponse for every object
+    """
+    t = Tagger(getsession())
+    res = t.connect()
+    if res.status != '200':
+        return [res] * len(objs)
+    return t.tagmany(objs, key[2], key[3])
+
+BATCHER = TagBatcher(flushbatch, BULK_WINDOW, BULK_MAX_OBJECTS) if WARM_PROCESS and BULK_WINDOW > 0 else None
+ASSOCIATIONS = AssociationCache(TAG_CACHE_TTL) if WARM_PROCESS and TAG_CACHE_TTL > 0 else None
+TIMINGS = Timings('tagging', WARM_PROCESS)
+FILTER = EventFilter.fromenv()
+
+@batched(batchscope)
+@TIMINGS.timed
 def handle(req):
+    # Events the function is not set up for are rejected before they are decoded (filter_* env, see vefilter.py)
+    with TIMINGS.stage('filter'):
+        rejected = FILTER.reject(req)
+    if rejected:
+        res = FaaSResponse('200','Event filtered out > {0}'.format(rejected))
+        return dumps(vars(res))
+
     # Validate input
-    try:
-        body = json.loads(req)
-    except ValueError as err:
-        res = FaaSResponse('400','invalid JSON {0}'.format(err))
-        print(json.dumps(vars(res)))
-        return
+    with TIMINGS.stage('decode'):
+        try:
+            event = decode(req)
+        except DecodeError as err:
+            res = FaaSResponse('400','invalid JSON {0}'.format(err))
+            return dumps(vars(res))
         
     # Assert managed object reference (e.g. to a VM) exists
     # For debugging: validate the JSON blob we received - uncomment if needed
-    # print(j)
+    # print(event.raw)
     try:
-        ref = (body['data']['Vm']['Vm'])
+        event.require('vm')
+        ref = event.vm
     except KeyError as err:
         res = FaaSResponse('400','JSON does not contain ManagedObjectReference {0}'.format(err))
-        print(json.dumps(vars(res)))
-        return
+        return dumps(vars(res))
 
     # Convert MoRef to an object VAPI REST tagging endpoint requires
     obj = {
         'object_id': {
-            'id': ref['Value'],
-            'type': ref['Type']
+            'id': ref.value,
+            'type': ref.type
         }
     }
 
-    # Open session to VAPI REST and obtain session token
-    s=requests.Session()
-    s.verify=False
-    t = Tagger(s)
-    res = t.connect()
-    if res.status != '200':
-        print(json.dumps(vars(res)))
-        return
+    # Find the tags to attach/detach, only the rules for the event subject are evaluated
+    with TIMINGS.stage('config'):
+        t = Tagger(None)
+        actions = t.rules.match(event.subject, event.data)
+    if not actions:
+        res = FaaSResponse('200','no tagging rule matched for: {0}'.format(ref.value))
+        return dumps(vars(res))
+
+    # In bulk mode the object is tagged together with the objects of concurrent events
+    if BATCHER is not None:
+        with TIMINGS.stage('dispatch'):
+            futures = [BATCHER.submit((t.vc, t.username, tagurn, action), obj) for action, tagurns in actions.items() for tagurn in tagurns]
+            res = combine([future.result() for future in futures])
+        return dumps(vars(res))
 
-    # Perform tagging action on the object
-    res = t.tag(obj)
+    # Open session to VAPI REST and obtain session token (reused in warm-process mode)
+    with TIMINGS.stage('auth'):
+        s=getsession()
+        t.session=s
+        res = t.connect()
     if res.status != '200':
-        print(json.dumps(vars(res)))
-        return
+        return dumps(vars(res))
 
-    # Close session to VC
-    s.close()
+    # Perform tagging actions on the object, multiple tags for the same action are applied with one request
+    with TIMINGS.stage('dispatch'):
+        res = t.apply(obj, actions)
 
-    print(json.dumps(vars(res)))
-    return
+    # Log out and close session to VC, unless the process is kept warm for the next event
+    if not WARM_PROCESS:
+        t.disconnect()
+        s.close()
 
+    return dumps(vars(res))
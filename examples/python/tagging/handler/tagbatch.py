@@ -0,0 +1,77 @@
+import threading
+from concurrent.futures import Future
+
+class Batch:
+    """Batch collects the objects for one tag and action until it is flushed."""
+
+    def __init__(self):
+        self.objs=[]
+        self.futures=[]
+        self.timer=None
+
+class TagBatcher:
+    """TagBatcher buffers objects to be tagged for a short window (or up to a number of objects)
+    and tags all of them with a single bulk request. Every caller gets a future resolving to the
+    result for its own object.
+    """
+
+    def __init__(self, flush, window=0.2, max_objects=100):
+        """
+
+        Arguments:
+
+            flush {function} -- called with (key, objs), returns one result per object in the same order
+            window {float} -- seconds to wait for more objects after the first one arrived
+            max_objects {int} -- objects per bulk request, reaching it flushes the batch right away
+        """
+        self.flush=flush
+        self.window=window
+        self.max_objects=max(1, max_objects)
+        self.pending={}
+        self.lock=threading.Lock()
+
+    def submit(self, key, obj):
+        """adds an object to the batch for key (e.g. tag urn and action)
+
+        Arguments:
+
+            key {tuple} -- objects with the same key are tagged together
+            obj {dict} -- object to tag
+
+        Returns:
+            Future -- resolves to the result for obj
+        """
+        future=Future()
+        full=None
+        with self.lock:
+            batch=self.pending.get(key)
+            if batch is None:
+                batch=self.pending[key]=Batch()
+                batch.timer=threading.Timer(self.window, self.expire, (key, batch))
+                batch.timer.daemon=True
+                batch.timer.start()
+            batch.objs.append(obj)
+            batch.futures.append(future)
+            if len(batch.objs) >= self.max_objects:
+                full=self.pending.pop(key)
+                full.timer.cancel()
+        if full is not None:
+            self.run(key, full)
+        return future
+
+    def expire(self, key, batch):
+        with self.lock:
+            if self.pending.get(key) is not batch:
+                return # already flushed because it was full
+            del self.pending[key]
+        self.run(key, batch)
+
+    def run(self, key, batch):
+        try:
+            results=self.flush(key, batch.objs)
+            for future, result in zip(batch.futures, results):
+                future.set_result(result)
+        except BaseException as err: # eg. SystemExit of a Tagger without configuration, the callers must not wait forever
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(err)
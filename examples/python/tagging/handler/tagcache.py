@@ -0,0 +1,101 @@
+import threading, time
+
+class TagEntry:
+    """TagEntry holds the objects a tag is attached to, as listed by vCenter at loaded and updated by our writes."""
+
+    def __init__(self, loaded, objects):
+        self.loaded=loaded
+        self.objects=objects
+
+class AssociationCache:
+    """AssociationCache remembers which objects a tag is attached to, so attaching a tag an object already
+    carries (or detaching one it does not carry) is answered without a request to vCenter. The objects of a
+    tag are listed in one request when the tag is first used and again once ttl seconds have passed, in
+    between the successful writes of the function keep them up to date. Changes made outside the function
+    (e.g. in the vSphere Client) are picked up when the tag is listed again.
+    """
+
+    def __init__(self, ttl=300, max_tags=1000):
+        """
+
+        Arguments:
+
+            ttl {float} -- seconds the listed objects of a tag are trusted
+            max_tags {int} -- tags remembered at most, the ones listed longest ago are dropped first
+        """
+        self.ttl=ttl
+        self.max_tags=max(1, max_tags)
+        self.tags={} # (server, tag urn) -> TagEntry
+        self.loading={} # (server, tag urn) -> lock held while the objects of the tag are listed
+        self.writes={} # (server, tag urn) -> writes so far, a listing that overlapped a write is not kept
+        self.epoch=0 # cleared so far
+        self.lock=threading.Lock()
+
+    def attached(self, server, tagurn, objkey, listobjects):
+        """whether the tag is attached to the object
+
+        Arguments:
+
+            server {str} -- vCenter server
+            tagurn {str} -- tag
+            objkey {tuple} -- (type, id) of the object
+            listobjects {function} -- lists the objects of the tag as a set of (type, id), returns None on failure
+
+        Returns:
+            bool -- True if the tag is attached, False if not, None if that is not known
+        """
+        key=(server, tagurn)
+        with self.lock:
+            objects=self.fresh(key)
+            if objects is not None:
+                return objkey in objects
+            loading=self.loading.setdefault(key, threading.Lock())
+        with loading: # concurrent events for the same tag wait for one listing
+            with self.lock:
+                objects=self.fresh(key)
+                if objects is not None:
+                    return objkey in objects
+                writes=(self.epoch, self.writes.get(key, 0))
+            started=time.monotonic()
+            objects=listobjects()
+            if objects is None:
+                return None
+            with self.lock:
+                if writes != (self.epoch, self.writes.get(key, 0)):
+                    return None # the listing may miss the write, the object is tagged as without the cache
+                self.tags[key]=TagEntry(started, set(objects))
+                while len(self.tags) > self.max_tags:
+                    oldest=min(self.tags, key=lambda tag: self.tags[tag].loaded)
+                    del self.tags[oldest]
+        return objkey in objects
+
+    def fresh(self, key):
+        entry=self.tags.get(key)
+        if entry is None or time.monotonic() - entry.loaded >= self.ttl:
+            return None
+        return entry.objects
+
+    def update(self, server, tagurn, action, objkeys):
+        """records a successful attach or detach of the tag on the objects"""
+        key=(server, tagurn)
+        with self.lock:
+            self.writes[key]=self.writes.get(key, 0)+1
+            entry=self.tags.get(key)
+            if entry is None:
+                return
+            if action == 'attach':
+                entry.objects.update(objkeys)
+            else:
+                entry.objects.difference_update(objkeys)
+
+    def invalidate(self, server, tagurn):
+        """forgets the objects of the tag, e.g. after a write failed and its outcome is unknown"""
+        key=(server, tagurn)
+        with self.lock:
+            self.writes[key]=self.writes.get(key, 0)+1
+            self.tags.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.epoch+=1
+            self.tags.clear()
@@ -0,0 +1,90 @@
+import re
+
+ACTIONS=('attach', 'detach')
+MATCHERS=(
+    # rule key, path of the name in the CloudEvent data
+    ('vm', ('Vm', 'Name')),
+    ('host', ('Host', 'Name')),
+    ('datacenter', ('Datacenter', 'Name')),
+)
+
+class TagRule:
+    """TagRule maps events matching its conditions to tags and the action to perform on them."""
+
+    def __init__(self, rule):
+        """
+
+        Arguments:
+
+            rule {dict} -- a [[rules]] table of vcconfig.toml
+
+        Raises:
+            KeyError -- tags missing
+            ValueError -- unknown action or invalid name pattern
+        """
+        tags=rule['tags']
+        self.tags=[tags] if isinstance(tags, str) else list(tags)
+        if not self.tags:
+            raise ValueError('rule without tags')
+        self.action=rule.get('action', 'attach').lower()
+        if self.action not in ACTIONS:
+            raise ValueError(f'unknown tagging action: {self.action}')
+        subjects=rule.get('subjects', [])
+        self.subjects=[subjects] if isinstance(subjects, str) else list(subjects)
+        self.patterns=[]
+        for key, path in MATCHERS:
+            if key in rule:
+                try:
+                    self.patterns.append((path, re.compile(rule[key])))
+                except re.error as err:
+                    raise ValueError(f'invalid {key} pattern "{rule[key]}": {err}')
+
+    def matches(self, data):
+        """checks the name patterns against the CloudEvent data, the subject is matched by the index"""
+        for (entity, field), pattern in self.patterns:
+            try:
+                name=data[entity][field]
+            except (KeyError, TypeError):
+                return False
+            if not isinstance(name, str) or not pattern.match(name):
+                return False
+        return True
+
+class RuleIndex:
+    """RuleIndex holds the tagging rules keyed by event subject, so an event is only checked
+    against the rules for its own subject (and the rules without a subject).
+    """
+
+    def __init__(self, rules):
+        """
+
+        Arguments:
+
+            rules {list} -- [[rules]] tables of vcconfig.toml
+        """
+        self.bysubject={}
+        self.anysubject=[]
+        for rule in rules:
+            rule=TagRule(rule)
+            if not rule.subjects:
+                self.anysubject.append(rule)
+            for subject in rule.subjects:
+                self.bysubject.setdefault(subject, []).append(rule)
+
+    def match(self, subject, data):
+        """returns the tags to attach and detach for an event
+
+        Arguments:
+
+            subject {str} -- CloudEvent subject, e.g. VmPoweredOnEvent
+            data {dict} -- CloudEvent data
+
+        Returns:
+            dict -- action to list of tag urns, without duplicates
+        """
+        actions={}
+        for rule in self.bysubject.get(subject, []) + self.anysubject:
+            if rule.matches(data):
+                tags=actions.setdefault(rule.action, [])
+                tags.extend(tag for tag in rule.tags if tag not in tags)
+        return actions
@@ -0,0 +1,288 @@
+import sys, json, os, tempfile, threading, unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+sys.modules.pop('handler', None) #every example function has a handler module, make sure this one is loaded
+import handler
+from tagbatch import TagBatcher
+from tagcache import AssociationCache
+import vefilter
+
+class FakeVAPI(BaseHTTPRequestHandler):
+    """Minimal vCenter REST API (session and tag-association endpoints) recording the calls it receives"""
+    protocol_version = 'HTTP/1.1'
+    calls = []
+    tokens = set()
+    missing = set() # object ids the bulk endpoints report as not found
+    attached = {} # tag urn -> set of (type, id)
+    delay = 0
+    silent = False # the bulk and multiple-tags endpoints fail without error messages
+
+    @classmethod
+    def reset(cls):
+        cls.calls, cls.tokens, cls.missing, cls.attached, cls.delay, cls.silent = [], set(), set(), {}, 0, False
+
+    @classmethod
+    def associate(cls, action, tagurns, objs):
+        for tagurn in tagurns:
+            objects = cls.attached.setdefault(tagurn, set())
+            for obj in objs:
+                (objects.add if action.startswith('attach') else objects.discard)((obj['type'], obj['id']))
+
+    def reply(self, code, body=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        FakeVAPI.calls.append(('POST', self.path, body))
+        if self.path == handler.VAPI_SESSION_PATH:
+            token = f'token-{len(FakeVAPI.calls)}'
+            FakeVAPI.tokens.add(token)
+            return self.reply(200, {'value': token})
+        if self.headers.get(handler.VAPI_SESSION_HEADER) not in FakeVAPI.tokens:
+            return self.reply(401, {'type': 'com.vmware.vapi.std.errors.unauthenticated'})
+        if FakeVAPI.delay:
+            threading.Event().wait(FakeVAPI.delay)
+        path, _, action = self.path.partition('?~action=')
+        tagurn = path.rsplit('id:', 1)[-1]
+        if action == 'list-attached-objects':
+            return self.reply(200, {'value': [{'type': type, 'id': id} for type, id in sorted(FakeVAPI.attached.get(tagurn, ()))]})
+        if FakeVAPI.silent and (self.path.endswith('-multiple-objects') or '-multiple-tags-' in self.path):
+            return self.reply(200, {'value': {'success': False, 'error_messages': []}})
+        if self.path.endswith('-multiple-objects'):
+            errors = [{'id': 'cis.tagging.objectNotFound', 'default_message': f'Object {obj["id"]} not found', 'args': [obj['id']]}
+                      for obj in body['object_ids'] if obj['id'] in FakeVAPI.missing]
+            FakeVAPI.associate(action, [tagurn], [obj for obj in body['object_ids'] if obj['id'] not in FakeVAPI.missing])
+            return self.reply(200, {'value': {'success': not errors, 'error_messages': errors}})
+        if self.path.endswith('-to-object') or self.path.endswith('-from-object'):
+            FakeVAPI.associate(action, body['tag_ids'], [body['object_id']])
+            return self.reply(200, {'value': {'success': True, 'error_messages': []}})
+        if action in ('attach', 'detach'):
+            FakeVAPI.associate(action, [tagurn], [body['object_id']])
+        self.reply(200)
+
+    def do_DELETE(self):
+        FakeVAPI.calls.append(('DELETE', self.path, None))
+        FakeVAPI.tokens.discard(self.headers.get(handler.VAPI_SESSION_HEADER))
+        self.reply(200)
+
+    def log_message(self, format, *args):
+        pass
+
+class PlainHTTPAdapter(requests.adapters.HTTPAdapter):
+    """The handler always talks https to vCenter, send those requests to the plain http fake instead"""
+    def send(self, request, **kwargs):
+        request.url = request.url.replace('https://', 'http://', 1)
+        return super().send(request, **kwargs)
+
+def fakesession():
+    s = requests.Session()
+    s.mount('https://', PlainHTTPAdapter())
+    return s
+
+def event(vm, subject='VmPoweredOnEvent', host='esxi01.pdotk.local'):
+    return json.dumps({'subject': subject, 'data': {'Host': {'Name': host}, 'Vm': {'Name': vm, 'Vm': {'Type': 'VirtualMachine', 'Value': vm}}}})
+
+TAG = '[tag]\nurn = "urn:vmomi:InventoryServiceTag:demo:GLOBAL"\naction = "attach"\n'
+
+class FakeVAPITest(unittest.TestCase):
+
+    def setUp(self):
+        FakeVAPI.reset()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeVAPI)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        fd, self.config = tempfile.mkstemp(suffix='.toml')
+        os.close(fd)
+        self.writeconfig(TAG)
+        self.saved = (handler.VC_CONFIG, handler.WARM_PROCESS, handler.SESSION, handler.SESSIONS, handler.BATCHER, handler.ASSOCIATIONS)
+        handler.VC_CONFIG = self.config
+        handler.WARM_PROCESS = True
+        handler.SESSION = fakesession()
+        handler.SESSIONS = handler.SessionCache()
+        handler.BATCHER = None
+        handler.ASSOCIATIONS = None
+
+    def tearDown(self):
+        handler.shutdown()
+        handler.VC_CONFIG, handler.WARM_PROCESS, handler.SESSION, handler.SESSIONS, handler.BATCHER, handler.ASSOCIATIONS = self.saved
+        self.server.shutdown()
+        self.server.server_close()
+        os.remove(self.config)
+
+    def writeconfig(self, tagging):
+        with open(self.config, 'w') as configfile:
+            configfile.write(f'[vcenter]\nserver = "127.0.0.1:{self.server.server_port}"\nuser = "tagger@vsphere.local"\npassword = "secret"\n\n{tagging}')
+        os.utime(self.config, ns=(0, os.stat(self.config).st_mtime_ns + 1000000000)) # new mtime, configuration is parsed again
+
+    def paths(self):
+        return [(method, path.rsplit('?~action=', 1)[-1]) for method, path, _ in FakeVAPI.calls]
+
+class SessionCacheTest(FakeVAPITest):
+
+    def test_session_reused_and_renewed(self):
+        for vm in ('vm-1', 'vm-2'):
+            self.assertEqual(json.loads(handler.handle(event(vm)))['status'], '200')
+        FakeVAPI.tokens.clear() # session expired on the vCenter side
+        self.assertEqual(json.loads(handler.handle(event('vm-3')))['status'], '200')
+        handler.shutdown()
+
+        self.assertEqual(self.paths(), [
+            ('POST', handler.VAPI_SESSION_PATH), ('POST', 'attach'), ('POST', 'attach'),
+            ('POST', 'attach'), ('POST', handler.VAPI_SESSION_PATH), ('POST', 'attach'),
+            ('DELETE', handler.VAPI_SESSION_PATH)])
+
+    def test_classic_mode_logs_out(self):
+        handler.WARM_PROCESS = False
+        with mock.patch.object(handler, 'getsession', fakesession):
+            self.assertEqual(json.loads(handler.handle(event('vm-1')))['status'], '200')
+        self.assertEqual([method for method, _ in self.paths()], ['POST', 'POST', 'DELETE'])
+
+class BulkTest(FakeVAPITest):
+
+    def test_concurrent_events_tagged_in_bulk(self):
+        handler.BATCHER = TagBatcher(handler.flushbatch, window=0.2, max_objects=3)
+        FakeVAPI.missing.add('vm-4')
+        vms = [f'vm-{i}' for i in range(1, 6)]
+        results = {}
+        def run(vm):
+            results[vm] = json.loads(handler.handle(event(vm)))
+        threads = [threading.Thread(target=run, args=(vm,)) for vm in vms]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        bulk = [body['object_ids'] for _, path, body in FakeVAPI.calls if path.endswith('attach-tag-to-multiple-objects')]
+        self.assertEqual(sorted(len(ids) for ids in bulk), [2, 3])
+        self.assertEqual(sorted(obj['id'] for ids in bulk for obj in ids), vms)
+        self.assertEqual({vm: res['status'] for vm, res in results.items()},
+                         {'vm-1': '200', 'vm-2': '200', 'vm-3': '200', 'vm-4': '500', 'vm-5': '200'})
+        self.assertIn('vm-4 not found', results['vm-4']['message'])
+
+    def test_flush_exit_fails_futures(self):
+        batcher = TagBatcher(lambda key, objs: sys.exit(1), window=0.05)
+        future = batcher.submit(('vc', 'user', URN, 'attach'), {'id': 'vm-1', 'type': 'VirtualMachine'})
+        with self.assertRaises(SystemExit):
+            future.result(timeout=5)
+
+class RulesTest(FakeVAPITest):
+
+    def test_rules_matched_by_subject_and_name(self):
+        self.writeconfig('[[rules]]\nsubjects = ["VmPoweredOnEvent"]\nvm = "^web-"\ntags = ["urn:a", "urn:b"]\n\n'
+                         '[[rules]]\nsubjects = ["VmPoweredOffEvent"]\ntags = ["urn:c"]\naction = "detach"\n\n'
+                         '[[rules]]\nhost = "^esxi01"\ntags = ["urn:a"]\n')
+        results = [json.loads(handler.handle(event(*args))) for args in [
+            ('web-1', 'VmPoweredOnEvent'),
+            ('db-1', 'VmPoweredOffEvent'),
+            ('db-2', 'VmPoweredOnEvent', 'esxi02.pdotk.local')]]
+
+        self.assertEqual([res['status'] for res in results], ['200', '200', '200'])
+        self.assertIn('no tagging rule matched', results[2]['message'])
+        calls = [(path.split('?~action=')[-1], body) for _, path, body in FakeVAPI.calls if 'tag-association' in path]
+        self.assertEqual(calls, [
+            ('attach-multiple-tags-to-object', {'object_id': {'id': 'web-1', 'type': 'VirtualMachine'}, 'tag_ids': ['urn:a', 'urn:b']}),
+            ('detach', {'object_id': {'id': 'db-1', 'type': 'VirtualMachine'}}),
+            ('attach', {'object_id': {'id': 'db-1', 'type': 'VirtualMachine'}})])
+
+    def test_filtered_event_answered_like_other_functions(self):
+        with mock.patch.object(handler, 'FILTER', vefilter.EventFilter(['VmPoweredOnEvent'])):
+            res = json.loads(handler.handle(event('web-1', 'VmPoweredOffEvent')))
+        self.assertEqual(res['status'], '200')
+        self.assertTrue(res['message'].startswith('Event filtered out > '), res['message'])
+        self.assertEqual(FakeVAPI.calls, [])
+
+URN = 'urn:vmomi:InventoryServiceTag:demo:GLOBAL'
+
+class AssociationCacheTest(FakeVAPITest):
+
+    def setUp(self):
+        super().setUp()
+        handler.ASSOCIATIONS = AssociationCache(ttl=300)
+
+    def actions(self):
+        return [path.split('?~action=')[-1] for _, path, _ in FakeVAPI.calls if 'tag-association' in path]
+
+    def test_attach_skipped_when_already_attached(self):
+        FakeVAPI.attached[URN] = {('VirtualMachine', 'vm-1')}
+        results = [json.loads(handler.handle(event(vm))) for vm in ('vm-1', 'vm-2', 'vm-2', 'vm-1')]
+
+        self.assertEqual([res['status'] for res in results], ['200'] * 4)
+        self.assertIn('already attached', results[0]['message'])
+        self.assertIn('successfully attached', results[1]['message'])
+        self.assertIn('already attached', results[2]['message'])
+        self.assertEqual(self.actions(), ['list-attached-objects', 'attach'])
+
+    def test_listed_again_after_ttl(self):
+        handler.ASSOCIATIONS = AssociationCache(ttl=0.1)
+        handler.handle(event('vm-1'))
+        FakeVAPI.attached[URN].clear() # detached in the vSphere Client
+        handler.handle(event('vm-1'))
+        threading.Event().wait(0.1)
+        handler.handle(event('vm-1'))
+        self.assertEqual(self.actions(), ['list-attached-objects', 'attach', 'list-attached-objects', 'attach'])
+
+    def test_detach_and_multiple_tags(self):
+        self.writeconfig('[[rules]]\nsubjects = ["VmPoweredOnEvent"]\ntags = ["urn:a", "urn:b"]\n\n'
+                         '[[rules]]\nsubjects = ["VmPoweredOffEvent"]\ntags = ["urn:a"]\naction = "detach"\n')
+        FakeVAPI.attached['urn:a'] = {('VirtualMachine', 'vm-1')}
+        handler.handle(event('vm-2', 'VmPoweredOffEvent'))
+        handler.handle(event('vm-1', 'VmPoweredOnEvent'))
+        handler.handle(event('vm-1', 'VmPoweredOnEvent'))
+        calls = [(path.split('?~action=')[-1], body) for _, path, body in FakeVAPI.calls if 'list-attached-objects' not in path and 'tag-association' in path]
+        self.assertEqual(calls, [('attach-multiple-tags-to-object', {'object_id': {'id': 'vm-1', 'type': 'VirtualMachine'}, 'tag_ids': ['urn:b']})])
+
+    def test_bulk_failure_without_errors(self):
+        handler.BATCHER = TagBatcher(handler.flushbatch, window=0.2, max_objects=2)
+        FakeVAPI.silent = True
+        results = {}
+        def run(vm):
+            results[vm] = json.loads(handler.handle(event(vm)))
+        threads = [threading.Thread(target=run, args=(vm,)) for vm in ('vm-1', 'vm-2')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual({vm: res['status'] for vm, res in results.items()}, {'vm-1': '500', 'vm-2': '500'})
+        # not remembered as attached, the next event sends the attach again
+        FakeVAPI.silent = False
+        self.assertEqual(json.loads(handler.handle(event('vm-1')))['status'], '200')
+        self.assertEqual(FakeVAPI.attached[URN], {('VirtualMachine', 'vm-1')})
+
+    def test_multiple_tags_failure_without_errors(self):
+        self.writeconfig('[[rules]]\nsubjects = ["VmPoweredOnEvent"]\ntags = ["urn:a", "urn:b"]\n')
+        FakeVAPI.silent = True
+        res = json.loads(handler.handle(event('vm-1')))
+        self.assertEqual(res['status'], '500')
+        self.assertIn('without error messages', res['message'])
+        # not remembered as attached, the next event sends the attach again
+        FakeVAPI.silent = False
+        self.assertEqual(json.loads(handler.handle(event('vm-1')))['status'], '200')
+        self.assertEqual((FakeVAPI.attached['urn:a'], FakeVAPI.attached['urn:b']), ({('VirtualMachine', 'vm-1')},) * 2)
+
+    def test_bulk_sends_only_changes(self):
+        handler.BATCHER = TagBatcher(handler.flushbatch, window=0.2, max_objects=3)
+        FakeVAPI.attached[URN] = {('VirtualMachine', 'vm-2')}
+        results = {}
+        def run(vm):
+            results[vm] = json.loads(handler.handle(event(vm)))
+        threads = [threading.Thread(target=run, args=(vm,)) for vm in ('vm-1', 'vm-2', 'vm-3')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        bulk = [body['object_ids'] for _, path, body in FakeVAPI.calls if path.endswith('attach-tag-to-multiple-objects')]
+        self.assertEqual([sorted(obj['id'] for obj in ids) for ids in bulk], [['vm-1', 'vm-3']])
+        self.assertIn('already attached', results['vm-2']['message'])
+        self.assertEqual(json.loads(handler.handle(event('vm-3')))['message'], 'tag already attached on: vm-3')
+
+if __name__ == '__main__':
+    unittest.main()
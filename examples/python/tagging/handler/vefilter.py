@@ -0,0 +1,70 @@
+#
+## Event filter shared by the Python example functions - keep the copies in the function folders identical to
+## examples/python/shared/vefilter.py (see examples/python/shared/README.md)
+##
+## The filter is declared next to the topic annotation in stack.yml and is evaluated on the raw request, before the
+## event is decoded and the configuration is loaded
+##     environment:
+##       filter_subjects: VmPoweredOnEvent,VmPoweredOffEvent
+##       filter_types: com.vmware.event.router/event
+##       filter_require: data.Vm,data.Host
+## The request is only scanned for the keys of the filter, an event is rejected when it certainly does not match: none
+## of its "subject"/"type" keys has one of the listed values, or a key of a required path is missing or only null.
+## Anything the scan can not tell (escaped strings, a value that is not a string) is passed on to the full decode
+#
+import os, re
+
+STRING = r'"((?:[^"\\]|\\.)*)"'
+
+class EventFilter:
+    """
+    EventFilter rejects the events a function does not handle, see the top of this file
+    """
+
+    def __init__(self, subjects=(), types=(), require=()):
+        """
+        Arguments:
+            subjects {list} -- accepted CloudEvent subjects (vCenter event types), any if empty
+            types {list} -- accepted CloudEvent types, any if empty
+            require {list} -- dotted paths (eg. data.Vm.Vm.Value) every accepted event has a non-null value for
+        """
+        self.subjects = frozenset(subjects)
+        self.types = frozenset(types)
+        self.require = tuple(require)
+        self.fields = [(name, values, re.compile(r'"%s"\s*:\s*(?:%s)?' % (name, STRING)))
+                       for name, values in (('subject', self.subjects), ('type', self.types)) if values]
+        keys = dict.fromkeys(key for path in self.require for key in path.split('.') if key)
+        self.keys = [(key, re.compile(r'"%s"\s*:(?!\s*null\b)' % re.escape(key))) for key in keys]
+        self.enabled = bool(self.fields or self.keys)
+
+    @classmethod
+    def fromenv(cls):
+        """the filter of the function, from filter_subjects, filter_types and filter_require (comma separated)"""
+        def names(var):
+            return [name.strip() for name in os.getenv(var, '').split(',') if name.strip()]
+        return cls(names('filter_subjects'), names('filter_types'), names('filter_require'))
+
+    def reject(self, req):
+        """
+        Arguments:
+            req {str} -- raw request body
+
+        Returns:
+            str -- why the event is rejected, None if it is passed on
+        """
+        if not self.enabled or not isinstance(req, str):
+            return None
+        for name, values, pattern in self.fields:
+            found = None
+            for match in pattern.finditer(req):
+                value = match.group(1)
+                if value is None or '\\' in value or value in values:
+                    found = True
+                    break
+                found = found or value
+            if found is not True:
+                return '{0} {1} not accepted'.format(name, found) if found else 'no {0}'.format(name)
+        for key, pattern in self.keys:
+            if pattern.search(req) is None:
+                return 'no value for {0}'.format(key)
+        return None
@@ -1,30 +1,34 @@
-import sys, json, os
-import urllib3
-import requests
+import sys, json, os, atexit, contextlib
 import traceback
+from concurrent.futures import TimeoutError as FutureTimeout
 
-# GLOBAL_VARS
-DEBUG=False
-class bgc:
-    HEADER = '\033[95m'
-    OKBLUE = '\033[94m'
-    OKGREEN = '\033[92m'
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
-    BOLD = '\033[1m'
-    UNDERLINE = '\033[4m'
-
-if(os.getenv("insecure_ssl")):
-    # Surpress SSL warnings
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-if(os.getenv("write_debug")):
-    sys.stderr.write(f"{bgc.WARNING}WARNING!! DEBUG has been enabled for this function. Sensitive information could be printed to sysout{bgc.ENDC} \n")
-    DEBUG=True
-
-def debug(s):
-    if DEBUG:
-        sys.stderr.write(s+" \n") #syserr only get logged on the console logs
+try:
+    from .pddedup import DedupTable, dedupkey
+    from .pdenrich import Enricher, VSphereLookup, details, objkeys
+    from .pdqueue import DeliveryQueue, QueueFull, Retry, retryafter
+    from .vebalog import getlogger, pretty
+    from .vebatch import batched
+    from .vecevent import DecodeError, decode, dumps, loads
+    from .vefilter import EventFilter
+    from .velazy import lazy, preload
+    from .vetiming import Timings
+except ImportError:
+    from pddedup import DedupTable, dedupkey
+    from pdenrich import Enricher, VSphereLookup, details, objkeys
+    from pdqueue import DeliveryQueue, QueueFull, Retry, retryafter
+    from vebalog import getlogger, pretty
+    from vebatch import batched
+    from vecevent import DecodeError, decode, dumps, loads
+    from vefilter import EventFilter
+    from velazy import lazy, preload
+    from vetiming import Timings
+
+# imported on first use, see velazy.py
+requests = lazy('requests')
+urllib3 = lazy('urllib3')
+
+# debug records (write_debug env) are only formatted when they are emitted, see vebalog.py
+log = getlogger('trigger-pagerduty-incident')
 
 #
 ### Paths and Endpoints
@@ -32,6 +36,33 @@ def debug(s):
 #
 PAGERDUTY_API_PATH='https://events.pagerduty.com/v2/enqueue'
 PD_CONFIG='/var/openfaas/secrets/pdconfig'
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# of-watchdog templates (mode=http) keep the process running between events, the session, the
+# configuration and the coalescing table are then kept across invocations
+WARM_PROCESS = bool(os.getenv("warm_process")) or os.getenv("mode") == "http"
+if WARM_PROCESS:
+    preload(requests, urllib3)
+POOL_SIZE = int(os.getenv("pool_size", "10"))
+# events with the same dedup_key inside the window (seconds) are coalesced, 0 sends every event
+DEDUP_WINDOW = float(os.getenv("dedup_window", "60"))
+DEDUP_MAX_KEYS = int(os.getenv("dedup_max_keys", "1024"))
+# warm-process delivery queue, events failing with 429/5xx are retried in the background, 0 workers sends inline
+QUEUE_WORKERS = int(os.getenv("queue_workers", "2"))
+QUEUE_MAX_DEPTH = int(os.getenv("queue_max_depth", "1000"))
+QUEUE_MAX_RETRIES = int(os.getenv("queue_max_retries", "8"))
+QUEUE_SPOOL = os.getenv("queue_spool") #append-only file keeping undelivered events across restarts
+# seconds an invocation waits for its event to be delivered before answering 202 and leaving it to the queue
+RESPONSE_TIMEOUT = float(os.getenv("response_timeout", "5"))
+# warm-process enrichment of the incident with cluster, resource pool, guest IP and custom attributes of the VM and
+# the host, looked up in the vCenter of the vcenter section of pdconfig (see pdenrich.py). Objects are cached for
+# enrich_ttl seconds, an event waits at most enrich_budget seconds for a lookup, 0 turns the enrichment off
+ENRICH_BUDGET = float(os.getenv("enrich_budget", "0.5"))
+ENRICH_TTL = float(os.getenv("enrich_ttl", "300"))
+ENRICH_MAX_ENTRIES = int(os.getenv("enrich_max_entries", "4096"))
+ENRICH_TIMEOUT = float(os.getenv("enrich_timeout", "10")) #seconds a vCenter call may take, a lookup that hangs fails
+ENRICH_ATTRIBUTES = [name.strip() for name in os.getenv("enrich_attributes", "Owner").split(",") if name.strip()]
+
 class FaaSResponse:
     """
     FaaSResponse is a helper class to construct a properly formatted message returned by this function.
@@ -59,6 +90,32 @@ class Pagerduty:
         self.session=conn
 
     # PagerDuty REST API implementation        
+    def send(self,obj):
+        """
+        Make a rest api call to Pagerduty Events API
+
+        Arguments:
+            obj {dict} -- Generated API Body for the PagerDuty Events API
+
+        Returns:
+            dict -- response body
+
+        Raises:
+            Retry -- rate limited (429), server error (5xx) or no connection, worth retrying
+            HTTPError -- event rejected (4xx)
+        """
+        try:
+            resp = self.session.post(PAGERDUTY_API_PATH, data=dumps(obj).encode(), headers=JSON_HEADERS)
+        except (requests.ConnectionError, requests.Timeout) as err:
+            raise Retry('Could not connect to PagerDuty API > {0}'.format(err))
+        if resp.status_code == 429 or resp.status_code >= 500:
+            log.info('HTTP POST Request failed with %s, Retry-After: %s', resp.status_code, resp.headers.get('Retry-After'))
+            raise Retry('{0} Error: {1} for url: {2}'.format(resp.status_code, resp.reason, resp.url), retryafter(resp.headers.get('Retry-After')))
+        resp.raise_for_status()
+        log.debug('HTTP POST Request successful')
+        log.debug('Response Body > %s', resp.text)
+        return loads(resp.text)
+
     def invoke(self,obj):
         """
         Make a rest api call to Pagerduty Events API
@@ -70,147 +127,301 @@ class Pagerduty:
             FaaSResponse -- status code and message
         """
         try:
-            resp = self.session.post(PAGERDUTY_API_PATH,json=obj)
-            resp.raise_for_status()
-            debug(f'{bgc.OKGREEN}HTTP POST Request successful{bgc.ENDC}')
-            debug(f'{bgc.OKBLUE}Response Body > {bgc.ENDC}{resp.text}')
-            resp_body = json.loads(resp.text)
+            resp_body = self.send(obj)
+            return FaaSResponse('200', 'Successfully invoked PagerDuty API! dedup_key for this request: {0}'.format(resp_body['dedup_key']))
+        except (requests.HTTPError, Retry) as err:
+            return FaaSResponse('500', 'Could not invoke PagerDuty API > HTTPError: {0}'.format(err))
+
+    def enqueue(self,obj,queue):
+        """
+        Queue the event for delivery and wait up to RESPONSE_TIMEOUT seconds for it
+
+        Arguments:
+            obj {dict} -- Generated API Body for the PagerDuty Events API
+            queue {DeliveryQueue} -- queue delivering the event
+
+        Returns:
+            FaaSResponse -- 200 when delivered, 202 when it is still being retried, 500/503 when it failed or was not queued
+        """
+        try:
+            future = queue.submit(obj)
+        except QueueFull as err:
+            return FaaSResponse('503', 'Could not queue event for PagerDuty API > QueueFull: {0}'.format(err))
+        # an event given up after this invocation answered must not keep coalescing its duplicates
+        future.add_done_callback(lambda f: f.exception() is not None and DEDUP.release(obj['dedup_key']))
+        try:
+            resp_body = future.result(timeout=RESPONSE_TIMEOUT)
             return FaaSResponse('200', 'Successfully invoked PagerDuty API! dedup_key for this request: {0}'.format(resp_body['dedup_key']))
-        except requests.HTTPError as err:
+        except FutureTimeout:
+            return FaaSResponse('202', 'Queued for delivery to PagerDuty API, dedup_key for this request: {0}'.format(obj['dedup_key']))
+        except (requests.HTTPError, Retry) as err:
             return FaaSResponse('500', 'Could not invoke PagerDuty API > HTTPError: {0}'.format(err))
 
+class ConfigCache:
+    """
+    ConfigCache holds the parsed pdconfig. The file is only parsed again when its path or modification
+    time changes, so a warm process picks up an updated secret without restarting
+    """
+
+    def __init__(self):
+        self.path = None
+        self.mtime = None
+        self.config = None
+
+    def load(self, path):
+        """
+        Returns the config for path, reading it if it is not cached or has changed
+
+        Arguments:
+            path {str} -- path to the pdconfig file
+
+        Returns:
+            dict -- pdconfig
+
+        Raises:
+            OSError -- config could not be read
+            JSONDecodeError -- config is not valid JSON
+            KeyError -- routing_key or event_action missing
+        """
+        mtime = os.stat(path).st_mtime_ns
+        if self.config is not None and path == self.path and mtime == self.mtime:
+            return self.config
+
+        with open(path, 'r') as pdconfigfile:
+            pdconfig = json.load(pdconfigfile)
+        log.debug('Successfully parsed Configuration into JSON!')
+        for key in ('routing_key', 'event_action'):
+            if key not in pdconfig:
+                raise KeyError(key)
+
+        self.path, self.mtime, self.config = path, mtime, pdconfig
+        return pdconfig
+
+CONFIG_CACHE = ConfigCache()
+TIMINGS = Timings('trigger-pagerduty-incident', WARM_PROCESS)
+FILTER = EventFilter.fromenv()
+DEDUP = DedupTable(DEDUP_WINDOW, DEDUP_MAX_KEYS)
+SESSION = None
+
+def queuesend(obj):
+    return Pagerduty(getsession()).send(obj)
+
+QUEUE = None
+if WARM_PROCESS and QUEUE_WORKERS > 0:
+    QUEUE = DeliveryQueue(queuesend, QUEUE_WORKERS, QUEUE_MAX_DEPTH, QUEUE_MAX_RETRIES, spool=QUEUE_SPOOL)
+    atexit.register(QUEUE.stop)
+    TIMINGS.report('queue', QUEUE.stats)
+    if QUEUE_SPOOL:
+        QUEUE.start() #events left in the spool by the last process are sent again without waiting for a new event
+
+ENRICHER = None
+if WARM_PROCESS and ENRICH_BUDGET > 0:
+    ENRICHER = Enricher(VSphereLookup(ENRICH_ATTRIBUTES, ENRICH_TIMEOUT), ENRICH_TTL, ENRICH_MAX_ENTRIES, ENRICH_BUDGET)
+    TIMINGS.report('enrichment', ENRICHER.stats)
+
+def getsession():
+    """
+    Returns the requests session used for the PagerDuty API calls. Connections are pooled (pool_size env) and kept alive,
+    in warm-process mode the same session is handed out for every invocation
+
+    Returns:
+        [session] -- [Request Connection]
+    """
+    global SESSION
+    if WARM_PROCESS and SESSION is not None:
+        return SESSION
+    s=requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    s.mount('https://', adapter)
+    s.mount('http://', adapter)
+    if(os.getenv("insecure_ssl")):
+        # Surpress SSL warnings
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        s.verify=False
+    if WARM_PROCESS:
+        SESSION = s
+    return s
+
+@contextlib.contextmanager
+def batchscope():
+    """the session and the configuration are kept for a batch of events (see vebatch.py), as in warm-process mode"""
+    global WARM_PROCESS, SESSION
+    warm, WARM_PROCESS = WARM_PROCESS, True
+    try:
+        getsession() #created before the events of the batch are handled concurrently
+        yield
+    finally:
+        WARM_PROCESS = warm
+        if not warm and SESSION is not None:
+            SESSION.close()
+            SESSION = None
+
+@batched(batchscope)
+@TIMINGS.timed
 def handle(req):
-    
+
+    # Events without a VM and a host (eg. UserLogoutSessionEvent) are rejected before they are decoded,
+    # with the filter_* env set in stack.yml (see vefilter.py)
+    with TIMINGS.stage('filter'):
+        rejected = FILTER.reject(req)
+    if rejected:
+        res = FaaSResponse('200','Event filtered out > {0}'.format(rejected))
+        return dumps(vars(res))
+
     # Validate Event input
-    debug(f'{bgc.HEADER}---Validating CloudEvent--- {bgc.ENDC}')
-    debug(f'{bgc.OKBLUE}Event (raw) > {bgc.ENDC}{req}')
-    try:
-        cevent = json.loads(req)
-        debug(f'{bgc.OKGREEN}Successfully parsed Event into JSON!{bgc.ENDC}')
-        debug(f'{bgc.OKBLUE}Event (JSON) > {bgc.ENDC}{json.dumps(cevent, indent=4, sort_keys=True)}')
-    except json.JSONDecodeError as err:
-        res = FaaSResponse('400','Invalid JSON > JSONDecodeError: {0}'.format(err))
-        print(json.dumps(vars(res)))
-        return
+    log.debug('---Validating CloudEvent---')
+    log.debug('Event (raw) > %s', req)
+    with TIMINGS.stage('decode'):
+        try:
+            event = decode(req)
+            log.debug('Successfully parsed Event into JSON!')
+            log.debug('Event (JSON) > %s', pretty(event.raw, sort_keys=True))
+        except DecodeError as err:
+            res = FaaSResponse('400','Invalid JSON > JSONDecodeError: {0}'.format(err))
+            return dumps(vars(res))
     
-    # Validate Config file
-    debug(f'{bgc.HEADER}---Validating Config--- {bgc.ENDC}')
-    debug(f'{bgc.OKBLUE}Reading Config File > {bgc.ENDC}{PD_CONFIG}')
-    try: 
-        with open(PD_CONFIG, 'r') as pdconfigfile:
-            pdconfig = json.load(pdconfigfile)
-            debug(f'{bgc.OKGREEN}Successfully parsed Configuration into JSON!{bgc.ENDC}')
-            debug(f'{bgc.OKBLUE}Configuration > {bgc.ENDC}{json.dumps(pdconfig,indent=4)}')
+    # Validate Config file - in warm-process mode this is only re-read when the secret changes
+    log.debug('---Validating Config---')
+    log.debug('Reading Config File > %s', PD_CONFIG)
+    with TIMINGS.stage('config'):
+        try:
+            pdconfig = CONFIG_CACHE.load(PD_CONFIG)
+            log.debug('Configuration > %s', pretty(pdconfig))
             routingkey=pdconfig['routing_key']
             event_action=pdconfig['event_action']
-    except json.JSONDecodeError as err:
-        res = FaaSResponse('400','Invalid JSON > JSONDecodeError: {0}'.format(err))
-        print(json.dumps(vars(res)))
-        return
-    except KeyError as err:
-        res = FaaSResponse('400','Required key not found in the provided configuration > KeyError: {0}'.format(err))
-        print(json.dumps(vars(res)))
-        return 
-    except OSError as err:
-        res = FaaSResponse('500','Could not read PagerDuty configuration > OSError: {0}'.format(err))
-        print(json.dumps(vars(res)))
-        return
+            vcenter=pdconfig.get('vcenter')
+        except json.JSONDecodeError as err:
+            res = FaaSResponse('400','Invalid JSON > JSONDecodeError: {0}'.format(err))
+            return dumps(vars(res))
+        except KeyError as err:
+            res = FaaSResponse('400','Required key not found in the provided configuration > KeyError: {0}'.format(err))
+            return dumps(vars(res))
+        except OSError as err:
+            res = FaaSResponse('500','Could not read PagerDuty configuration > OSError: {0}'.format(err))
+            return dumps(vars(res))
 
     # Assert that the function is able to get the required information from the event and build the request body
     # For debugging: validate the JSON blob we received - uncomment print statements if needed
-    # print(cevent)
-    debug(f'{bgc.HEADER}---Building HTTP Request body--- {bgc.ENDC}')
-    try:
-        # Map the CloudEvent data and build the PagerDuty Event API Request body
-        obj = {
-                'routing_key': routingkey,
-                'event_action': event_action,
-                'client': 'VMware Event Broker Appliance',
-                'client_url': cevent['source'],
-                'payload': {
-                    'summary': cevent['data']['FullFormattedMessage'],
-                    'timestamp': cevent['data']['CreatedTime'],
-                    'source': cevent['source'],
-                    'severity': 'info',
-                    'component': cevent['data']['Vm']['Name'],
-                    'group': cevent['data']['Host']['Name'],
-                    'class': cevent['subject'],
-                    'custom_details': {
-                        'user': cevent['data']['UserName'],
-                        'Datacenter': cevent['data']['Datacenter'],
-                        'ComputeResource': cevent['data']['ComputeResource'],
-                        'Host': cevent['data']['Host'],
-                        'VM': cevent['data']['Vm']
+    # print(event.raw)
+    log.debug('---Building HTTP Request body---')
+    with TIMINGS.stage('body'):
+        try:
+            # Map the CloudEvent data and build the PagerDuty Event API Request body
+            event.require('source', 'subject', 'message', 'vm', 'host')
+            # CreatedTime and UserName only have to be present, null is sent as is
+            for key in ('CreatedTime', 'UserName'):
+                if key not in event.data:
+                    raise KeyError(key)
+            dedup_key = dedupkey(event)
+            obj = {
+                    'routing_key': routingkey,
+                    'event_action': event_action,
+                    'dedup_key': dedup_key,
+                    'client': 'VMware Event Broker Appliance',
+                    'client_url': event.source,
+                    'payload': {
+                        'summary': event.message,
+                        'timestamp': event.created,
+                        'source': event.source,
+                        'severity': 'info',
+                        'component': event.vm.name,
+                        'group': event.host.name,
+                        'class': event.subject,
+                        'custom_details': {
+                            'user': event.user,
+                            'Datacenter': event.data.get('Datacenter'),
+                            'ComputeResource': event.data.get('ComputeResource'),
+                            'Host': event.data['Host'],
+                            'VM': event.data['Vm']
+                        }
                     }
+                    #,
+                    #'images': [{
+                    #    'src': 'https://www.pagerduty.com/wp-content/uploads/2016/05/pagerduty-logo-green.png',
+                    #    'href': 'https://example.com/',
+                    #    'alt': event.data['Vm']
+                    # }],
+                    # 'links': [{
+                    #    'href': 'https://example.com/',
+                    #    'text': 'Link to VM'
+                    # }]
                 }
-                #,
-                #'images': [{
-                #    'src': 'https://www.pagerduty.com/wp-content/uploads/2016/05/pagerduty-logo-green.png',
-                #    'href': 'https://example.com/',
-                #    'alt': cevent['data']['Vm']
-                # }],
-                # 'links': [{
-                #    'href': 'https://example.com/',
-                #    'text': 'Link to VM'
-                # }]
-            }
-        debug(f'{bgc.OKBLUE}Built API Request Body > {bgc.ENDC}{json.dumps(obj,indent=4)}')
-    except KeyError as err:
-        res = FaaSResponse('400','Invalid JSON, required key not found in the provided Event > KeyError: {0}'.format(err))
-        print(json.dumps(vars(res)))
-        traceback.print_exc(limit=1, file=sys.stderr) #providing traceback since it helps debug the exact key that failed
-        return
-    except TypeError as err:
-        res = FaaSResponse('400','Invalid JSON, missing required data in the provided Event > TypeError: {0}'.format(err))
-        print(json.dumps(vars(res)))
-        traceback.print_exc(limit=1, file=sys.stderr) #providing traceback since it helps debug the exact key that failed
-        return
-
-    # Make the Rest Api Call to PagerDuty
-    s=requests.Session()
-    if(os.getenv("insecure_ssl")):
-        s.verify=False
-    debug(f'{bgc.HEADER}---Attemping API Request to PagerDuty--- {bgc.ENDC}')
-    try:
-        pg = Pagerduty(s)
-        res = pg.invoke(obj)
-        print(json.dumps(vars(res)))
-    except Exception as err:
-        res = FaaSResponse('500','Unexpected Error occurred > Exception: {0}'.format(err))
-        print(json.dumps(vars(res)))
+            log.debug('Built API Request Body > %s', pretty(obj))
+        except KeyError as err:
+            res = FaaSResponse('400','Invalid JSON, required key not found in the provided Event > KeyError: {0}'.format(err))
+            traceback.print_exc(limit=1, file=sys.stderr) #providing traceback since it helps debug the exact key that failed
+            return dumps(vars(res))
+        except TypeError as err:
+            res = FaaSResponse('400','Invalid JSON, missing required data in the provided Event > TypeError: {0}'.format(err))
+            traceback.print_exc(limit=1, file=sys.stderr) #providing traceback since it helps debug the exact key that failed
+            return dumps(vars(res))
+
+    # Repeated events for the same VM inside the dedup window (eg. a VM flapping its power state) are not sent again,
+    # PagerDuty would only add them to the alert of the first one
+    coalesced = DEDUP.claim(dedup_key)
+    if coalesced:
+        log.debug('Coalesced duplicate event #%d for dedup_key %s', coalesced, dedup_key)
+        res = FaaSResponse('200', 'Coalesced duplicate event, dedup_key for this request: {0}'.format(dedup_key))
+        return dumps(vars(res))
+
+    # Add what vCenter knows about the VM and the host, served from the cache for repeats. A slow or unreachable
+    # vCenter costs at most the budget, the incident is then sent with the event data only
+    if ENRICHER is not None and vcenter:
+        with TIMINGS.stage('enrich'):
+            try:
+                keys = objkeys(event)
+                found = ENRICHER.enrich(vcenter, keys)
+                obj['payload']['custom_details'].update(details(found, keys))
+            except Exception as err:
+                log.info('Could not enrich the incident > %s', err)
+
+    # Make the Rest Api Call to PagerDuty - the session and its connection pool are kept in warm-process mode,
+    # with the delivery queue failed calls are retried in the background
+    with TIMINGS.stage('dispatch'):
+        s=getsession()
+        log.debug('---Attemping API Request to PagerDuty---')
+        try:
+            pg = Pagerduty(s)
+            res = pg.enqueue(obj, QUEUE) if QUEUE is not None else pg.invoke(obj)
+        except Exception as err:
+            res = FaaSResponse('500','Unexpected Error occurred > Exception: {0}'.format(err))
+        if res.status not in ('200', '202'):
+            # not delivered, the next event with this dedup_key has to be sent
+            DEDUP.release(dedup_key)
     
     #Close session
-    s.close()
+    if not WARM_PROCESS:
+        s.close()
 
-    return
+    return dumps(vars(res))
 
 #
 ## Unit Test - helps with executing the function locally
 ## Uncomment PDConfig - update the path to the file accordingly
-## Uncomment handle('... to test the function with the event samples provided below test without deploying to OpenFaaS
+## Uncomment print(handle('...)) to test the function with the event samples provided below test without deploying to OpenFaaS
 #
 #PD_CONFIG='pdconfig.json'
 
 #
 ## FAILURE CASES :Invalid Inputs
 #
-#handle('')
-#handle('"test":"ok"')
-#handle('{"test":"ok"}')
-#handle('{"data":"ok"}')
+#print(handle(''))
+#print(handle('"test":"ok"'))
+#print(handle('{"test":"ok"}'))
+#print(handle('{"data":"ok"}'))
 
 #
 ## FAILURE CASES :Unhandled Events
 # 
 # Standard : UserLogoutSessionEvent
-#handle('{"id":"17e1027a-c865-4354-9c21-e8da3df4bff9","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"UserLogoutSessionEvent","time":"2020-04-14T00:28:36.455112549Z","data":{"Key":7775,"ChainId":7775,"CreatedTime":"2020-04-14T00:28:35.221698Z","UserName":"machine-b8eb9a7f","Datacenter":null,"ComputeResource":null,"Host":null,"Vm":null,"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"User machine-b8ebe7eb9a7f@127.0.0.1 logged out (login time: Tuesday, 14 April, 2020 12:28:35 AM, number of API invocations: 34, user agent: pyvmomi Python/3.7.5 (Linux; 4.19.84-1.ph3; x86_64))","ChangeTag":"","IpAddress":"127.0.0.1","UserAgent":"pyvmomi Python/3.7.5 (Linux; 4.19.84-1.ph3; x86_64)","CallCount":34,"SessionId":"52edf160927","LoginTime":"2020-04-14T00:28:35.071817Z"},"datacontenttype":"application/json"}')
+#print(handle('{"id":"17e1027a-c865-4354-9c21-e8da3df4bff9","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"UserLogoutSessionEvent","time":"2020-04-14T00:28:36.455112549Z","data":{"Key":7775,"ChainId":7775,"CreatedTime":"2020-04-14T00:28:35.221698Z","UserName":"machine-b8eb9a7f","Datacenter":null,"ComputeResource":null,"Host":null,"Vm":null,"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"User machine-b8ebe7eb9a7f@127.0.0.1 logged out (login time: Tuesday, 14 April, 2020 12:28:35 AM, number of API invocations: 34, user agent: pyvmomi Python/3.7.5 (Linux; 4.19.84-1.ph3; x86_64))","ChangeTag":"","IpAddress":"127.0.0.1","UserAgent":"pyvmomi Python/3.7.5 (Linux; 4.19.84-1.ph3; x86_64)","CallCount":34,"SessionId":"52edf160927","LoginTime":"2020-04-14T00:28:35.071817Z"},"datacontenttype":"application/json"}'))
 # Eventex : vim.event.ResourceExhaustionStatusChangedEvent
-#handle('{"id":"0707d7e0-269f-42e7-ae1c-18458ecabf3d","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/eventex","subject":"vim.event.ResourceExhaustionStatusChangedEvent","time":"2020-04-14T00:20:15.100325334Z","data":{"Key":7715,"ChainId":7715,"CreatedTime":"2020-04-14T00:20:13.76967Z","UserName":"machine-bb9a7f","Datacenter":null,"ComputeResource":null,"Host":null,"Vm":null,"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"vCenter Log File System Resource status changed from Yellow to Green on vcsa.pdotk.local  ","ChangeTag":"","EventTypeId":"vim.event.ResourceExhaustionStatusChangedEvent","Severity":"info","Message":"","Arguments":[{"Key":"resourceName","Value":"storage_util_filesystem_log"},{"Key":"oldStatus","Value":"yellow"},{"Key":"newStatus","Value":"green"},{"Key":"reason","Value":" "},{"Key":"nodeType","Value":"vcenter"},{"Key":"_sourcehost_","Value":"vcsa.pdotk.local"}],"ObjectId":"","ObjectType":"","ObjectName":"","Fault":null},"datacontenttype":"application/json"}')
+#print(handle('{"id":"0707d7e0-269f-42e7-ae1c-18458ecabf3d","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/eventex","subject":"vim.event.ResourceExhaustionStatusChangedEvent","time":"2020-04-14T00:20:15.100325334Z","data":{"Key":7715,"ChainId":7715,"CreatedTime":"2020-04-14T00:20:13.76967Z","UserName":"machine-bb9a7f","Datacenter":null,"ComputeResource":null,"Host":null,"Vm":null,"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"vCenter Log File System Resource status changed from Yellow to Green on vcsa.pdotk.local  ","ChangeTag":"","EventTypeId":"vim.event.ResourceExhaustionStatusChangedEvent","Severity":"info","Message":"","Arguments":[{"Key":"resourceName","Value":"storage_util_filesystem_log"},{"Key":"oldStatus","Value":"yellow"},{"Key":"newStatus","Value":"green"},{"Key":"reason","Value":" "},{"Key":"nodeType","Value":"vcenter"},{"Key":"_sourcehost_","Value":"vcsa.pdotk.local"}],"ObjectId":"","ObjectType":"","ObjectName":"","Fault":null},"datacontenttype":"application/json"}'))
 
 #
 ## SUCCESS CASES
 #
 # Standard : VmPoweredOnEvent
-#handle('{"id":"453120cd-3d19-4c43-aadc-df0cdbce3887","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"VmPoweredOnEvent","time":"2020-04-13T23:46:10.402531287Z","data":{"Key":7441,"ChainId":7438,"CreatedTime":"2020-04-13T23:46:09.387283Z","UserName":"Administrator","Datacenter":{"Name":"PKLAB","Datacenter":{"Type":"Datacenter","Value":"datacenter-3"}},"ComputeResource":{"Name":"esxi01.pdotk.local","ComputeResource":{"Type":"ComputeResource","Value":"domain-s29"}},"Host":{"Name":"esxi01.pdotk.local","Host":{"Type":"HostSystem","Value":"host-31"}},"Vm":{"Name":"Test VM","Vm":{"Type":"VirtualMachine","Value":"vm-33"}},"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"Test VM on esxi01.pdotk.local in PKLAB has powered on","ChangeTag":"","Template":false},"datacontenttype":"application/json"}')
+#print(handle('{"id":"453120cd-3d19-4c43-aadc-df0cdbce3887","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"VmPoweredOnEvent","time":"2020-04-13T23:46:10.402531287Z","data":{"Key":7441,"ChainId":7438,"CreatedTime":"2020-04-13T23:46:09.387283Z","UserName":"Administrator","Datacenter":{"Name":"PKLAB","Datacenter":{"Type":"Datacenter","Value":"datacenter-3"}},"ComputeResource":{"Name":"esxi01.pdotk.local","ComputeResource":{"Type":"ComputeResource","Value":"domain-s29"}},"Host":{"Name":"esxi01.pdotk.local","Host":{"Type":"HostSystem","Value":"host-31"}},"Vm":{"Name":"Test VM","Vm":{"Type":"VirtualMachine","Value":"vm-33"}},"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"Test VM on esxi01.pdotk.local in PKLAB has powered on","ChangeTag":"","Template":false},"datacontenttype":"application/json"}'))
 # Standard : VmPoweredOffEvent
-#handle('{"id":"d77a3767-1727-49a3-ac33-ddbdef294150","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"VmPoweredOffEvent","time":"2020-04-14T00:33:30.838669841Z","data":{"Key":7825,"ChainId":7821,"CreatedTime":"2020-04-14T00:33:30.252792Z","UserName":"Administrator","Datacenter":{"Name":"PKLAB","Datacenter":{"Type":"Datacenter","Value":"datacenter-3"}},"ComputeResource":{"Name":"esxi01.pdotk.local","ComputeResource":{"Type":"ComputeResource","Value":"domain-s29"}},"Host":{"Name":"esxi01.pdotk.local","Host":{"Type":"HostSystem","Value":"host-31"}},"Vm":{"Name":"Test VM","Vm":{"Type":"VirtualMachine","Value":"vm-33"}},"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"Test VM on  esxi01.pdotk.local in PKLAB is powered off","ChangeTag":"","Template":false},"datacontenttype":"application/json"}')
+#print(handle('{"id":"d77a3767-1727-49a3-ac33-ddbdef294150","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"VmPoweredOffEvent","time":"2020-04-14T00:33:30.838669841Z","data":{"Key":7825,"ChainId":7821,"CreatedTime":"2020-04-14T00:33:30.252792Z","UserName":"Administrator","Datacenter":{"Name":"PKLAB","Datacenter":{"Type":"Datacenter","Value":"datacenter-3"}},"ComputeResource":{"Name":"esxi01.pdotk.local","ComputeResource":{"Type":"ComputeResource","Value":"domain-s29"}},"Host":{"Name":"esxi01.pdotk.local","Host":{"Type":"HostSystem","Value":"host-31"}},"Vm":{"Name":"Test VM","Vm":{"Type":"VirtualMachine","Value":"vm-33"}},"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"Test VM on  esxi01.pdotk.local in PKLAB is powered off","ChangeTag":"","Template":false},"datacontenttype":"application/json"}'))
@@ -0,0 +1,75 @@
+import threading, time
+from collections import OrderedDict
+
+def dedupkey(event):
+    """
+    Builds the PagerDuty dedup_key of an event from its source, subject and VM, so repeated events
+    for the same VM (eg. a VM flapping its power state) update one alert instead of opening new ones
+
+    Arguments:
+        event {VCEvent} -- decoded CloudEvent
+
+    Returns:
+        str -- dedup_key, at most 255 characters as required by the Events API v2
+
+    Raises:
+        KeyError -- source, subject or data.Vm missing in the event
+    """
+    event.require('source', 'subject', 'vm')
+    return f"{event.source}|{event.subject}|{event.vm.value}"[-255:]
+
+class DedupTable:
+    """
+    DedupTable remembers the dedup_keys sent within the last window seconds, duplicates arriving inside
+    the window are coalesced instead of being sent again. At most max_keys keys are kept, the least
+    recently sent ones are dropped first.
+    """
+
+    def __init__(self, window=60, max_keys=1024):
+        """
+        Arguments:
+            window {float} -- seconds a dedup_key is kept, 0 disables coalescing
+            max_keys {int} -- keys remembered at most
+        """
+        self.window = window
+        self.max_keys = max(1, max_keys)
+        self.entries = OrderedDict() # dedup_key -> [time sent, coalesced count]
+        self.lock = threading.Lock()
+
+    def claim(self, key):
+        """
+        Claims key for sending
+
+        Returns:
+            int -- 0 if the event has to be sent, otherwise the number of events coalesced into the key so far
+        """
+        if self.window <= 0:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[0] < self.window:
+                entry[1] += 1
+                return entry[1]
+            self.entries[key] = [now, 0]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_keys:
+                self.entries.popitem(last=False)
+            self.expire(now)
+            return 0
+
+    def release(self, key):
+        """forgets key, eg. after sending failed so the next event for it is sent again"""
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def expire(self, now):
+        # entries are ordered by the time they were sent, so expired keys are collected from the front
+        while self.entries:
+            key, (sent, _) = next(iter(self.entries.items()))
+            if now - sent < self.window:
+                break
+            del self.entries[key]
+
+    def __len__(self):
+        return len(self.entries)
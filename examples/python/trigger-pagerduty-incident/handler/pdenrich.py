@@ -0,0 +1,351 @@
+import threading, time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+try:
+    from .velazy import lazy
+except ImportError:
+    from velazy import lazy
+
+# pyVmomi takes long to import, it is imported on the first lookup (see velazy.py)
+connect = lazy('pyVim.connect')
+vim = lazy('pyVmomi', 'vim')
+vmodl = lazy('pyVmomi', 'vmodl')
+
+# properties fetched per type, the resource pool of a VM and its owner (the cluster) and the parent of a host
+# (the cluster or standalone compute resource) are reached by traversal in the same call
+PROPERTIES = {'VirtualMachine': ['name', 'guest.ipAddress', 'resourcePool', 'customValue'],
+              'HostSystem': ['name', 'parent', 'customValue'],
+              'ResourcePool': ['name', 'owner'],
+              'ComputeResource': ['name'],
+              'CustomFieldsManager': ['field']}
+
+def objkeys(event):
+    """
+    Returns:
+        list -- (type, managed object id) of the VM (data.Vm.Vm.Value) and the host (data.Host.Host.Value) of the event
+    """
+    return [(objtype, ref.value) for objtype, ref in (('VirtualMachine', event.vm), ('HostSystem', event.host))
+            if ref is not None and ref.value]
+
+def details(found, keys):
+    """
+    PagerDuty custom_details of the attributes looked up for the VM and the host of an event (keys as returned by
+    objkeys), custom attributes of the VM come before the ones of the host
+
+    Returns:
+        dict -- Cluster, ResourcePool, GuestIP and the custom attributes, only the ones known
+    """
+    bytype = dict((key[0], found.get(key) or {}) for key in keys)
+    vm, host = bytype.get('VirtualMachine', {}), bytype.get('HostSystem', {})
+    added = {'Cluster': vm.get('cluster') or host.get('cluster'),
+             'ResourcePool': vm.get('resource_pool'),
+             'GuestIP': vm.get('guest_ip')}
+    added = dict((name, value) for name, value in added.items() if value)
+    for attributes in (vm.get('attributes'), host.get('attributes')):
+        for name, value in (attributes or {}).items():
+            added.setdefault(name, value)
+    return added
+
+class EnrichmentCache:
+    """
+    EnrichmentCache keeps the attributes looked up per object for ttl seconds. At most max_entries objects
+    are kept, the least recently used ones are dropped first.
+    """
+
+    def __init__(self, ttl=300, max_entries=4096):
+        """
+        Arguments:
+            ttl {float} -- seconds the attributes of an object are served from memory
+            max_entries {int} -- objects remembered at most
+        """
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.entries = OrderedDict() # (vCenter, type, id) -> (time looked up, attributes)
+
+    def get(self, key):
+        """
+        Returns:
+            dict -- attributes of key, None if not cached or expired
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= self.ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, attributes):
+        self.entries[key] = (time.monotonic(), attributes)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+class Enricher:
+    """
+    Enricher looks up the attributes of the VM and the host of an event for the incident. Cached objects are
+    answered from memory, the others are looked up by a background thread: the objects of all events waiting
+    for a lookup go into one call of lookup, events for an object already being looked up wait for that call.
+    An event waits at most budget seconds and goes out with what is known by then, a late lookup still fills
+    the cache for the next events. After a failed lookup, or when events ran out of budget stall_limit times in a
+    row (a vCenter that does not answer), no lookups are made for backoff seconds.
+    """
+
+    def __init__(self, lookup, ttl=300, max_entries=4096, budget=0.5, backoff=30, stall_limit=3):
+        """
+        Arguments:
+            lookup {function} -- lookup(vcenter, keys) returns {(type, id): attributes} for the vcenter config and
+                                 the list of (type, id), objects not found are left out
+            ttl {float} -- seconds the attributes of an object are cached
+            max_entries {int} -- objects cached at most
+            budget {float} -- seconds an event waits for its lookup
+            backoff {float} -- seconds without lookups after a lookup failed
+            stall_limit {int} -- events in a row waiting in vain for their lookup, counted as a failed lookup
+        """
+        self.lookup = lookup
+        self.cache = EnrichmentCache(ttl, max_entries)
+        self.budget = budget
+        self.backoff = backoff
+        self.futures = {} # (vCenter, type, id) -> Future of the lookup, until it is done
+        self.waiting = OrderedDict() # (vCenter, type, id) -> vcenter config, not taken by the thread yet
+        self.failed = None # time of the last failed lookup
+        self.stall_limit = max(1, stall_limit)
+        self.stalled = 0 # events in a row that ran out of budget since the last lookup finished
+        self.thread = None
+        self.cond = threading.Condition()
+        self.counts = dict.fromkeys(('hits', 'misses', 'lookups', 'objects', 'timeouts', 'errors', 'skipped'), 0)
+
+    def enrich(self, vcenter, keys):
+        """
+        Arguments:
+            vcenter {dict} -- vcenter section of pdconfig: server, user, password
+            keys {list} -- (type, id) of the objects
+
+        Returns:
+            dict -- (type, id) -> attributes of the objects known within the budget
+        """
+        deadline = time.monotonic() + self.budget
+        server = vcenter['server']
+        found, pending = {}, {}
+        with self.cond:
+            for key in keys:
+                attributes = self.cache.get((server,) + key)
+                if attributes is not None:
+                    self.counts['hits'] += 1
+                    found[key] = attributes
+                    continue
+                self.counts['misses'] += 1
+                future = self.futures.get((server,) + key)
+                if future is None:
+                    if self.failed is not None and time.monotonic() - self.failed < self.backoff:
+                        self.counts['skipped'] += 1
+                        continue
+                    future = self.futures[(server,) + key] = Future()
+                    self.waiting[(server,) + key] = vcenter
+                pending[key] = future
+            if self.waiting:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run, name='pdenrich', daemon=True)
+                    self.thread.start()
+                self.cond.notify()
+        timeouts = 0
+        for key, future in pending.items():
+            try:
+                attributes = future.result(timeout=max(0, deadline - time.monotonic()))
+            except FutureTimeout:
+                timeouts += 1
+                continue
+            except Exception:
+                continue # counted once by the thread
+            if attributes:
+                found[key] = attributes
+        if timeouts:
+            with self.cond:
+                self.counts['timeouts'] += timeouts
+                self.stalled += 1
+                if self.stalled >= self.stall_limit:
+                    # the lookup hangs, new objects are not queued behind it until the backoff is over
+                    self.failed = time.monotonic()
+        return found
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.waiting:
+                    self.cond.wait()
+                batch, self.waiting = self.waiting, OrderedDict()
+            groups = OrderedDict() # objects of the same vCenter are looked up together
+            for key, vcenter in batch.items():
+                groups.setdefault(key[0], (vcenter, []))[1].append(key[1:])
+            for server, (vcenter, keys) in groups.items():
+                self.resolve(server, vcenter, keys)
+
+    def resolve(self, server, vcenter, keys):
+        try:
+            found = self.lookup(vcenter, keys)
+        except Exception as err:
+            with self.cond:
+                self.counts['errors'] += 1
+                self.failed = time.monotonic()
+                self.stalled = 0
+                futures = [self.futures.pop((server,) + key) for key in keys]
+            for future in futures:
+                future.set_exception(err)
+            return
+        with self.cond:
+            self.counts['lookups'] += 1
+            self.counts['objects'] += len(keys)
+            self.failed = None
+            self.stalled = 0
+            futures = []
+            for key in keys:
+                attributes = found.get(key) or {} # not found, eg. a deleted VM, is not looked up again until it expires
+                self.cache.put((server,) + key, attributes)
+                futures.append((self.futures.pop((server,) + key), attributes))
+        for future, attributes in futures:
+            future.set_result(attributes)
+
+    def stats(self):
+        with self.cond:
+            stats = dict(self.counts)
+            stats['cached'] = len(self.cache)
+        return stats
+
+class VSphereLookup:
+    """
+    VSphereLookup fetches cluster, resource pool, guest IP and custom attributes (eg. Owner) of VMs and hosts with
+    a single RetrievePropertiesEx call per batch, the vCenter session is kept for the next batches
+    """
+
+    def __init__(self, attributes=None, timeout=10, smart_connect=None):
+        """
+        Arguments:
+            attributes {list} -- names of the custom attributes added to the incident, all when empty
+            timeout {float} -- seconds the login and every call may wait for vCenter to connect or answer
+            smart_connect {function} -- logs in, pyVim.connect.SmartConnect by default
+        """
+        self.attributes = set(attributes or ())
+        self.timeout = timeout
+        self.smart_connect = smart_connect
+        self.sessions = {} # (server, user, password) -> ServiceInstance
+        self.lock = threading.Lock() # lookups run on the thread of the Enricher, the lock only guards the sessions
+
+    def __call__(self, vcenter, keys):
+        """
+        Raises:
+            IOError, vim.fault.InvalidLogin -- login failed
+            vmodl.MethodFault -- the lookup failed
+        """
+        login = (vcenter['server'], vcenter['user'], vcenter['password'])
+        for attempt in range(2):
+            si = self.session(login, vcenter)
+            try:
+                return self.retrieve(si.content, keys)
+            except vim.fault.NotAuthenticated:
+                # the session expired, logged in again once
+                with self.lock:
+                    self.sessions.pop(login, None)
+                if attempt:
+                    raise
+
+    def session(self, login, vcenter):
+        with self.lock:
+            si = self.sessions.get(login)
+        if si is not None:
+            return si
+        kwargs = {'httpConnectionTimeout': self.timeout}
+        if vcenter.get('insecure_ssl'):
+            import ssl # only needed for the login, not imported at startup (see velazy.py)
+            sslContext = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            sslContext.check_hostname = False
+            sslContext.verify_mode = ssl.CERT_NONE
+            kwargs['sslContext'] = sslContext
+        si = (self.smart_connect or connect.SmartConnect)(host=login[0], user=login[1], pwd=login[2], **kwargs)
+        with self.lock:
+            self.sessions[login] = si
+        return si
+
+    def retrieve(self, content, keys):
+        """
+        Returns:
+            dict -- (type, id) -> attributes of the objects found
+        """
+        keys = list(keys)
+        collector = content.propertyCollector
+        while keys:
+            try:
+                result = collector.RetrievePropertiesEx([filter_spec(content, keys)],
+                                                        vmodl.query.PropertyCollector.RetrieveOptions())
+                break
+            except vmodl.fault.ManagedObjectNotFound as err:
+                # one object is gone (eg. a deleted VM), the others are looked up again without it
+                missing = [key for key in keys if key[1] == moid(err.obj)]
+                if not missing:
+                    raise
+                keys = [key for key in keys if key not in missing]
+        else:
+            return {}
+        objects = {}
+        while result:
+            for obj in result.objects:
+                objects[obj.obj._moId] = dict((prop.name, prop.val) for prop in obj.propSet)
+            if not result.token:
+                break
+            result = collector.ContinueRetrievePropertiesEx(result.token)
+        return self.attributesof(keys, objects, content)
+
+    def attributesof(self, keys, objects, content):
+        manager = content.customFieldsManager
+        fields = {}
+        if manager is not None:
+            fields = dict((field.key, field.name) for field in objects.get(manager._moId, {}).get('field') or [])
+        found = {}
+        for key in keys:
+            props = objects.get(key[1])
+            if props is None:
+                continue
+            attributes = {}
+            if key[0] == 'VirtualMachine':
+                pool = objects.get(moid(props.get('resourcePool')), {})
+                attributes['resource_pool'] = pool.get('name')
+                attributes['cluster'] = objects.get(moid(pool.get('owner')), {}).get('name')
+                attributes['guest_ip'] = props.get('guest.ipAddress')
+            else:
+                attributes['cluster'] = objects.get(moid(props.get('parent')), {}).get('name')
+            custom = {}
+            for value in props.get('customValue') or []:
+                name = fields.get(value.key)
+                if name is not None and (not self.attributes or name in self.attributes):
+                    custom[name] = getattr(value, 'value', None)
+            attributes['attributes'] = custom
+            found[key] = attributes
+        return found
+
+def moid(ref):
+    return ref._moId if ref is not None else None
+
+def filter_spec(content, keys):
+    """
+    FilterSpec selecting the properties of the VMs and hosts of keys, their resource pools and clusters and the
+    custom attribute definitions
+    """
+    PC = vmodl.query.PropertyCollector
+    stub = content.propertyCollector._stub
+    to_owner = PC.TraversalSpec(name='poolOwner', type=vim.ResourcePool, path='owner', skip=False)
+    to_pool = PC.TraversalSpec(name='vmPool', type=vim.VirtualMachine, path='resourcePool', skip=False, selectSet=[to_owner])
+    to_parent = PC.TraversalSpec(name='hostParent', type=vim.HostSystem, path='parent', skip=False)
+    objects = []
+    for objtype, value in keys:
+        if objtype == 'VirtualMachine':
+            objects.append(PC.ObjectSpec(obj=vim.VirtualMachine(value, stub), skip=False, selectSet=[to_pool]))
+        elif objtype == 'HostSystem':
+            objects.append(PC.ObjectSpec(obj=vim.HostSystem(value, stub), skip=False, selectSet=[to_parent]))
+    if content.customFieldsManager is not None:
+        objects.append(PC.ObjectSpec(obj=content.customFieldsManager, skip=False))
+    props = [PC.PropertySpec(type=getattr(vim, objtype), pathSet=paths, all=False) for objtype, paths in PROPERTIES.items()]
+    return PC.FilterSpec(objectSet=objects, propSet=props)
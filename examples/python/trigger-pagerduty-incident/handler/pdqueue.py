@@ -0,0 +1,323 @@
+import json, os, random, threading, time, uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    from .velazy import lazy
+except ImportError:
+    from velazy import lazy
+
+# only needed once a queue is started or a Retry-After date is parsed, see velazy.py
+asyncio = lazy('asyncio')
+emailutils = lazy('email.utils')
+
+class Retry(Exception):
+    """raised by the send function for deliveries worth retrying (429, 5xx, connection errors)"""
+
+    def __init__(self, message, after=None):
+        """
+        Arguments:
+            message {str} -- reason of the failure
+            after {float} -- seconds to wait as requested by the server (Retry-After), None to back off exponentially
+        """
+        super().__init__(message)
+        self.after = after
+
+class QueueFull(Exception):
+    """raised by submit when max_depth events are waiting for delivery"""
+
+def retryafter(value):
+    """
+    Parses a Retry-After header, either seconds or an HTTP date
+
+    Returns:
+        float -- seconds to wait, None if value is empty or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, emailutils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+class Item:
+    __slots__ = ('id', 'obj', 'future', 'queued', 'attempts')
+
+    def __init__(self, id, obj):
+        self.id = id
+        self.obj = obj
+        self.future = Future()
+        self.queued = time.monotonic()
+        self.attempts = 0
+
+class Spool:
+    """
+    Spool is an append-only file of the events not delivered yet, one JSON record per line:
+    {"add": id, "obj": event} when an event is queued and {"done": id} when it is delivered or given up.
+    Events added but not done are queued again when the process restarts.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+
+    def recover(self):
+        """
+        Reads the events left by a previous process and compacts the file to just these
+
+        Returns:
+            list -- (id, event) tuples not delivered yet
+        """
+        pending = {}
+        try:
+            with open(self.path, 'r') as spool:
+                for line in spool:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue #torn write of a crashed process
+                    if 'add' in record:
+                        pending[record['add']] = record['obj']
+                    else:
+                        pending.pop(record.get('done'), None)
+        except FileNotFoundError:
+            pass
+        with self.lock:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as spool:
+                for id, obj in pending.items():
+                    spool.write(json.dumps({'add': id, 'obj': obj}) + '\n')
+            os.replace(tmp, self.path)
+            self.file = open(self.path, 'a')
+        return list(pending.items())
+
+    def add(self, id, obj):
+        self.write({'add': id, 'obj': obj})
+
+    def done(self, id):
+        self.write({'done': id})
+
+    def truncate(self):
+        """drops all records, called when no event is waiting for delivery"""
+        with self.lock:
+            if self.file is not None and self.file.tell() > 0:
+                self.file.truncate(0)
+                self.file.seek(0)
+
+    def write(self, record):
+        with self.lock:
+            if self.file is not None:
+                self.file.write(json.dumps(record) + '\n')
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+class DeliveryQueue:
+    """
+    DeliveryQueue delivers events in the background with a bounded queue served by asyncio workers on their own
+    event loop thread. Deliveries failing with Retry are retried with exponential backoff, a Retry-After of the
+    server pauses all workers for that time, so a rate-limited integration is not hammered by the other workers.
+    """
+
+    def __init__(self, send, workers=2, max_depth=1000, max_retries=8, base_delay=0.5, max_delay=60, spool=None):
+        """
+        Arguments:
+            send {callable} -- delivers one event, blocking, returns the result or raises Retry (or any other exception for permanent failures)
+            workers {int} -- events delivered concurrently
+            max_depth {int} -- events queued at most, submit raises QueueFull beyond
+            max_retries {int} -- retries per event before it is given up
+            base_delay {float} -- seconds before the first retry, doubled for every further retry
+            max_delay {float} -- seconds between retries at most, also caps Retry-After
+            spool {str} -- path of the spool file, None keeps the queue in memory only
+        """
+        self.send = send
+        self.workers = max(1, workers)
+        self.max_depth = max_depth
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.spool = Spool(spool) if spool else None
+        self.lock = threading.Lock()
+        self.loop = None
+        self.queue = None
+        self.paused_until = 0.0
+        self.depth = 0
+        self.in_flight = 0
+        self.delivered = 0
+        self.failed = 0
+        self.retries = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=1000)
+
+    def start(self):
+        """starts the event loop thread and the workers, events left in the spool are queued again"""
+        with self.lock:
+            if self.loop is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            self.depth = 0 #events of a stopped loop are gone or back from the spool
+            ready = threading.Event()
+            threading.Thread(target=self.run, args=(ready, self.loop, self.executor), name='pdqueue', daemon=True).start()
+            ready.wait()
+            if self.spool:
+                for id, obj in self.spool.recover():
+                    self.depth += 1
+                    self.loop.call_soon_threadsafe(self.queue.put_nowait, Item(id, obj))
+
+    def run(self, ready, loop, executor):
+        asyncio.set_event_loop(loop)
+        self.queue = queue = asyncio.Queue()
+        workers = [loop.create_task(self.worker(queue)) for _ in range(self.workers)]
+        loop.call_soon(ready.set)
+        loop.run_forever()
+        for worker in workers:
+            worker.cancel()
+        loop.run_until_complete(asyncio.gather(*workers, return_exceptions=True))
+        loop.close()
+        executor.shutdown(wait=False)
+
+    def stop(self):
+        """stops the workers, events not delivered stay in the spool"""
+        with self.lock:
+            loop, self.loop = self.loop, None
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        if self.spool:
+            self.spool.close()
+
+    def submit(self, obj):
+        """
+        Queues an event for delivery
+
+        Arguments:
+            obj {dict} -- event, must be JSON serializable when a spool is used
+
+        Returns:
+            Future -- resolved with the result of send, or the exception of the last attempt
+
+        Raises:
+            QueueFull -- max_depth events are already waiting
+        """
+        self.start()
+        item = Item(uuid.uuid4().hex, obj)
+        with self.lock:
+            if self.depth >= self.max_depth:
+                self.rejected += 1
+                raise QueueFull(f'{self.depth} events waiting for delivery')
+            self.depth += 1
+            if self.spool:
+                self.spool.add(item.id, obj)
+            loop, queue = self.loop, self.queue
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+        return item.future
+
+    async def worker(self, queue):
+        while True:
+            item = await queue.get()
+            try:
+                await self.deliver(item)
+            finally:
+                queue.task_done()
+
+    async def deliver(self, item):
+        while True:
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            with self.lock:
+                self.in_flight += 1
+            try:
+                result = await self.call(item.obj)
+            except Retry as err:
+                retry = err
+            except Exception as err:
+                self.finish(item, err, failed=True)
+                return
+            else:
+                self.finish(item, result)
+                return
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+
+            item.attempts += 1
+            if item.attempts > self.max_retries:
+                self.finish(item, retry, failed=True)
+                return
+            delay = self.backoff(item.attempts, retry.after)
+            with self.lock:
+                self.retries += 1
+                if retry.after is not None:
+                    self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            await asyncio.sleep(delay)
+
+    def call(self, obj):
+        # like loop.run_in_executor, but a send finishing after stop() doesn't touch the closed loop
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+
+        def done(future):
+            try:
+                loop.call_soon_threadsafe(resolve, future)
+            except RuntimeError:
+                pass #stopped meanwhile, the event stays in the spool
+
+        def resolve(future):
+            if waiter.cancelled():
+                return
+            if future.exception() is not None:
+                waiter.set_exception(future.exception())
+            else:
+                waiter.set_result(future.result())
+
+        self.executor.submit(self.send, obj).add_done_callback(done)
+        return waiter
+
+    def backoff(self, attempt, after):
+        if after is not None:
+            return min(after, self.max_delay)
+        delay = min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+        return delay / 2 + random.uniform(0, delay / 2) #jitter, so retries of a storm don't arrive together
+
+    def finish(self, item, result, failed=False):
+        with self.lock:
+            self.depth -= 1
+            if failed:
+                self.failed += 1
+            else:
+                self.delivered += 1
+                self.latencies.append(time.monotonic() - item.queued)
+            if self.spool:
+                # truncated under the queue lock, so no event is added to the spool in between
+                self.spool.done(item.id)
+                if self.depth == 0:
+                    self.spool.truncate()
+        if failed:
+            item.future.set_exception(result)
+        else:
+            item.future.set_result(result)
+
+    def stats(self):
+        """
+        Returns:
+            dict -- queue depth, events in flight, delivered/failed/retried/rejected counters and the delivery latency
+                    (queued to delivered, including retries) of the last 1000 events in ms
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {'depth': self.depth, 'in_flight': self.in_flight, 'delivered': self.delivered, 'failed': self.failed,
+                     'retries': self.retries, 'rejected': self.rejected}
+        for name, q in (('p50', 0.5), ('p95', 0.95), ('max', 1.0)):
+            stats[f'latency_{name}_ms'] = round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 1) if latencies else None
+        return stats
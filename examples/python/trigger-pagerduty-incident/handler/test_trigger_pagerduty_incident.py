@@ -0,0 +1,476 @@
+import sys, importlib.util, io, json, os, subprocess, time, tempfile, threading, unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pyVmomi import vim, vmodl
+
+sys.modules.pop('handler', None) #every example function has a handler module, make sure this one is loaded
+import handler
+import pddedup
+import pdenrich
+import pdqueue
+import vebatch
+import vefilter
+
+EVENT = '{"id":"453120cd-3d19-4c43-aadc-df0cdbce3887","source":"https://vcsa.pdotk.local/sdk","specversion":"1.0","type":"com.vmware.event.router/event","subject":"VmPoweredOnEvent","time":"2020-04-13T23:46:10.402531287Z","data":{"Key":7441,"ChainId":7438,"CreatedTime":"2020-04-13T23:46:09.387283Z","UserName":"Administrator","Datacenter":{"Name":"PKLAB","Datacenter":{"Type":"Datacenter","Value":"datacenter-3"}},"ComputeResource":{"Name":"esxi01.pdotk.local","ComputeResource":{"Type":"ComputeResource","Value":"domain-s29"}},"Host":{"Name":"esxi01.pdotk.local","Host":{"Type":"HostSystem","Value":"host-31"}},"Vm":{"Name":"Test VM","Vm":{"Type":"VirtualMachine","Value":"vm-33"}},"Ds":null,"Net":null,"Dvs":null,"FullFormattedMessage":"Test VM on esxi01.pdotk.local in PKLAB has powered on","ChangeTag":"","Template":false},"datacontenttype":"application/json"}'
+
+def event(vm='vm-33', subject='VmPoweredOnEvent'):
+    cevent = json.loads(EVENT)
+    cevent['subject'] = subject
+    cevent['data']['Vm']['Vm']['Value'] = vm
+    return json.dumps(cevent)
+
+class EventsAPI(BaseHTTPRequestHandler):
+    """Keep-alive HTTP server standing in for the PagerDuty Events API v2, counts connections and records bodies.
+    The status codes in fail, optionally (status, Retry-After) tuples, are answered before accepting events again"""
+    protocol_version = 'HTTP/1.1'
+    connections = 0
+    bodies = []
+    fail = []
+    attempts = []
+
+    def setup(self):
+        super().setup()
+        EventsAPI.connections += 1
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        EventsAPI.attempts.append(time.monotonic())
+        headers = {}
+        if EventsAPI.fail:
+            status = EventsAPI.fail.pop(0)
+            if isinstance(status, tuple):
+                status, headers['Retry-After'] = status
+            reply = b'{"status":"error","message":"failed"}'
+        else:
+            EventsAPI.bodies.append(body)
+            status = 202
+            reply = json.dumps({'status': 'success', 'message': 'Event processed', 'dedup_key': body['dedup_key']}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(reply)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, format, *args):
+        pass
+
+class EventsAPITest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), EventsAPI)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        EventsAPI.connections = 0
+        EventsAPI.bodies = []
+        EventsAPI.fail = []
+        EventsAPI.attempts = []
+
+        fd, self.config = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.writeconfig('trigger')
+        patches = [mock.patch.object(handler, 'PAGERDUTY_API_PATH', f'http://127.0.0.1:{self.server.server_port}/v2/enqueue'),
+                   mock.patch.object(handler, 'PD_CONFIG', self.config),
+                   mock.patch.object(handler, 'WARM_PROCESS', True),
+                   mock.patch.object(handler, 'SESSION', None),
+                   mock.patch.object(handler, 'CONFIG_CACHE', handler.ConfigCache()),
+                   mock.patch.object(handler, 'DEDUP', pddedup.DedupTable(60)),
+                   mock.patch.object(handler, 'QUEUE', None)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        if handler.SESSION is not None:
+            handler.SESSION.close()
+        self.server.shutdown()
+        self.server.server_close()
+        os.remove(self.config)
+
+    def writeconfig(self, action):
+        with open(self.config, 'w') as configfile:
+            json.dump({'routing_key': 'R0UT1NGK3Y', 'event_action': action}, configfile)
+
+class DispatcherTest(EventsAPITest):
+
+    def test_warm_process_reuses_connection(self):
+        for i in range(5):
+            res = json.loads(handler.handle(event(f'vm-{i}')))
+            self.assertEqual(res['status'], '200', res['message'])
+        self.assertEqual(len(EventsAPI.bodies), 5)
+        self.assertEqual(EventsAPI.connections, 1)
+        self.assertEqual(EventsAPI.bodies[0]['dedup_key'], 'https://vcsa.pdotk.local/sdk|VmPoweredOnEvent|vm-0')
+
+    def test_config_reloaded_when_changed(self):
+        handler.handle(event('vm-1'))
+        self.writeconfig('resolve')
+        os.utime(self.config, ns=(0, os.stat(self.config).st_mtime_ns + 1000000))
+        handler.handle(event('vm-2'))
+        self.assertEqual([body['event_action'] for body in EventsAPI.bodies], ['trigger', 'resolve'])
+
+    def test_flapping_vm_coalesced(self):
+        for _ in range(10):
+            for subject in ('VmPoweredOnEvent', 'VmPoweredOffEvent'):
+                res = json.loads(handler.handle(event('vm-33', subject)))
+                self.assertEqual(res['status'], '200', res['message'])
+        self.assertEqual([body['payload']['class'] for body in EventsAPI.bodies], ['VmPoweredOnEvent', 'VmPoweredOffEvent'])
+
+        # outside the window the event is sent again
+        with mock.patch.object(pddedup.time, 'monotonic', return_value=pddedup.time.monotonic() + 61):
+            handler.handle(event('vm-33'))
+        self.assertEqual(len(EventsAPI.bodies), 3)
+
+    def test_failed_event_not_coalesced(self):
+        EventsAPI.fail = [500]
+        res = json.loads(handler.handle(event()))
+        self.assertEqual(res['status'], '500')
+        res = json.loads(handler.handle(event()))
+        self.assertEqual(res['status'], '200', res['message'])
+        self.assertEqual(len(EventsAPI.bodies), 1)
+
+    def test_null_user_and_time_sent(self):
+        cevent = json.loads(EVENT)
+        cevent['data']['UserName'] = cevent['data']['CreatedTime'] = None
+        res = json.loads(handler.handle(json.dumps(cevent)))
+        self.assertEqual(res['status'], '200', res['message'])
+        self.assertIsNone(EventsAPI.bodies[0]['payload']['custom_details']['user'])
+        del cevent['data']['UserName']
+        res = json.loads(handler.handle(json.dumps(cevent)))
+        self.assertEqual(res['status'], '400')
+        self.assertIn('UserName', res['message'])
+
+    def test_stage_timings_trailer(self):
+        stream = io.StringIO()
+        with mock.patch.multiple(handler.TIMINGS, enabled=True, warm=False, stream=stream):
+            handler.handle(event())
+            handler.handle('{"id":')
+        trailers = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(list(trailers[0]['stages_ms']), ['filter', 'decode', 'config', 'body', 'dispatch', 'total'])
+        self.assertEqual(list(trailers[1]['stages_ms']), ['filter', 'decode', 'total'])
+
+    def test_filtered_event_not_decoded(self):
+        with mock.patch.object(handler, 'FILTER', vefilter.EventFilter(['VmPoweredOnEvent'], require=['data.Vm', 'data.Host'])), \
+             mock.patch.object(handler, 'decode', side_effect=AssertionError('decoded')):
+            for req in (event(subject='UserLogoutSessionEvent'), EVENT.replace('"Vm":{"Name":"Test VM","Vm":{"Type":"VirtualMachine","Value":"vm-33"}}', '"Vm":null')):
+                res = json.loads(handler.handle(req))
+                self.assertEqual(res['status'], '200')
+                self.assertTrue(res['message'].startswith('Event filtered out >'), res['message'])
+        self.assertEqual(EventsAPI.bodies, [])
+
+    def test_ndjson_batch_shares_session(self):
+        handler.WARM_PROCESS = False
+        batch = '\n'.join([event(f'vm-{i}') for i in range(6)] + ['{"id":', event('vm-0')]) + '\n'
+        results = [json.loads(line) for line in handler.handle(batch).splitlines()]
+        self.assertEqual([res['status'] for res in results], ['200'] * 6 + ['400', '200'])
+        self.assertIn('Coalesced', results[-1]['message'])
+        self.assertEqual(len(EventsAPI.bodies), 6)
+        self.assertLessEqual(EventsAPI.connections, vebatch.CONCURRENCY) #one session, its pool is shared by the events in flight
+        self.assertFalse(handler.WARM_PROCESS)
+        self.assertIsNone(handler.SESSION)
+
+class DeliveryQueueTest(EventsAPITest):
+
+    def setUp(self):
+        super().setUp()
+        handler.QUEUE = self.queue()
+
+    def queue(self, **kwargs):
+        settings = dict(workers=2, max_depth=10, max_retries=3, base_delay=0.01)
+        settings.update(kwargs)
+        queue = pdqueue.DeliveryQueue(handler.queuesend, **settings)
+        self.addCleanup(queue.stop)
+        return queue
+
+    def test_rate_limit_honors_retry_after(self):
+        EventsAPI.fail = [(429, '1')]
+        res = json.loads(handler.handle(event()))
+        self.assertEqual(res['status'], '200', res['message'])
+        self.assertEqual(len(EventsAPI.bodies), 1)
+        self.assertGreaterEqual(EventsAPI.attempts[1] - EventsAPI.attempts[0], 0.95)
+        stats = handler.QUEUE.stats()
+        self.assertEqual((stats['depth'], stats['delivered'], stats['retries'], stats['failed']), (0, 1, 1, 0))
+        self.assertGreaterEqual(stats['latency_max_ms'], 950)
+
+    def test_empty_body_rejected(self):
+        for req in ('', ' \n'):
+            res = json.loads(handler.handle(req))
+            self.assertEqual(res['status'], '400', res['message'])
+        self.assertEqual(handler.QUEUE.stats()['delivered'], 0)
+
+    def test_server_errors_retried(self):
+        EventsAPI.fail = [500, 503, 502]
+        res = json.loads(handler.handle(event()))
+        self.assertEqual(res['status'], '200', res['message'])
+        self.assertEqual(handler.QUEUE.stats()['retries'], 3)
+
+    def test_retries_exhausted(self):
+        EventsAPI.fail = [503] * 4
+        res = json.loads(handler.handle(event()))
+        self.assertEqual(res['status'], '500')
+        self.assertEqual(handler.QUEUE.stats()['failed'], 1)
+        self.assertEqual(len(handler.DEDUP), 0)
+
+    def test_rejected_event_not_retried(self):
+        EventsAPI.fail = [400]
+        res = json.loads(handler.handle(event()))
+        self.assertEqual(res['status'], '500')
+        self.assertEqual(len(EventsAPI.attempts), 1)
+
+    def test_slow_delivery_answered_with_202(self):
+        EventsAPI.fail = [(429, '1')]
+        with mock.patch.object(handler, 'RESPONSE_TIMEOUT', 0.1):
+            res = json.loads(handler.handle(event()))
+        self.assertEqual(res['status'], '202', res['message'])
+        deadline = time.monotonic() + 5
+        while handler.QUEUE.stats()['delivered'] == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(EventsAPI.bodies), 1)
+
+    def test_queue_bounded(self):
+        handler.QUEUE = self.queue(workers=1, max_depth=1)
+        EventsAPI.fail = [(429, '1')]
+        with mock.patch.object(handler, 'RESPONSE_TIMEOUT', 0.1):
+            first = json.loads(handler.handle(event('vm-1')))
+            second = json.loads(handler.handle(event('vm-2')))
+        self.assertEqual((first['status'], second['status']), ('202', '503'))
+        self.assertEqual(handler.QUEUE.stats()['rejected'], 1)
+
+    def test_spool_survives_restart(self):
+        spool = os.path.join(tempfile.mkdtemp(), 'spool')
+        EventsAPI.fail = [(503, '30')]
+        handler.QUEUE = self.queue(spool=spool)
+        with mock.patch.object(handler, 'RESPONSE_TIMEOUT', 0.2):
+            res = json.loads(handler.handle(event()))
+        self.assertEqual(res['status'], '202')
+        handler.QUEUE.stop()
+        self.assertEqual(EventsAPI.bodies, [])
+
+        # a new warm process sends the spooled event when the handler is loaded, before any event arrives
+        url = handler.PAGERDUTY_API_PATH
+        post = handler.requests.Session.post
+        env = {'warm_process': 'true', 'queue_spool': spool, 'enrich_budget': '0', 'metrics_port': '0'}
+        with mock.patch.dict(os.environ, env), \
+             mock.patch.object(handler.requests.Session, 'post', lambda session, _, **kwargs: post(session, url, **kwargs)):
+            spec = importlib.util.spec_from_file_location('restarted', handler.__file__)
+            restarted = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(restarted)
+            self.addCleanup(restarted.QUEUE.stop)
+            deadline = time.monotonic() + 5
+            while restarted.QUEUE.stats()['delivered'] == 0 and time.monotonic() < deadline:
+                time.sleep(0.05)
+        self.assertEqual([body['payload']['component'] for body in EventsAPI.bodies], ['Test VM'])
+        restarted.QUEUE.stop()
+        with open(spool) as spoolfile:
+            self.assertEqual(spoolfile.read(), '')
+
+    def test_retry_after_parsed(self):
+        self.assertEqual(pdqueue.retryafter('7'), 7)
+        self.assertAlmostEqual(pdqueue.retryafter(time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(time.time() + 30))), 30, delta=2)
+        self.assertIsNone(pdqueue.retryafter('soon'))
+
+class DedupTableTest(unittest.TestCase):
+
+    def test_keys_bounded(self):
+        table = pddedup.DedupTable(60, max_keys=3)
+        for key in 'abcd':
+            self.assertEqual(table.claim(key), 0)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.claim('a'), 0) #dropped as least recently sent
+        self.assertEqual(table.claim('d'), 1)
+        self.assertEqual(table.claim('d'), 2)
+
+class FakeVCenter:
+    """Stand-in stub for the property collector of vCenter: walks the ObjectSpecs and TraversalSpecs of a
+    RetrievePropertiesEx call over the objects in props and returns the properties selected by the PropertySpecs"""
+
+    def __init__(self):
+        self.calls = []
+        self.expired = False
+        self.logins = 0
+        self.props = {}
+        self.add(vim.ClusterComputeResource, 'domain-c7', name='Cluster-01')
+        self.add(vim.ResourcePool, 'resgroup-8', name='Production', owner=self.ref(vim.ClusterComputeResource, 'domain-c7'))
+        self.add(vim.HostSystem, 'host-31', name='esxi01.pdotk.local', parent=self.ref(vim.ClusterComputeResource, 'domain-c7'),
+                 customValue=[vim.CustomFieldsManager.StringValue(key=102, value='Rack 4')])
+        for i in range(50):
+            self.add(vim.VirtualMachine, f'vm-{i}', name=f'VM {i}', resourcePool=self.ref(vim.ResourcePool, 'resgroup-8'),
+                     customValue=[vim.CustomFieldsManager.StringValue(key=101, value=f'team-{i % 3}'),
+                                  vim.CustomFieldsManager.StringValue(key=103, value='secret')],
+                     **{'guest.ipAddress': f'10.0.0.{i}'})
+        self.add(vim.CustomFieldsManager, 'CustomFieldsManager', field=[vim.CustomFieldsManager.FieldDef(key=key, name=name)
+                 for key, name in ((101, 'Owner'), (102, 'Location'), (103, 'Password'))])
+        self.content = vim.ServiceInstanceContent(propertyCollector=vim.PropertyCollector('propertyCollector', self),
+                                                  customFieldsManager=self.ref(vim.CustomFieldsManager, 'CustomFieldsManager'))
+
+    def ref(self, objtype, moid):
+        return objtype(moid, self)
+
+    def add(self, objtype, moid, **props):
+        # property values are typed, lists become arrays of their item type
+        self.props[moid] = (objtype, dict((name, type(val[0]).Array(val) if isinstance(val, list) else val)
+                                          for name, val in props.items()))
+
+    def connect(self, **kwargs):
+        self.logins += 1
+        self.expired = False
+        return vim.ServiceInstance('ServiceInstance', self)
+
+    def InvokeAccessor(self, mo, info):
+        return self.content
+
+    def InvokeMethod(self, mo, info, args):
+        PC = vmodl.query.PropertyCollector
+        self.calls.append(info.wsdlName)
+        if self.expired:
+            raise vim.fault.NotAuthenticated()
+        spec = args[0][0]
+        selected = {}
+        def walk(obj, selectSet):
+            if obj._moId not in self.props:
+                raise vmodl.fault.ManagedObjectNotFound(obj=obj)
+            selected[obj._moId] = obj
+            for traversal in selectSet or []:
+                if isinstance(obj, traversal.type):
+                    walk(self.props[obj._moId][1][traversal.path], traversal.selectSet)
+        for objspec in spec.objectSet:
+            walk(objspec.obj, objspec.selectSet)
+        objects = []
+        for moid, obj in selected.items():
+            objtype, props = self.props[moid]
+            paths = [path for propspec in spec.propSet if issubclass(objtype, propspec.type) for path in propspec.pathSet]
+            objects.append(PC.ObjectContent(obj=obj, propSet=[vmodl.DynamicProperty(name=path, val=props[path])
+                                                              for path in paths if path in props]))
+        return PC.RetrieveResult(objects=objects)
+
+class EnrichmentTest(EventsAPITest):
+
+    def setUp(self):
+        super().setUp()
+        self.vcenter = FakeVCenter()
+        self.lookup = pdenrich.VSphereLookup(['Owner', 'Location'], smart_connect=self.vcenter.connect)
+        self.enricher = pdenrich.Enricher(self.lookup, budget=2)
+        patch = mock.patch.object(handler, 'ENRICHER', self.enricher)
+        patch.start()
+        self.addCleanup(patch.stop)
+        with open(self.config, 'w') as configfile:
+            json.dump({'routing_key': 'R0UT1NGK3Y', 'event_action': 'trigger',
+                       'vcenter': {'server': 'vcsa.pdotk.local', 'user': 'pd', 'password': 'pd'}}, configfile)
+
+    def test_incident_enriched_repeats_from_cache(self):
+        for subject in ('VmPoweredOnEvent', 'VmPoweredOffEvent'):
+            res = json.loads(handler.handle(event('vm-4', subject)))
+            self.assertEqual(res['status'], '200', res['message'])
+        details = EventsAPI.bodies[0]['payload']['custom_details']
+        self.assertEqual({name: details[name] for name in ('Cluster', 'ResourcePool', 'GuestIP', 'Owner', 'Location')},
+                         {'Cluster': 'Cluster-01', 'ResourcePool': 'Production', 'GuestIP': '10.0.0.4', 'Owner': 'team-1',
+                          'Location': 'Rack 4'})
+        self.assertNotIn('Password', details) #only the custom attributes asked for
+        self.assertEqual(EventsAPI.bodies[1]['payload']['custom_details'], details)
+        self.assertEqual(self.vcenter.calls, ['RetrievePropertiesEx']) #VM and host in one call, the second event from memory
+        self.assertEqual(self.enricher.stats(),
+                         {'hits': 2, 'misses': 2, 'lookups': 1, 'objects': 2, 'timeouts': 0, 'errors': 0, 'skipped': 0, 'cached': 2})
+
+    def test_concurrent_events_share_lookup(self):
+        started, release = threading.Event(), threading.Event()
+        lookup = self.enricher.lookup
+        def slow(vcenter, keys):
+            started.set()
+            release.wait(5)
+            return lookup(vcenter, keys)
+        self.enricher.lookup = slow
+        vcenter = {'server': 'vcsa.pdotk.local', 'user': 'pd', 'password': 'pd'}
+        first = threading.Thread(target=self.enricher.enrich, args=(vcenter, [('VirtualMachine', 'vm-0')]))
+        first.start()
+        started.wait(5)
+        # events arriving while the lookup of vm-0 runs are looked up together in the next call
+        threads = [threading.Thread(target=self.enricher.enrich, args=(vcenter, [('VirtualMachine', f'vm-{i % 20}'), ('HostSystem', 'host-31')]))
+                   for i in range(40)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while len(self.enricher.futures) < 21 and time.monotonic() < deadline: #vm-0 to vm-19 and host-31
+            time.sleep(0.01)
+        release.set()
+        for thread in threads + [first]:
+            thread.join()
+        self.assertEqual(self.vcenter.calls, ['RetrievePropertiesEx'] * 2)
+        self.assertEqual(self.enricher.stats()['objects'], 21)
+
+    def test_slow_vcenter_within_budget(self):
+        self.enricher.budget = 0.05
+        release = threading.Event()
+        lookup = self.enricher.lookup
+        self.enricher.lookup = lambda vcenter, keys: release.wait(5) and lookup(vcenter, keys)
+        start = time.monotonic()
+        res = json.loads(handler.handle(event('vm-7')))
+        self.assertEqual(res['status'], '200', res['message'])
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertNotIn('Cluster', EventsAPI.bodies[0]['payload']['custom_details'])
+        self.assertEqual(self.enricher.stats()['timeouts'], 2)
+
+        # the late lookup fills the cache for the next event
+        release.set()
+        deadline = time.monotonic() + 5
+        while self.enricher.stats()['lookups'] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        handler.handle(event('vm-7', 'VmPoweredOffEvent'))
+        self.assertEqual(EventsAPI.bodies[1]['payload']['custom_details']['Owner'], 'team-1')
+
+    def test_failed_lookup_backs_off(self):
+        self.vcenter.connect = mock.Mock(side_effect=OSError('connection refused'))
+        self.lookup.smart_connect = self.vcenter.connect
+        for i in range(3):
+            res = json.loads(handler.handle(event(f'vm-{i}')))
+            self.assertEqual(res['status'], '200', res['message'])
+            self.assertNotIn('Cluster', EventsAPI.bodies[i]['payload']['custom_details'])
+        self.assertEqual(self.vcenter.connect.call_count, 1)
+        stats = self.enricher.stats()
+        self.assertEqual((stats['errors'], stats['skipped']), (1, 4))
+
+    def test_hanging_vcenter_backs_off(self):
+        self.enricher.budget = 0.02
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.enricher.lookup = lambda vcenter, keys: release.wait(5) and {}
+        vcenter = {'server': 'vcsa.pdotk.local', 'user': 'pd', 'password': 'pd'}
+        for i in range(10):
+            self.assertEqual(self.enricher.enrich(vcenter, [('VirtualMachine', f'vm-{i}')]), {})
+        # after 3 events waited in vain no more objects are queued behind the hanging lookup
+        stats = self.enricher.stats()
+        self.assertEqual((stats['timeouts'], stats['skipped']), (3, 7))
+        self.assertEqual(len(self.enricher.futures), 3)
+
+    def test_login_timeout_and_ssl_not_imported_on_start(self):
+        connect = mock.Mock(side_effect=self.vcenter.connect)
+        lookup = pdenrich.VSphereLookup(timeout=7, smart_connect=connect)
+        lookup({'server': 'vcsa.pdotk.local', 'user': 'pd', 'password': 'pd', 'insecure_ssl': True}, [('HostSystem', 'host-31')])
+        self.assertEqual(connect.call_args.kwargs['httpConnectionTimeout'], 7)
+        self.assertIn('sslContext', connect.call_args.kwargs)
+        check = 'import sys, handler; print("ssl" in sys.modules)'
+        imported = subprocess.run([sys.executable, '-c', check], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        self.assertEqual(imported, 'False')
+
+    def test_session_renewed_and_deleted_vm(self):
+        vcenter = {'server': 'vcsa.pdotk.local', 'user': 'pd', 'password': 'pd'}
+        self.assertIn(('VirtualMachine', 'vm-1'), self.enricher.enrich(vcenter, [('VirtualMachine', 'vm-1')]))
+        self.vcenter.expired = True
+        found = self.enricher.enrich(vcenter, [('VirtualMachine', 'vm-gone'), ('VirtualMachine', 'vm-2')])
+        self.assertEqual(self.vcenter.logins, 2)
+        self.assertEqual(found[('VirtualMachine', 'vm-2')]['cluster'], 'Cluster-01')
+        self.assertNotIn(('VirtualMachine', 'vm-gone'), found)
+
+    def test_cache_lru_and_ttl(self):
+        cache = pdenrich.EnrichmentCache(ttl=60, max_entries=2)
+        cache.put('a', {'cluster': 'A'})
+        cache.put('b', {'cluster': 'B'})
+        cache.get('a')
+        cache.put('c', {'cluster': 'C'})
+        self.assertIsNone(cache.get('b')) #least recently used
+        self.assertEqual(cache.get('a'), {'cluster': 'A'})
+        with mock.patch.object(pdenrich.time, 'monotonic', return_value=pdenrich.time.monotonic() + 61):
+            self.assertIsNone(cache.get('c'))
+        self.assertEqual(len(cache), 1)
+
+if __name__ == '__main__':
+    unittest.main()